@@ -5,6 +5,29 @@ Client models for InvoiceFlow
 import uuid
 from django.db import models
 from django.conf import settings
+from django.db.models.functions import Coalesce
+
+ZERO = models.Value(0, output_field=models.DecimalField(max_digits=12, decimal_places=2))
+
+
+class ClientQuerySet(models.QuerySet):
+    """QuerySet for Client model"""
+
+    def with_totals(self):
+        """Annotate the totals of get_total_invoiced() and friends in one grouped query"""
+        return self.annotate(
+            total_invoiced=Coalesce(models.Sum('invoices__total_amount'), ZERO),
+            total_paid=Coalesce(
+                models.Sum('invoices__total_amount', filter=models.Q(invoices__status='PAID')), ZERO
+            ),
+            total_outstanding=Coalesce(
+                models.Sum(
+                    'invoices__total_amount',
+                    filter=~models.Q(invoices__status__in=['PAID', 'CANCELLED'])
+                ),
+                ZERO
+            ),
+        )
 
 
 class Client(models.Model):
@@ -25,6 +48,8 @@ class Client(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ClientQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Client'
         verbose_name_plural = 'Clients'
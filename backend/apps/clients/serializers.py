@@ -7,7 +7,7 @@ from .models import Client
 
 
 class ClientSerializer(serializers.ModelSerializer):
-    """Serializer for Client model"""
+    """Serializer for Client model; reads totals annotated by with_totals() when present"""
 
     total_invoiced = serializers.SerializerMethodField()
     total_paid = serializers.SerializerMethodField()
@@ -24,15 +24,18 @@ class ClientSerializer(serializers.ModelSerializer):
 
     def get_total_invoiced(self, obj):
         """Get total amount invoiced to this client"""
-        return float(obj.get_total_invoiced())
+        total = getattr(obj, 'total_invoiced', None)
+        return float(obj.get_total_invoiced() if total is None else total)
 
     def get_total_paid(self, obj):
         """Get total amount paid by this client"""
-        return float(obj.get_total_paid())
+        total = getattr(obj, 'total_paid', None)
+        return float(obj.get_total_paid() if total is None else total)
 
     def get_total_outstanding(self, obj):
         """Get total outstanding amount from this client"""
-        return float(obj.get_total_outstanding())
+        total = getattr(obj, 'total_outstanding', None)
+        return float(obj.get_total_outstanding() if total is None else total)
 
 
 class ClientCreateUpdateSerializer(serializers.ModelSerializer):
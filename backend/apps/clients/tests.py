@@ -1,3 +1,28 @@
-from django.test import TestCase
+"""
+Query budget tests for the client API
+"""
 
-# Create your tests here.
+from apps.monitoring.testing import QueryBudgetTestCase
+
+
+class ClientQueryBudgetTests(QueryBudgetTestCase):
+    """Clients are listed with their totals in a single query"""
+
+    def test_list(self):
+        self.assertBudget('get', '/api/clients/', queries=2, size=9 * 1024)
+
+    def test_retrieve(self):
+        self.assertBudget('get', lambda account: f'/api/clients/{account.client.pk}/', queries=1, size=1024)
+
+    def test_create(self):
+        self.assertBudget('post', '/api/clients/', queries=1, size=1024, status=201, data={
+            'name': 'New Client', 'email': 'new@example.com', 'company_name': 'New Co'
+        })
+
+    def test_update(self):
+        self.assertBudget('patch', lambda account: f'/api/clients/{account.client.pk}/', queries=2, size=1024,
+                          data={'notes': 'Prefers email'})
+
+    def test_destroy(self):
+        self.assertBudget('delete', lambda account: f'/api/clients/{account.idle_client.pk}/', queries=5, size=0,
+                          status=204)
@@ -26,7 +26,7 @@ class ClientViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """Return clients for the current user only"""
-        return Client.objects.filter(user=self.request.user)
+        return Client.objects.filter(user=self.request.user).with_totals()
 
     def get_serializer_class(self):
         """Use different serializers for different actions"""
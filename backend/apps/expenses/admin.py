@@ -3,7 +3,7 @@ Admin configuration for Expense model
 """
 
 from django.contrib import admin
-from .models import Expense
+from .models import Expense, ExpenseCategoryRule, ReceiptUpload
 
 
 @admin.register(Expense)
@@ -13,14 +13,42 @@ class ExpenseAdmin(admin.ModelAdmin):
     list_display = ['description', 'amount', 'category', 'expense_date', 'vendor', 'tax_deductible', 'user', 'created_at']
     list_filter = ['category', 'tax_deductible', 'expense_date', 'created_at']
     search_fields = ['description', 'vendor', 'notes']
-    readonly_fields = ['id', 'created_at', 'updated_at']
+    readonly_fields = [
+        'id', 'receipt_thumbnail', 'receipt_web', 'receipt_width', 'receipt_height',
+        'receipt_size', 'receipt_processed_at', 'created_at', 'updated_at'
+    ]
     ordering = ['-expense_date', '-created_at']
 
     fieldsets = (
         (None, {'fields': ('id', 'user')}),
         ('Expense Details', {'fields': ('description', 'amount', 'category', 'expense_date', 'vendor')}),
-        ('Receipt', {'fields': ('receipt',)}),
+        ('Receipt', {'fields': (
+            'receipt', 'receipt_thumbnail', 'receipt_web', 'receipt_width',
+            'receipt_height', 'receipt_size', 'receipt_processed_at'
+        )}),
         ('Tax Info', {'fields': ('tax_deductible',)}),
         ('Additional Info', {'fields': ('notes',)}),
         ('Timestamps', {'fields': ('created_at', 'updated_at')}),
     )
+
+
+@admin.register(ExpenseCategoryRule)
+class ExpenseCategoryRuleAdmin(admin.ModelAdmin):
+    """Admin for ExpenseCategoryRule model"""
+
+    list_display = ['__str__', 'user', 'category', 'tax_deductible', 'priority', 'is_active']
+    list_filter = ['category', 'is_active']
+    search_fields = ['name', 'vendor_pattern', 'description_pattern', 'user__email']
+    readonly_fields = ['id', 'created_at', 'updated_at']
+    ordering = ['user', 'priority']
+
+
+@admin.register(ReceiptUpload)
+class ReceiptUploadAdmin(admin.ModelAdmin):
+    """Admin for ReceiptUpload model"""
+
+    list_display = ['filename', 'user', 'status', 'received_size', 'total_size', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['filename', 'sha256', 'user__email']
+    readonly_fields = ['id', 'received_size', 'receipt', 'sha256', 'created_at', 'updated_at']
+    ordering = ['-created_at']
@@ -0,0 +1,88 @@
+"""
+Expense categorization engine for InvoiceFlow
+
+A user's ExpenseCategoryRule rows are compiled into a single regular
+expression. Each rule becomes one alternative made of zero-width lookaheads
+over a ``vendor<US>description`` key, so one ``match()`` call evaluates the
+rules in priority order and ``lastgroup`` names the first rule that applies.
+
+Patterns are case-insensitive, match anywhere in the field, and treat ``*``
+as a wildcard for any run of characters. Everything else is literal, so
+user input can never produce a pathological regular expression.
+"""
+
+import re
+from functools import lru_cache
+
+# ASCII unit separator between the vendor and description in the match key
+SEPARATOR = '\x1f'
+
+MEMO_SIZE = 65536
+
+
+def _pattern_to_regex(pattern, any_char):
+    """Translate a wildcard pattern into a regex fragment"""
+    parts = [re.escape(part) for part in pattern.strip().split('*')]
+    return f'{any_char}*?'.join(parts)
+
+
+def _rule_to_regex(rule):
+    """Build the lookahead alternative for a single rule"""
+    lookaheads = []
+    if rule.vendor_pattern.strip():
+        vendor = _pattern_to_regex(rule.vendor_pattern, f'[^{SEPARATOR}]')
+        lookaheads.append(f'(?=[^{SEPARATOR}]*?{vendor})')
+    if rule.description_pattern.strip():
+        description = _pattern_to_regex(rule.description_pattern, '.')
+        lookaheads.append(f'(?=[^{SEPARATOR}]*{SEPARATOR}.*?{description})')
+    return ''.join(lookaheads)
+
+
+class CompiledRuleSet:
+    """Categorizes expenses against a compiled set of rules"""
+
+    def __init__(self, rules):
+        self.rules = []
+        alternatives = []
+        for rule in rules:
+            regex = _rule_to_regex(rule)
+            if not regex:
+                continue
+            alternatives.append(f'(?P<r{len(self.rules)}>{regex})')
+            self.rules.append(rule)
+
+        self._regex = (
+            re.compile('|'.join(alternatives), re.IGNORECASE | re.DOTALL)
+            if alternatives else None
+        )
+        # Card exports repeat the same merchants over and over
+        self.match = lru_cache(maxsize=MEMO_SIZE)(self._match)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _match(self, vendor, description):
+        if self._regex is None:
+            return None
+        key = f'{vendor.replace(SEPARATOR, " ")}{SEPARATOR}{description.replace(SEPARATOR, " ")}'
+        match = self._regex.match(key)
+        if match is None:
+            return None
+        return self.rules[int(match.lastgroup[1:])]
+
+    def categorize(self, vendor, description, default_category='OTHER', default_tax_deductible=True):
+        """Return (category, tax_deductible, rule) for an expense line"""
+        rule = self.match(vendor or '', description or '')
+        if rule is None:
+            return default_category, default_tax_deductible, None
+
+        tax_deductible = default_tax_deductible if rule.tax_deductible is None else rule.tax_deductible
+        return rule.category, tax_deductible, rule
+
+
+def compile_rules(user):
+    """Compile a user's active categorization rules in priority order"""
+    from .models import ExpenseCategoryRule
+
+    rules = ExpenseCategoryRule.objects.filter(user=user, is_active=True).order_by('priority', 'created_at')
+    return CompiledRuleSet(rules)
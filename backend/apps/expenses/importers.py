@@ -0,0 +1,319 @@
+"""
+Bulk expense import for InvoiceFlow
+
+Card and bank exports (CSV or OFX) are parsed as streams, one transaction
+line at a time, categorized with the user's compiled rules and inserted in
+batches. Rows are written with a single prepared INSERT and executemany(),
+which avoids building a model instance per line.
+"""
+
+import csv
+import io
+import re
+import uuid
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from apps.reports.cache import invalidate_reports
+from apps.reports.rollups import mark_dirty
+
+from .categorization import compile_rules
+from .models import Expense
+
+BATCH_SIZE = 2000
+MAX_REPORTED_ERRORS = 100
+READ_SIZE = 64 * 1024
+
+# How debits are signed: OFX always signs them negative, CSV exports vary
+DEBIT_SIGNS = ['negative', 'positive']
+
+DATE_FORMATS = ['%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y', '%m/%d/%y', '%d.%m.%Y', '%Y/%m/%d']
+
+# Accepted CSV header names for each expense field
+CSV_COLUMNS = {
+    'date': ['date', 'transaction date', 'posted date', 'posting date', 'expense_date'],
+    'description': ['description', 'memo', 'details', 'transaction description'],
+    'vendor': ['vendor', 'payee', 'merchant', 'name', 'merchant name'],
+    'amount': ['amount', 'debit', 'transaction amount', 'value'],
+    'category': ['category'],
+    'notes': ['notes', 'note'],
+}
+
+AMOUNT_CLEAN_RE = re.compile(r'[^\d.\-]')
+OFX_TOKEN_RE = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+CATEGORY_VALUES = {value for value, _ in Expense.CATEGORY_CHOICES}
+
+
+class ImportFormatError(ValueError):
+    """Raised when a file cannot be imported at all"""
+
+
+class ImportRowError(ValueError):
+    """Raised for a line that cannot be imported"""
+
+
+def parse_amount(value):
+    """Parse amounts such as "1,234.50", "-$12.00" or "(12.00)" into a Decimal"""
+    value = (value or '').strip()
+    negative = value.startswith('(') and value.endswith(')')
+    cleaned = AMOUNT_CLEAN_RE.sub('', value.replace(',', ''))
+    if not cleaned:
+        raise ImportRowError(f'Invalid amount "{value}"')
+    try:
+        amount = Decimal(cleaned)
+    except InvalidOperation:
+        raise ImportRowError(f'Invalid amount "{value}"')
+    return -amount if negative else amount
+
+
+@lru_cache(maxsize=4096)
+def parse_date(value, date_format=None):
+    """Parse a transaction date using `date_format` or the common export formats"""
+    value = (value or '').strip()
+    for fmt in [date_format] if date_format else DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ImportRowError(f'Invalid date "{value}"')
+
+
+def iter_csv(fileobj):
+    """Yield (line_number, fields) pairs from a CSV export"""
+    reader = csv.reader(fileobj)
+    header = next(reader, None)
+    if header is None:
+        return
+
+    header = [name.strip().lower() for name in header]
+    columns = {}
+    for field, aliases in CSV_COLUMNS.items():
+        for alias in aliases:
+            if alias in header:
+                columns[field] = header.index(alias)
+                break
+    missing = {'date', 'amount'} - columns.keys()
+    if not columns.keys() & {'description', 'vendor'}:
+        missing.add('description')
+    if missing:
+        raise ImportFormatError(f'Missing required column(s): {", ".join(sorted(missing))}')
+
+    width = len(header)
+    for line_number, values in enumerate(reader, start=2):
+        if not any(values):
+            continue
+        values += [''] * (width - len(values))
+        yield line_number, {field: values[index].strip() for field, index in columns.items()}
+
+
+def iter_ofx_transactions(fileobj):
+    """Yield the fields of each <STMTTRN> in an OFX 1.x (SGML) or 2.x (XML) file"""
+    buffer = ''
+    transaction_fields = None
+
+    def tokens(text):
+        nonlocal transaction_fields
+        for closing, tag, value in OFX_TOKEN_RE.findall(text):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if closing and transaction_fields is not None:
+                    yield transaction_fields
+                    transaction_fields = None
+                elif not closing:
+                    transaction_fields = {}
+            elif transaction_fields is not None and not closing:
+                transaction_fields[tag] = value.strip()
+
+    while True:
+        chunk = fileobj.read(READ_SIZE)
+        if not chunk:
+            break
+        buffer += chunk
+        # Only tokenize up to the last '<' so no tag is split across reads
+        cut = buffer.rfind('<')
+        if cut <= 0:
+            continue
+        yield from tokens(buffer[:cut])
+        buffer = buffer[cut:]
+
+    yield from tokens(buffer)
+
+
+def iter_ofx(fileobj):
+    """Yield (transaction_number, fields) pairs for the transactions in an OFX export"""
+    for number, transaction_fields in enumerate(iter_ofx_transactions(fileobj), start=1):
+        posted = transaction_fields.get('DTPOSTED', '')
+        name = transaction_fields.get('NAME') or transaction_fields.get('PAYEE', '')
+        fitid = transaction_fields.get('FITID')
+        yield number, {
+            'date': f'{posted[:4]}-{posted[4:6]}-{posted[6:8]}',
+            'amount': transaction_fields.get('TRNAMT', ''),
+            'description': transaction_fields.get('MEMO') or name,
+            'vendor': name,
+            'notes': f'FITID {fitid}' if fitid else '',
+        }
+
+
+PARSERS = {
+    'csv': iter_csv,
+    'ofx': iter_ofx,
+}
+
+
+def build_row(fields, rules, date_format=None, debit_sign='negative'):
+    """
+    Validate and categorize parsed line fields, returning expense values,
+    or None for a credit
+    """
+    amount = parse_amount(fields.get('amount'))
+    if not amount:
+        raise ImportRowError('Amount is zero')
+    if (amount < 0) != (debit_sign == 'negative'):
+        # Credits and refunds are not expenses
+        return None
+    amount = abs(amount)
+
+    description = fields.get('description', '')
+    vendor = fields.get('vendor', '')
+    if not (description or vendor):
+        raise ImportRowError('Description is empty')
+
+    category, tax_deductible, rule = rules.categorize(vendor, description)
+    supplied_category = fields.get('category', '').upper()
+    if supplied_category in CATEGORY_VALUES:
+        category, rule = supplied_category, None
+
+    return {
+        'description': (description or vendor)[:500],
+        'vendor': vendor[:255],
+        'amount': amount,
+        'category': category,
+        'tax_deductible': tax_deductible,
+        'expense_date': parse_date(fields.get('date'), date_format),
+        'notes': fields.get('notes', ''),
+        'categorized_by_rule': rule is not None,
+    }
+
+
+class ExpenseWriter:
+    """Inserts imported expense rows for one user with executemany()"""
+
+    COLUMNS = [
+        'id', 'user', 'description', 'vendor', 'amount', 'category',
+        'tax_deductible', 'expense_date', 'notes', 'created_at', 'updated_at',
+    ]
+
+    def __init__(self, user):
+        self.connection = connections[router.db_for_write(Expense)]
+        fields = {name: Expense._meta.get_field(name) for name in self.COLUMNS}
+        quote = self.connection.ops.quote_name
+        self.sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(Expense._meta.db_table),
+            ', '.join(quote(fields[name].column) for name in self.COLUMNS),
+            ', '.join(['%s'] * len(self.COLUMNS)),
+        )
+        self.id_field = fields['id']
+        self.amount_field = fields['amount']
+        self.date_field = fields['expense_date']
+
+        now = timezone.now()
+        self.user_id = fields['user'].get_db_prep_save(user.pk, self.connection)
+        self.timestamp = fields['created_at'].get_db_prep_save(now, self.connection)
+        self._dates = {}
+
+    def prepare(self, row):
+        """Convert an expense row into database parameters"""
+        expense_date = row['expense_date']
+        prepared_date = self._dates.get(expense_date)
+        if prepared_date is None:
+            prepared_date = self._dates[expense_date] = self.date_field.get_db_prep_save(expense_date, self.connection)
+
+        return (
+            self.id_field.get_db_prep_save(uuid.uuid4(), self.connection),
+            self.user_id,
+            row['description'],
+            row['vendor'],
+            self.amount_field.get_db_prep_save(row['amount'], self.connection),
+            row['category'],
+            row['tax_deductible'],
+            prepared_date,
+            row['notes'],
+            self.timestamp,
+            self.timestamp,
+        )
+
+    def write(self, params):
+        with self.connection.cursor() as cursor:
+            cursor.executemany(self.sql, params)
+
+
+def import_expenses(user, uploaded_file, file_format, date_format=None, debit_sign='negative', dry_run=False):
+    """
+    Import expenses from a CSV or OFX file for `user`.
+
+    Only debits are imported: amounts signed as `debit_sign`, which for
+    OFX is always negative. Credits are counted but not imported. Lines
+    are categorized by the user's rules unless the file supplies a valid
+    category. Invalid lines are skipped and reported. With `dry_run`
+    nothing is written.
+    """
+    if file_format != 'csv':
+        date_format = None
+        debit_sign = 'negative'
+
+    rules = compile_rules(user)
+    writer = ExpenseWriter(user)
+    text = io.TextIOWrapper(uploaded_file, encoding='utf-8-sig', errors='replace', newline='')
+    rows = PARSERS[file_format](text)
+
+    summary = {
+        'created': 0,
+        'credits': 0,
+        'skipped': 0,
+        'categorized': 0,
+        'by_category': {},
+        'errors': [],
+    }
+    batch = []
+    # Raw inserts skip model signals, so report rollups and caches are updated here
+    imported_dates = set()
+
+    def flush():
+        if batch and not dry_run:
+            writer.write(batch)
+        batch.clear()
+
+    with transaction.atomic(using=writer.connection.alias):
+        for line_number, fields in rows:
+            try:
+                row = build_row(fields, rules, date_format, debit_sign)
+            except ImportRowError as exc:
+                summary['skipped'] += 1
+                if len(summary['errors']) < MAX_REPORTED_ERRORS:
+                    summary['errors'].append({'line': line_number, 'error': str(exc)})
+                continue
+            if row is None:
+                summary['credits'] += 1
+                continue
+
+            if row['categorized_by_rule']:
+                summary['categorized'] += 1
+            summary['created'] += 1
+            summary['by_category'][row['category']] = summary['by_category'].get(row['category'], 0) + 1
+
+            batch.append(writer.prepare(row))
+            imported_dates.add(row['expense_date'])
+            if len(batch) >= BATCH_SIZE:
+                flush()
+
+        flush()
+        if not dry_run:
+            mark_dirty(user.pk, imported_dates)
+            invalidate_reports(user.pk)
+
+    return summary
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.6 on 2026-10-19 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='receipt_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='receipt_processed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='receipt_size',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, help_text='Original receipt size in bytes', null=True),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='receipt_thumbnail',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='receipts/thumbnails/'),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='receipt_web',
+            field=models.ImageField(blank=True, editable=False, help_text='Compressed, EXIF-stripped copy used by list endpoints', null=True, upload_to='receipts/web/'),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='receipt_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.0.6 on 2026-10-19 07:45
+
+import apps.expenses.storage
+import django.core.validators
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0003_receipt_derivatives'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='expense',
+            name='receipt',
+            field=models.FileField(blank=True, help_text='Receipt image or PDF, stored under its content hash', max_length=255, null=True, storage=apps.expenses.storage.get_receipt_storage, upload_to=apps.expenses.storage.receipt_upload_to, validators=[django.core.validators.FileExtensionValidator(['jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'heif', 'pdf'])]),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='receipt_thumbnail',
+            field=models.ImageField(blank=True, editable=False, max_length=255, null=True, storage=apps.expenses.storage.get_receipt_storage, upload_to=apps.expenses.storage.receipt_thumbnail_upload_to),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='receipt_web',
+            field=models.ImageField(blank=True, editable=False, help_text='Compressed, EXIF-stripped copy used by list endpoints', max_length=255, null=True, storage=apps.expenses.storage.get_receipt_storage, upload_to=apps.expenses.storage.receipt_web_upload_to),
+        ),
+        migrations.CreateModel(
+            name='ReceiptUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('total_size', models.PositiveBigIntegerField(help_text='Expected file size in bytes')),
+                ('received_size', models.PositiveBigIntegerField(default=0, help_text='Bytes received so far')),
+                ('status', models.CharField(choices=[('IN_PROGRESS', 'In Progress'), ('COMPLETE', 'Complete')], default='IN_PROGRESS', max_length=20)),
+                ('receipt', models.FileField(blank=True, max_length=255, null=True, storage=apps.expenses.storage.get_receipt_storage, upload_to=apps.expenses.storage.receipt_upload_to)),
+                ('sha256', models.CharField(blank=True, max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='receipt_uploads', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Receipt Upload',
+                'verbose_name_plural': 'Receipt Uploads',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', 'status'], name='expenses_re_user_id_9066ba_idx'), models.Index(fields=['status', 'updated_at'], name='expenses_re_status_4234b9_idx')],
+            },
+        ),
+    ]
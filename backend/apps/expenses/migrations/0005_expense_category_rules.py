@@ -0,0 +1,39 @@
+# Generated by Django 5.0.6 on 2026-10-19 07:47
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0004_content_addressed_receipts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseCategoryRule',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('vendor_pattern', models.CharField(blank=True, help_text='Case-insensitive text to find in the vendor; * matches anything', max_length=255)),
+                ('description_pattern', models.CharField(blank=True, help_text='Case-insensitive text to find in the description; * matches anything', max_length=255)),
+                ('priority', models.PositiveIntegerField(default=100, help_text='Rules with lower priority are tried first')),
+                ('is_active', models.BooleanField(default=True)),
+                ('category', models.CharField(choices=[('OFFICE_SUPPLIES', 'Office Supplies'), ('TRAVEL', 'Travel'), ('MEALS', 'Meals & Entertainment'), ('SOFTWARE', 'Software & Subscriptions'), ('EQUIPMENT', 'Equipment'), ('MARKETING', 'Marketing & Advertising'), ('PROFESSIONAL_SERVICES', 'Professional Services'), ('UTILITIES', 'Utilities'), ('RENT', 'Rent'), ('INSURANCE', 'Insurance'), ('TAXES', 'Taxes'), ('OTHER', 'Other')], max_length=50)),
+                ('tax_deductible', models.BooleanField(blank=True, help_text='Leave empty to keep the default', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expense_rules', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Expense Category Rule',
+                'verbose_name_plural': 'Expense Category Rules',
+                'ordering': ['priority', 'created_at'],
+                'indexes': [models.Index(fields=['user', 'is_active', 'priority'], name='expenses_ex_user_id_803a16_idx')],
+            },
+        ),
+    ]
@@ -2,9 +2,23 @@
 Expense models for InvoiceFlow
 """
 
+import os
+import shutil
 import uuid
-from django.db import models
+from django.core.validators import FileExtensionValidator
+from django.db import models, transaction
 from django.conf import settings
+from django.utils import timezone
+from .storage import (
+    PartialUploadFile,
+    get_receipt_storage,
+    receipt_upload_to,
+    receipt_thumbnail_upload_to,
+    receipt_web_upload_to,
+)
+
+RECEIPT_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'heif', 'pdf']
+UPLOAD_BLOCK_SIZE = 64 * 1024
 
 
 class Expense(models.Model):
@@ -35,7 +49,26 @@ class Expense(models.Model):
     expense_date = models.DateField()
 
     # Receipt
-    receipt = models.ImageField(upload_to='receipts/', null=True, blank=True)
+    receipt = models.FileField(
+        upload_to=receipt_upload_to, storage=get_receipt_storage, max_length=255, null=True, blank=True,
+        validators=[FileExtensionValidator(RECEIPT_EXTENSIONS)],
+        help_text='Receipt image or PDF, stored under its content hash'
+    )
+    receipt_thumbnail = models.ImageField(
+        upload_to=receipt_thumbnail_upload_to, storage=get_receipt_storage, max_length=255,
+        null=True, blank=True, editable=False
+    )
+    receipt_web = models.ImageField(
+        upload_to=receipt_web_upload_to, storage=get_receipt_storage, max_length=255,
+        null=True, blank=True, editable=False,
+        help_text='Compressed, EXIF-stripped copy used by list endpoints'
+    )
+    receipt_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    receipt_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    receipt_size = models.PositiveBigIntegerField(
+        null=True, blank=True, editable=False, help_text='Original receipt size in bytes'
+    )
+    receipt_processed_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     # Additional info
     notes = models.TextField(blank=True)
@@ -60,3 +93,183 @@ class Expense(models.Model):
 
     def __str__(self):
         return f"{self.description} - {self.amount}"
+
+    def clear_receipt_derivatives(self):
+        """Delete generated receipt files and reset receipt metadata"""
+        for field_name in ('receipt_thumbnail', 'receipt_web'):
+            derivative = getattr(self, field_name)
+            if not derivative:
+                continue
+
+            # Derivatives are content-addressed, so other expenses may share them
+            shared = Expense.objects.filter(**{field_name: derivative.name}).exclude(pk=self.pk).exists()
+            if shared:
+                setattr(self, field_name, None)
+            else:
+                derivative.delete(save=False)
+
+        self.receipt_width = None
+        self.receipt_height = None
+        self.receipt_size = None
+        self.receipt_processed_at = None
+
+    def schedule_receipt_processing(self):
+        """Queue thumbnail/web derivative generation once the transaction commits"""
+        if not self.receipt:
+            return
+
+        from .tasks import process_receipt
+
+        expense_id, receipt_name = str(self.pk), self.receipt.name
+        transaction.on_commit(lambda: process_receipt.delay(expense_id, receipt_name))
+
+
+class ExpenseCategoryRule(models.Model):
+    """Maps vendor/description patterns to an expense category"""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='expense_rules')
+
+    # Matching
+    name = models.CharField(max_length=100, blank=True)
+    vendor_pattern = models.CharField(
+        max_length=255, blank=True, help_text='Case-insensitive text to find in the vendor; * matches anything'
+    )
+    description_pattern = models.CharField(
+        max_length=255, blank=True, help_text='Case-insensitive text to find in the description; * matches anything'
+    )
+    priority = models.PositiveIntegerField(default=100, help_text='Rules with lower priority are tried first')
+    is_active = models.BooleanField(default=True)
+
+    # Result
+    category = models.CharField(max_length=50, choices=Expense.CATEGORY_CHOICES)
+    tax_deductible = models.BooleanField(
+        null=True, blank=True, help_text='Leave empty to keep the default'
+    )
+
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Expense Category Rule'
+        verbose_name_plural = 'Expense Category Rules'
+        ordering = ['priority', 'created_at']
+        indexes = [
+            models.Index(fields=['user', 'is_active', 'priority']),
+        ]
+
+    def __str__(self):
+        return self.name or f"{self.vendor_pattern or self.description_pattern} -> {self.category}"
+
+
+class ReceiptUpload(models.Model):
+    """Resumable, chunked receipt upload"""
+
+    STATUS_CHOICES = [
+        ('IN_PROGRESS', 'In Progress'),
+        ('COMPLETE', 'Complete'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='receipt_uploads')
+
+    # Upload details
+    filename = models.CharField(max_length=255)
+    total_size = models.PositiveBigIntegerField(help_text='Expected file size in bytes')
+    received_size = models.PositiveBigIntegerField(default=0, help_text='Bytes received so far')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='IN_PROGRESS')
+
+    # Stored file, set once the upload is complete
+    receipt = models.FileField(
+        upload_to=receipt_upload_to, storage=get_receipt_storage, max_length=255, null=True, blank=True
+    )
+    sha256 = models.CharField(max_length=64, blank=True)
+
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Receipt Upload'
+        verbose_name_plural = 'Receipt Uploads'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'status']),
+            models.Index(fields=['status', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.filename} ({self.received_size}/{self.total_size})"
+
+    @property
+    def part_path(self):
+        """Path of the partially received file"""
+        return os.path.join(settings.RECEIPT_UPLOAD_TEMP_DIR, f'{self.pk}.part')
+
+    @property
+    def is_complete(self):
+        return self.status == 'COMPLETE'
+
+    def stage_chunk(self, stream, length):
+        """
+        Stream up to `length` bytes from `stream` to a staging file of its own.
+
+        Returns the staging file's path and how many bytes were written. No
+        database transaction is held while the client sends the chunk.
+        """
+        os.makedirs(settings.RECEIPT_UPLOAD_TEMP_DIR, exist_ok=True)
+        staged_path = os.path.join(settings.RECEIPT_UPLOAD_TEMP_DIR, f'{self.pk}.{uuid.uuid4().hex}.chunk')
+
+        written = 0
+        with open(staged_path, 'wb') as staged:
+            while written < length:
+                block = stream.read(min(UPLOAD_BLOCK_SIZE, length - written))
+                if not block:
+                    break
+                staged.write(block)
+                written += len(block)
+        return staged_path, written
+
+    def append_chunk(self, staged_path, start, length):
+        """
+        Append a staged chunk of `length` bytes at offset `start`.
+
+        The offset is advanced with a conditional UPDATE, so of concurrent
+        chunks for the same offset only one is appended. Returns whether
+        this one was.
+        """
+        with transaction.atomic():
+            claimed = ReceiptUpload.objects.filter(
+                pk=self.pk, status='IN_PROGRESS', received_size=start
+            ).update(received_size=start + length, updated_at=timezone.now())
+            if not claimed:
+                return False
+
+            with open(staged_path, 'rb') as staged, open(self.part_path, 'r+b' if start else 'wb') as part:
+                # Drop anything past the acknowledged offset
+                part.seek(start)
+                part.truncate()
+                shutil.copyfileobj(staged, part, UPLOAD_BLOCK_SIZE)
+
+        self.received_size = start + length
+        return True
+
+    def complete(self):
+        """Move the received file into content-addressed receipt storage"""
+        with open(self.part_path, 'rb') as part:
+            self.receipt.save(self.filename, PartialUploadFile(part), save=False)
+
+        self.sha256 = os.path.splitext(os.path.basename(self.receipt.name))[0]
+        self.status = 'COMPLETE'
+        self.save(update_fields=['receipt', 'sha256', 'status', 'updated_at'])
+
+        if os.path.exists(self.part_path):
+            # Left behind when the content was already stored
+            os.remove(self.part_path)
+
+    def discard(self):
+        """Delete the partial file and the upload record"""
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+        self.delete()
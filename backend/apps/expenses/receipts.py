@@ -0,0 +1,99 @@
+"""
+Receipt image processing for InvoiceFlow
+
+Phone-camera receipts are frequently 5-10 MB. These helpers produce the
+small derivatives served by list endpoints: a thumbnail and a compressed
+web copy, both re-oriented and stripped of EXIF metadata.
+"""
+
+import io
+import os
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+THUMBNAIL_SIZE = (320, 320)
+WEB_SIZE = (1600, 1600)
+JPEG_QUALITY = 80
+
+# EXIF orientations that rotate the image by 90 or 270 degrees
+EXIF_ORIENTATION_TAG = 0x0112
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+# Leading bytes of the receipt formats we accept
+RECEIPT_SIGNATURES = (
+    b'%PDF',
+    b'\xff\xd8\xff',
+    b'\x89PNG\r\n\x1a\n',
+    b'GIF87a',
+    b'GIF89a',
+)
+
+
+def is_receipt_file(header):
+    """Check the first bytes of a file against the accepted receipt formats"""
+    if header.startswith(RECEIPT_SIGNATURES):
+        return True
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return True
+    # HEIC/HEIF: ISO base media file with an image brand
+    return header[4:8] == b'ftyp' and header[8:12] in (b'heic', b'heix', b'mif1', b'msf1')
+
+
+class ReceiptNotAnImage(Exception):
+    """Raised when a receipt file cannot be decoded as an image"""
+
+
+def _to_rgb(image):
+    """Flatten transparency onto white so the image can be stored as JPEG"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+def _encode_jpeg(image):
+    """Encode an image as an optimized progressive JPEG without metadata"""
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def build_receipt_derivatives(fileobj, name):
+    """
+    Build thumbnail and web derivatives for a receipt image.
+
+    Returns a dict with ``width``/``height`` of the correctly oriented
+    original and ``thumbnail``/``web`` ContentFile objects.
+    """
+    try:
+        image = Image.open(fileobj)
+    except UnidentifiedImageError as exc:
+        raise ReceiptNotAnImage(name) from exc
+
+    with image:
+        width, height = image.size
+        if image.getexif().get(EXIF_ORIENTATION_TAG) in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+
+        # Let the JPEG decoder downscale while decoding instead of
+        # materialising the full-resolution bitmap
+        image.draft('RGB', WEB_SIZE)
+        web = _to_rgb(ImageOps.exif_transpose(image))
+
+    web.thumbnail(WEB_SIZE, Image.Resampling.LANCZOS)
+    thumbnail = web.copy()
+    thumbnail.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return {
+        'width': width,
+        'height': height,
+        'web': ContentFile(_encode_jpeg(web), name=f'{stem}_web.jpg'),
+        'thumbnail': ContentFile(_encode_jpeg(thumbnail), name=f'{stem}_thumb.jpg'),
+    }
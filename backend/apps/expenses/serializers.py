@@ -2,8 +2,12 @@
 Serializers for Expense model
 """
 
+import os
+from django.conf import settings
 from rest_framework import serializers
-from .models import Expense
+from .importers import DEBIT_SIGNS
+from .models import Expense, ExpenseCategoryRule, ReceiptUpload, RECEIPT_EXTENSIONS
+from .receipts import is_receipt_file
 
 
 class ExpenseSerializer(serializers.ModelSerializer):
@@ -13,29 +17,205 @@ class ExpenseSerializer(serializers.ModelSerializer):
         model = Expense
         fields = [
             'id', 'description', 'amount', 'category', 'expense_date',
-            'receipt', 'notes', 'vendor', 'tax_deductible',
+            'receipt', 'receipt_thumbnail', 'receipt_web', 'receipt_width',
+            'receipt_height', 'receipt_size', 'notes', 'vendor', 'tax_deductible',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = [
+            'id', 'receipt_thumbnail', 'receipt_web', 'receipt_width',
+            'receipt_height', 'receipt_size', 'created_at', 'updated_at'
+        ]
+
+
+class ExpenseListSerializer(ExpenseSerializer):
+    """
+    Serializer for expense lists
+
+    `receipt` points at the compressed web derivative instead of the
+    full-size original, falling back to the original until it is processed.
+    """
+
+    receipt = serializers.SerializerMethodField()
+
+    class Meta(ExpenseSerializer.Meta):
+        fields = [
+            'id', 'description', 'amount', 'category', 'expense_date',
+            'receipt', 'receipt_thumbnail', 'notes', 'vendor', 'tax_deductible',
+            'created_at', 'updated_at'
+        ]
+
+    def get_receipt(self, obj):
+        """Get the URL of the lightweight receipt derivative"""
+        receipt = obj.receipt_web or obj.receipt
+        if not receipt:
+            return None
+
+        request = self.context.get('request')
+        return request.build_absolute_uri(receipt.url) if request else receipt.url
 
 
 class ExpenseCreateUpdateSerializer(serializers.ModelSerializer):
     """Serializer for creating and updating expenses"""
 
+    receipt_upload = serializers.PrimaryKeyRelatedField(
+        queryset=ReceiptUpload.objects.filter(status='COMPLETE'),
+        write_only=True,
+        required=False,
+        help_text='Completed chunked upload to use as the receipt'
+    )
+
     class Meta:
         model = Expense
         fields = [
             'description', 'amount', 'category', 'expense_date',
-            'receipt', 'notes', 'vendor', 'tax_deductible'
+            'receipt', 'receipt_upload', 'notes', 'vendor', 'tax_deductible'
         ]
 
+    def validate_receipt(self, value):
+        """Validate that the receipt's content is a supported image or PDF, whatever its name"""
+        if value:
+            header = value.read(16)
+            value.seek(0)
+            if not is_receipt_file(header):
+                raise serializers.ValidationError("Uploaded file is not a supported image or PDF.")
+        return value
+
+    def validate_receipt_upload(self, value):
+        """Validate that the upload belongs to the current user"""
+        if value.user_id != self.context['request'].user.pk:
+            raise serializers.ValidationError("You don't have permission to use this upload.")
+        return value
+
+    def validate(self, attrs):
+        """Accept a receipt either as a file or as a completed upload, not both"""
+        upload = attrs.pop('receipt_upload', None)
+        if upload is not None:
+            if attrs.get('receipt'):
+                raise serializers.ValidationError({
+                    'receipt_upload': "Provide either receipt or receipt_upload, not both."
+                })
+            attrs['receipt'] = upload.receipt.name
+        return attrs
+
     def create(self, validated_data):
         """Create expense for the current user"""
         validated_data['user'] = self.context['request'].user
-        return super().create(validated_data)
+        expense = super().create(validated_data)
+        expense.schedule_receipt_processing()
+        return expense
+
+    def update(self, instance, validated_data):
+        """Update expense, regenerating receipt derivatives if the receipt changed"""
+        receipt_changed = 'receipt' in validated_data
+        if receipt_changed:
+            instance.clear_receipt_derivatives()
+
+        expense = super().update(instance, validated_data)
+
+        if receipt_changed:
+            expense.schedule_receipt_processing()
+        return expense
 
     def validate_amount(self, value):
         """Validate that amount is positive"""
         if value <= 0:
             raise serializers.ValidationError("Expense amount must be greater than zero.")
         return value
+
+
+class ReceiptUploadSerializer(serializers.ModelSerializer):
+    """Serializer for chunked receipt uploads"""
+
+    class Meta:
+        model = ReceiptUpload
+        fields = [
+            'id', 'filename', 'total_size', 'received_size', 'status',
+            'receipt', 'sha256', 'created_at', 'updated_at'
+        ]
+        read_only_fields = [
+            'id', 'received_size', 'status', 'receipt', 'sha256',
+            'created_at', 'updated_at'
+        ]
+
+    def create(self, validated_data):
+        """Start an upload for the current user"""
+        validated_data['user'] = self.context['request'].user
+        return super().create(validated_data)
+
+    def validate_filename(self, value):
+        """Validate that the file has a supported receipt extension"""
+        value = os.path.basename(value)
+        extension = os.path.splitext(value)[1].lstrip('.').lower()
+        if extension not in RECEIPT_EXTENSIONS:
+            raise serializers.ValidationError(
+                f"Unsupported receipt type. Allowed: {', '.join(RECEIPT_EXTENSIONS)}."
+            )
+        return value
+
+    def validate_total_size(self, value):
+        """Validate the announced file size"""
+        if value <= 0:
+            raise serializers.ValidationError("File size must be greater than zero.")
+        if value > settings.RECEIPT_MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError(
+                f"File size may not exceed {settings.RECEIPT_MAX_UPLOAD_SIZE} bytes."
+            )
+        return value
+
+
+class ExpenseCategoryRuleSerializer(serializers.ModelSerializer):
+    """Serializer for ExpenseCategoryRule model"""
+
+    class Meta:
+        model = ExpenseCategoryRule
+        fields = [
+            'id', 'name', 'vendor_pattern', 'description_pattern', 'priority',
+            'is_active', 'category', 'tax_deductible', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+    def create(self, validated_data):
+        """Create rule for the current user"""
+        validated_data['user'] = self.context['request'].user
+        return super().create(validated_data)
+
+    def validate(self, attrs):
+        """Validate that the rule matches on at least one field"""
+        vendor = attrs.get('vendor_pattern', getattr(self.instance, 'vendor_pattern', ''))
+        description = attrs.get('description_pattern', getattr(self.instance, 'description_pattern', ''))
+        if not (vendor.strip() or description.strip()):
+            raise serializers.ValidationError(
+                "Provide a vendor_pattern or a description_pattern."
+            )
+        return attrs
+
+
+class ExpenseImportSerializer(serializers.Serializer):
+    """Serializer for bulk expense import requests"""
+
+    FORMAT_CHOICES = ['csv', 'ofx']
+
+    file = serializers.FileField()
+    format = serializers.ChoiceField(choices=FORMAT_CHOICES, required=False)
+    date_format = serializers.CharField(
+        required=False, help_text='strptime format for CSV dates, e.g. %d/%m/%Y'
+    )
+    debit_sign = serializers.ChoiceField(
+        choices=DEBIT_SIGNS, default='negative',
+        help_text='Sign of the debits in a CSV; lines of the other sign are credits and are not imported'
+    )
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        """Infer the format from the file extension when not given"""
+        if 'format' not in attrs:
+            extension = os.path.splitext(attrs['file'].name)[1].lstrip('.').lower()
+            if extension in ('ofx', 'qfx'):
+                attrs['format'] = 'ofx'
+            elif extension in ('csv', 'txt'):
+                attrs['format'] = 'csv'
+            else:
+                raise serializers.ValidationError({
+                    'format': "Could not infer the file format, specify csv or ofx."
+                })
+        return attrs
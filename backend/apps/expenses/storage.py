@@ -0,0 +1,81 @@
+"""
+Content-addressed receipt storage for InvoiceFlow
+
+Receipts are stored under the SHA-256 of their contents inside a per-user
+directory, so uploading the same receipt twice reuses the existing file
+instead of writing a second copy.
+"""
+
+import hashlib
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_digest(content):
+    """Return the SHA-256 hex digest of a Django File, reading it in blocks"""
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for block in content.chunks(HASH_BLOCK_SIZE):
+        digest.update(block)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def receipt_upload_to(instance, filename):
+    """Place receipts in a per-user directory; the storage picks the file name"""
+    return f'receipts/{instance.user_id}/{filename}'
+
+
+def receipt_thumbnail_upload_to(instance, filename):
+    """Place receipt thumbnails in a per-user directory"""
+    return f'receipts/{instance.user_id}/thumbnails/{filename}'
+
+
+def receipt_web_upload_to(instance, filename):
+    """Place compressed receipt copies in a per-user directory"""
+    return f'receipts/{instance.user_id}/web/{filename}'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names files by content hash
+
+    ``receipts/<user>/scan.pdf`` is stored as
+    ``receipts/<user>/<h[:2]>/<h>.pdf`` where ``h`` is the SHA-256 of the
+    file. Saving content that is already stored returns the existing name.
+    """
+
+    def content_name(self, name, content):
+        """Return the content-addressed name for `content` uploaded as `name`"""
+        directory, filename = posixpath.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        digest = file_digest(content)
+        return posixpath.join(directory, digest[:2], f'{digest}{extension}')
+
+    def save(self, name, content, max_length=None):
+        name = self.content_name(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+class PartialUploadFile(File):
+    """Wraps a fully received chunked upload so storage moves it instead of copying"""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+receipt_storage = ContentAddressedStorage()
+
+
+def get_receipt_storage():
+    """Storage callable used by receipt file fields"""
+    return receipt_storage
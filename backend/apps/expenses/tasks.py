@@ -0,0 +1,67 @@
+"""
+Celery tasks for Expense management
+"""
+
+import logging
+
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Expense, ReceiptUpload
+from .receipts import ReceiptNotAnImage, build_receipt_derivatives
+
+logger = logging.getLogger(__name__)
+
+RECEIPT_FIELDS = [
+    'receipt_thumbnail', 'receipt_web', 'receipt_width', 'receipt_height',
+    'receipt_size', 'receipt_processed_at', 'updated_at',
+]
+
+
+@shared_task(ignore_result=True)
+def process_receipt(expense_id, receipt_name):
+    """Generate receipt derivatives and record the original's dimensions and size"""
+    expense = Expense.objects.filter(pk=expense_id).first()
+    if expense is None or expense.receipt.name != receipt_name:
+        # Expense deleted, or its receipt replaced after this task was queued
+        return
+
+    expense.clear_receipt_derivatives()
+
+    # Receipts are content-addressed, so an identical upload may already be processed
+    processed = Expense.objects.filter(
+        user_id=expense.user_id,
+        receipt=receipt_name,
+        receipt_processed_at__isnull=False,
+    ).exclude(pk=expense.pk).first()
+    if processed is not None:
+        for field_name in RECEIPT_FIELDS[:-1]:
+            setattr(expense, field_name, getattr(processed, field_name))
+        expense.save(update_fields=RECEIPT_FIELDS)
+        return
+
+    expense.receipt_size = expense.receipt.size
+
+    try:
+        with expense.receipt.open('rb') as receipt_file:
+            derivatives = build_receipt_derivatives(receipt_file, receipt_name)
+    except ReceiptNotAnImage:
+        logger.info('Receipt %s for expense %s is not an image, skipping derivatives', receipt_name, expense_id)
+    else:
+        expense.receipt_width = derivatives['width']
+        expense.receipt_height = derivatives['height']
+        expense.receipt_thumbnail.save(derivatives['thumbnail'].name, derivatives['thumbnail'], save=False)
+        expense.receipt_web.save(derivatives['web'].name, derivatives['web'], save=False)
+
+    expense.receipt_processed_at = timezone.now()
+    expense.save(update_fields=RECEIPT_FIELDS)
+
+
+@shared_task(ignore_result=True)
+def purge_stale_receipt_uploads():
+    """Delete chunked uploads that were abandoned before completion"""
+    cutoff = timezone.now() - settings.RECEIPT_UPLOAD_EXPIRY
+    stale = ReceiptUpload.objects.filter(status='IN_PROGRESS', updated_at__lt=cutoff)
+    for upload in stale.iterator():
+        upload.discard()
@@ -1,3 +1,329 @@
-from django.test import TestCase
+"""
+Tests for receipt uploads and processing, expense imports and query budget
+tests for the expense API
+"""
 
-# Create your tests here.
+import io
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from apps.monitoring.testing import TEST_CACHES, QueryBudgetTestCase
+from apps.users.models import User
+
+from .models import Expense, ReceiptUpload
+from .receipts import EXIF_ORIENTATION_TAG
+from .tasks import process_receipt
+
+EXIF_MAKE_TAG = 0x010F
+
+RECEIPT = b'\x89PNG\r\n\x1a\n' + bytes(1016)
+
+IMPORT_CSV = (
+    b'Date,Description,Vendor,Amount\n'
+    + b''.join(f'2024-03-{day:02d},Cloud hosting,Vendor {day % 7},{day}.99\n'.encode() for day in range(1, 29))
+)
+
+
+CARD_CSV = (
+    b'Date,Description,Amount\n'
+    b'2024-03-01,Coffee Shop,-4.50\n'
+    b'2024-03-02,Refund Coffee Shop,4.50\n'
+    b'2024-03-03,Airline,-320.00\n'
+)
+
+CARD_OFX = b"""<OFX><BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240301<TRNAMT>-4.50<NAME>Coffee Shop</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20240302<TRNAMT>4.50<NAME>Refund Coffee Shop</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240303<TRNAMT>-320.00<NAME>Airline</STMTTRN>
+</BANKTRANLIST></OFX>"""
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ExpenseImportTests(TestCase):
+    """CSV and OFX imports apply the same debit sign rule"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='x', first_name='Plain', last_name='User')
+
+    def setUp(self):
+        self.api_client = APIClient(HTTP_HOST='localhost')
+        self.api_client.force_authenticate(self.user)
+
+    def import_file(self, name, content, **params):
+        return self.api_client.post('/api/expenses/import/', {
+            'file': SimpleUploadedFile(name, content), **params
+        }, format='multipart')
+
+    def test_csv_and_ofx_of_the_same_card_agree(self):
+        for name, content in [('card.csv', CARD_CSV), ('card.ofx', CARD_OFX)]:
+            response = self.import_file(name, content)
+            self.assertEqual(response.status_code, 201, name)
+            self.assertEqual((response.data['created'], response.data['credits']), (2, 1), name)
+
+        amounts = sorted(Expense.objects.values_list('amount', flat=True))
+        self.assertEqual([str(amount) for amount in amounts], ['4.50', '4.50', '320.00', '320.00'])
+
+    def test_csv_with_positive_debits(self):
+        content = (
+            b'Date,Description,Amount\n'
+            b'2024-03-01,Coffee Shop,4.50\n'
+            b'2024-03-02,Refund Coffee Shop,-4.50\n'
+            b'2024-03-03,Airline,320.00\n'
+        )
+        response = self.import_file('card.csv', content, debit_sign='positive')
+        self.assertEqual((response.data['created'], response.data['credits']), (2, 1))
+        self.assertFalse(Expense.objects.filter(description__startswith='Refund').exists())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ReceiptUploadTests(TestCase):
+    """Receipts are checked by content, and chunks append at most once per offset"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='x', first_name='Plain', last_name='User')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, RECEIPT_UPLOAD_TEMP_DIR=f'{media_root}/uploads')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.api_client = APIClient(HTTP_HOST='localhost')
+        self.api_client.force_authenticate(self.user)
+        self.upload = ReceiptUpload.objects.create(user=self.user, filename='receipt.png', total_size=1024)
+
+    def create_expense(self, content, name):
+        return self.api_client.post('/api/expenses/', {
+            'description': 'Dinner', 'amount': '20.00', 'expense_date': str(timezone.localdate()),
+            'receipt': SimpleUploadedFile(name, content),
+        }, format='multipart')
+
+    def send_chunk(self, content, start):
+        end = start + len(content) - 1
+        return self.api_client.put(
+            f'/api/receipt-uploads/{self.upload.pk}/chunk/', content, content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/1024'
+        )
+
+    def test_receipt_file_is_checked_by_content(self):
+        response = self.create_expense(b'#!/bin/sh\necho not a receipt\n', 'receipt.png')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('receipt', response.data)
+        self.assertFalse(Expense.objects.exists())
+
+    def test_receipt_file_is_stored(self):
+        response = self.create_expense(RECEIPT, 'receipt.png')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Expense.objects.get().receipt.name.endswith('.png'))
+
+    def test_chunks_are_appended_in_order(self):
+        self.assertEqual(self.send_chunk(RECEIPT[:512], 0).status_code, 200)
+        self.assertEqual(self.send_chunk(RECEIPT[512:], 512).data['received_size'], 1024)
+        with open(self.upload.part_path, 'rb') as part:
+            self.assertEqual(part.read(), RECEIPT)
+        self.assertEqual(os.listdir(os.path.dirname(self.upload.part_path)), [os.path.basename(self.upload.part_path)])
+
+    def test_chunk_at_a_stale_offset_is_refused(self):
+        self.send_chunk(RECEIPT[:512], 0)
+        response = self.send_chunk(bytes(512), 0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['received_size'], 512)
+
+    def test_chunk_that_lost_the_race_for_its_offset_is_not_appended(self):
+        append_chunk = ReceiptUpload.append_chunk
+
+        def append_after_another_chunk(upload, staged_path, start, length):
+            # Another request appends its chunk for the same offset meanwhile
+            other = ReceiptUpload.objects.get(pk=upload.pk)
+            other_path, _ = other.stage_chunk(io.BytesIO(RECEIPT[:512]), 512)
+            self.addCleanup(os.remove, other_path)
+            self.assertTrue(append_chunk(other, other_path, start, length))
+            return append_chunk(upload, staged_path, start, length)
+
+        with mock.patch.object(ReceiptUpload, 'append_chunk', append_after_another_chunk):
+            response = self.send_chunk(bytes(512), 0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['received_size'], 512)
+        with open(self.upload.part_path, 'rb') as part:
+            self.assertEqual(part.read(), RECEIPT[:512])
+
+    def test_staging_a_chunk_leaves_the_upload_untouched(self):
+        staged_path, written = self.upload.stage_chunk(io.BytesIO(RECEIPT[:100]), 512)
+        self.addCleanup(os.remove, staged_path)
+        self.assertEqual(written, 100)
+        self.assertFalse(os.path.exists(self.upload.part_path))
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.received_size, 0)
+
+
+def rotated_jpeg():
+    """A 400x200 JPEG whose EXIF says to show it rotated a quarter turn, so 200x400"""
+    image = Image.new('RGB', (400, 200), (200, 30, 30))
+    exif = image.getexif()
+    exif[EXIF_ORIENTATION_TAG] = 6
+    exif[EXIF_MAKE_TAG] = 'Receipt Camera'
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ReceiptProcessingTests(TestCase):
+    """Receipts get upright, metadata-free derivatives, which lists link to"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='x', first_name='Plain', last_name='User')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.api_client = APIClient(HTTP_HOST='localhost')
+        self.api_client.force_authenticate(self.user)
+        self.receipt = rotated_jpeg()
+        response = self.api_client.post('/api/expenses/', {
+            'description': 'Dinner', 'amount': '20.00', 'expense_date': str(timezone.localdate()),
+            'receipt': SimpleUploadedFile('dinner.jpg', self.receipt),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.expense = Expense.objects.get()
+
+    def assertDerivative(self, field_file, size):
+        with field_file.open('rb'), Image.open(field_file) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, size)
+            self.assertEqual(dict(image.getexif()), {})
+
+    def test_derivatives_are_upright_and_stripped(self):
+        process_receipt(str(self.expense.pk), self.expense.receipt.name)
+        self.expense.refresh_from_db()
+
+        self.assertEqual((self.expense.receipt_width, self.expense.receipt_height), (200, 400))
+        self.assertEqual(self.expense.receipt_size, len(self.receipt))
+        self.assertIsNotNone(self.expense.receipt_processed_at)
+        self.assertDerivative(self.expense.receipt_web, (200, 400))
+        self.assertDerivative(self.expense.receipt_thumbnail, (160, 320))
+
+    def test_list_links_to_the_web_derivative(self):
+        response = self.api_client.get('/api/expenses/')
+        self.assertTrue(response.data['results'][0]['receipt'].endswith(self.expense.receipt.url))
+
+        process_receipt(str(self.expense.pk), self.expense.receipt.name)
+        self.expense.refresh_from_db()
+        response = self.api_client.get('/api/expenses/')
+        listed = response.data['results'][0]
+        self.assertTrue(listed['receipt'].endswith(self.expense.receipt_web.url))
+        self.assertNotIn(self.expense.receipt.url, listed['receipt'])
+        self.assertTrue(listed['receipt_thumbnail'].endswith(self.expense.receipt_thumbnail.url))
+
+
+class ExpenseQueryBudgetTests(QueryBudgetTestCase):
+    """Expenses and imports run a fixed number of queries"""
+
+    def expense_url(self, account):
+        return f'/api/expenses/{account.expense.pk}/'
+
+    def test_list(self):
+        self.assertBudget('get', '/api/expenses/', queries=2, size=8 * 1024)
+
+    def test_retrieve(self):
+        self.assertBudget('get', self.expense_url, queries=1, size=1024)
+
+    def test_create(self):
+        self.assertBudget('post', '/api/expenses/', queries=2, size=1024, status=201, data={
+            'description': 'Laptop stand', 'amount': '49.00', 'category': 'EQUIPMENT',
+            'expense_date': str(timezone.localdate()), 'vendor': 'Vendor 1',
+        })
+
+    def test_update(self):
+        self.assertBudget('patch', self.expense_url, queries=4, size=1024, data={'notes': 'Annual plan'})
+
+    def test_destroy(self):
+        self.assertBudget('delete', self.expense_url, queries=3, size=0, status=204)
+
+    def test_import(self):
+        self.assertBudget(
+            'post', '/api/expenses/import/', queries=5, size=1024, status=201, format='multipart',
+            data=lambda account: {
+                'file': SimpleUploadedFile('expenses.csv', IMPORT_CSV, content_type='text/csv'), 'debit_sign': 'positive'
+            }
+        )
+
+
+class ExpenseCategoryRuleQueryBudgetTests(QueryBudgetTestCase):
+    """Rules are plain rows of their owner"""
+
+    def rule_url(self, account):
+        return f'/api/expense-rules/{account.rule.pk}/'
+
+    def test_list(self):
+        self.assertBudget('get', '/api/expense-rules/', queries=2, size=7 * 1024)
+
+    def test_retrieve(self):
+        self.assertBudget('get', self.rule_url, queries=1, size=1024)
+
+    def test_create(self):
+        self.assertBudget('post', '/api/expense-rules/', queries=1, size=1024, status=201, data={
+            'name': 'Hosting', 'vendor_pattern': 'cloud', 'category': 'SOFTWARE',
+        })
+
+    def test_update(self):
+        self.assertBudget('patch', self.rule_url, queries=2, size=1024, data={'priority': 5})
+
+    def test_destroy(self):
+        self.assertBudget('delete', self.rule_url, queries=2, size=0, status=204)
+
+
+class ReceiptUploadQueryBudgetTests(QueryBudgetTestCase):
+    """Chunked uploads touch only the upload row"""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, RECEIPT_UPLOAD_TEMP_DIR=f'{media_root}/uploads')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload_url(self, account, suffix=''):
+        return f'/api/receipt-uploads/{account.upload.pk}/{suffix}'
+
+    def send_chunk(self, account):
+        return self.request(account, 'put', self.upload_url(account, 'chunk/'), RECEIPT,
+                            content_type='application/octet-stream', HTTP_CONTENT_RANGE='bytes 0-1023/1024')
+
+    def test_create(self):
+        self.assertBudget('post', '/api/receipt-uploads/', queries=1, size=1024, status=201, data={
+            'filename': 'dinner.jpg', 'total_size': 2048,
+        })
+
+    def test_retrieve(self):
+        self.assertBudget('get', self.upload_url, queries=1, size=1024)
+
+    def test_chunk(self):
+        self.assertBudget('put', lambda account: self.upload_url(account, 'chunk/'), queries=4, size=1024,
+                          data=RECEIPT, format=None, content_type='application/octet-stream',
+                          HTTP_CONTENT_RANGE='bytes 0-1023/1024')
+
+    def test_complete(self):
+        for account in self.accounts.values():
+            self.assertEqual(self.send_chunk(account).status_code, 200)
+        self.assertBudget('post', lambda account: self.upload_url(account, 'complete/'), queries=2, size=1024)
+
+    def test_destroy(self):
+        self.assertBudget('delete', self.upload_url, queries=2, size=0, status=204)
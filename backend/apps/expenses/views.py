@@ -2,13 +2,31 @@
 Views for Expense management
 """
 
-from rest_framework import viewsets, filters
+import os
+import re
+from django.conf import settings
+from rest_framework import viewsets, filters, mixins, status
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Expense
-from .serializers import ExpenseSerializer, ExpenseCreateUpdateSerializer
+from invoiceflow.throttling import ConcurrencyLimitMixin
+from .importers import ImportFormatError, import_expenses
+from .models import Expense, ExpenseCategoryRule, ReceiptUpload
+from .receipts import is_receipt_file
+from .serializers import (
+    ExpenseSerializer,
+    ExpenseListSerializer,
+    ExpenseCreateUpdateSerializer,
+    ExpenseCategoryRuleSerializer,
+    ExpenseImportSerializer,
+    ReceiptUploadSerializer
+)
 
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
 
-class ExpenseViewSet(viewsets.ModelViewSet):
+
+class ExpenseViewSet(ConcurrencyLimitMixin, viewsets.ModelViewSet):
     """
     ViewSet for Expense CRUD operations
 
@@ -17,6 +35,7 @@ class ExpenseViewSet(viewsets.ModelViewSet):
     retrieve: GET /api/expenses/{id}/
     update: PUT/PATCH /api/expenses/{id}/
     destroy: DELETE /api/expenses/{id}/
+    import: POST /api/expenses/import/
     """
     serializer_class = ExpenseSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -33,4 +52,177 @@ class ExpenseViewSet(viewsets.ModelViewSet):
         """Use different serializers for different actions"""
         if self.action in ['create', 'update', 'partial_update']:
             return ExpenseCreateUpdateSerializer
+        if self.action == 'list':
+            return ExpenseListSerializer
+        if self.action == 'import_expenses':
+            return ExpenseImportSerializer
         return ExpenseSerializer
+
+    def get_throttles(self):
+        """Throttle imports, and let each user run only one at a time"""
+        if self.action == 'import_expenses':
+            self.throttle_scope = 'imports'
+            self.concurrency_scope = 'imports'
+        return super().get_throttles()
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_expenses(self, request):
+        """Bulk import expenses from a CSV or OFX export"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            summary = import_expenses(
+                request.user,
+                serializer.validated_data['file'],
+                serializer.validated_data['format'],
+                date_format=serializer.validated_data.get('date_format'),
+                debit_sign=serializer.validated_data['debit_sign'],
+                dry_run=serializer.validated_data['dry_run'],
+            )
+        except ImportFormatError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        response_status = status.HTTP_200_OK if serializer.validated_data['dry_run'] else status.HTTP_201_CREATED
+        return Response(summary, status=response_status)
+
+
+class ExpenseCategoryRuleViewSet(viewsets.ModelViewSet):
+    """
+    ViewSet for expense categorization rules
+
+    list: GET /api/expense-rules/
+    create: POST /api/expense-rules/
+    retrieve: GET /api/expense-rules/{id}/
+    update: PUT/PATCH /api/expense-rules/{id}/
+    destroy: DELETE /api/expense-rules/{id}/
+    """
+    serializer_class = ExpenseCategoryRuleSerializer
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filterset_fields = ['category', 'is_active']
+    search_fields = ['name', 'vendor_pattern', 'description_pattern']
+    ordering_fields = ['priority', 'created_at']
+    ordering = ['priority', 'created_at']
+
+    def get_queryset(self):
+        """Return rules for the current user only"""
+        return ExpenseCategoryRule.objects.filter(user=self.request.user)
+
+
+class ReceiptUploadViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    ViewSet for resumable, chunked receipt uploads
+
+    create: POST /api/receipt-uploads/
+    retrieve: GET /api/receipt-uploads/{id}/
+    chunk: PUT /api/receipt-uploads/{id}/chunk/
+    complete: POST /api/receipt-uploads/{id}/complete/
+    destroy: DELETE /api/receipt-uploads/{id}/
+
+    Chunks are sent as raw request bodies with a
+    ``Content-Range: bytes <start>-<end>/<total>`` header and are streamed
+    to disk. After an interruption, the client resumes from the
+    ``received_size`` returned by ``retrieve``.
+    """
+    serializer_class = ReceiptUploadSerializer
+
+    def get_queryset(self):
+        """Return uploads for the current user only"""
+        return ReceiptUpload.objects.filter(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        instance.discard()
+
+    def _parse_content_range(self, request, upload):
+        """Return (start, length) from the Content-Range header or an error Response"""
+        match = CONTENT_RANGE_RE.match(request.headers.get('Content-Range', ''))
+        if not match:
+            return None, Response({
+                'error': 'Content-Range header of the form "bytes <start>-<end>/<total>" is required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        start, end, total = (int(group) for group in match.groups())
+        length = end - start + 1
+        if total != upload.total_size or end < start or end >= total:
+            return None, Response({
+                'error': 'Content-Range does not match the upload size'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if length > settings.RECEIPT_MAX_CHUNK_SIZE:
+            return None, Response({
+                'error': f'Chunks may not exceed {settings.RECEIPT_MAX_CHUNK_SIZE} bytes'
+            }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        if int(request.headers.get('Content-Length') or 0) != length:
+            return None, Response({
+                'error': 'Content-Length does not match Content-Range'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return (start, length), None
+
+    @action(detail=True, methods=['put'])
+    def chunk(self, request, pk=None):
+        """Append a chunk to the upload"""
+        upload = self.get_object()
+        if upload.is_complete:
+            return Response({
+                'error': 'Upload is already complete'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        chunk_range, error = self._parse_content_range(request, upload)
+        if error:
+            return error
+
+        start, length = chunk_range
+        if start != upload.received_size:
+            return self._offset_conflict(upload)
+
+        # Received outside any transaction, then appended only if no other
+        # chunk for this offset got there first
+        staged_path, written = upload.stage_chunk(request.stream, length)
+        try:
+            if written != length:
+                return Response({
+                    'error': 'Chunk was truncated',
+                    'received_size': upload.received_size
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            if not upload.append_chunk(staged_path, start, length):
+                upload.refresh_from_db(fields=['received_size', 'status'])
+                return self._offset_conflict(upload)
+        finally:
+            os.remove(staged_path)
+
+        return Response(self.get_serializer(upload).data)
+
+    def _offset_conflict(self, upload):
+        return Response({
+            'error': 'Chunk does not start at the current upload offset',
+            'received_size': upload.received_size
+        }, status=status.HTTP_409_CONFLICT)
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        """Verify the received file and store it under its content hash"""
+        upload = self.get_object()
+        if upload.is_complete:
+            return Response(self.get_serializer(upload).data)
+
+        if upload.received_size != upload.total_size:
+            return Response({
+                'error': 'Upload is incomplete',
+                'received_size': upload.received_size
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        with open(upload.part_path, 'rb') as part:
+            header = part.read(16)
+        if not is_receipt_file(header):
+            upload.discard()
+            return Response({
+                'error': 'Uploaded file is not a supported image or PDF'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        upload.complete()
+        return Response(self.get_serializer(upload).data)
@@ -6,9 +6,27 @@ import uuid
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
+from django.db.models.functions import Coalesce
 from decimal import Decimal
 
 
+class InvoiceQuerySet(models.QuerySet):
+    """QuerySet for Invoice model"""
+
+    def with_amount_paid(self):
+        """Annotate get_amount_paid() as `amount_paid`"""
+        return self.annotate(
+            amount_paid=Coalesce(
+                models.Sum('payments__amount'),
+                models.Value(Decimal('0.00'), output_field=models.DecimalField(max_digits=12, decimal_places=2))
+            )
+        )
+
+    def overdue(self):
+        """Invoices past their due date that are neither paid nor cancelled, as is_overdue()"""
+        return self.exclude(status__in=['PAID', 'CANCELLED']).filter(due_date__lt=timezone.now().date())
+
+
 class Invoice(models.Model):
     """Invoice model"""
 
@@ -47,6 +65,8 @@ class Invoice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = InvoiceQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Invoice'
         verbose_name_plural = 'Invoices'
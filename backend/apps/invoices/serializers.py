@@ -17,7 +17,7 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
 
 
 class InvoiceSerializer(serializers.ModelSerializer):
-    """Serializer for Invoice model with related items"""
+    """Serializer for Invoice model with related items; reads `amount_paid` when annotated"""
 
     items = InvoiceItemSerializer(many=True, read_only=True)
     client_details = ClientSerializer(source='client', read_only=True)
@@ -38,13 +38,17 @@ class InvoiceSerializer(serializers.ModelSerializer):
             'sent_at', 'paid_at', 'created_at', 'updated_at'
         ]
 
+    def _amount_paid(self, obj):
+        amount_paid = getattr(obj, 'amount_paid', None)
+        return obj.get_amount_paid() if amount_paid is None else amount_paid
+
     def get_amount_paid(self, obj):
         """Get total amount paid for this invoice"""
-        return float(obj.get_amount_paid())
+        return float(self._amount_paid(obj))
 
     def get_amount_due(self, obj):
         """Get remaining amount due"""
-        return float(obj.get_amount_due())
+        return float(obj.total_amount - self._amount_paid(obj))
 
     def get_is_overdue(self, obj):
         """Check if invoice is overdue"""
@@ -1,3 +1,59 @@
-from django.test import TestCase
+"""
+Query budget tests for the invoice API
+"""
 
-# Create your tests here.
+from datetime import timedelta
+
+from django.utils import timezone
+
+from apps.monitoring.testing import QueryBudgetTestCase
+
+
+def invoice_url(account, suffix=''):
+    return f'/api/invoices/{account.invoice.pk}/{suffix}'
+
+
+class InvoiceQueryBudgetTests(QueryBudgetTestCase):
+    """Invoices are listed with their items, payments and client totals in a fixed number of queries"""
+
+    def test_list(self):
+        self.assertBudget('get', '/api/invoices/', queries=4, size=35 * 1024)
+
+    def test_list_filtered(self):
+        self.assertBudget('get', '/api/invoices/?status=SENT&search=Client&ordering=-total_amount',
+                          queries=4, size=35 * 1024)
+
+    def test_retrieve(self):
+        self.assertBudget('get', invoice_url, queries=3, size=2 * 1024)
+
+    def test_create(self):
+        today = timezone.localdate()
+        self.assertBudget('post', '/api/invoices/', queries=16, size=1024, status=201, data=lambda account: {
+            'client': str(account.client.pk),
+            'issue_date': str(today),
+            'due_date': str(today + timedelta(days=30)),
+            'items': [
+                {'description': 'Design', 'quantity': '2.00', 'unit_price': '150.00'},
+                {'description': 'Hosting', 'quantity': '1.00', 'unit_price': '20.00'},
+            ],
+        })
+
+    def test_update(self):
+        self.assertBudget('patch', invoice_url, queries=8, size=1024, data={'notes': 'Call before sending'})
+
+    def test_destroy(self):
+        self.assertBudget('delete', lambda account: f'/api/invoices/{account.draft_invoice.pk}/',
+                          queries=8, size=0, status=204)
+
+    def test_send(self):
+        self.assertBudget('post', lambda account: f'/api/invoices/{account.draft_invoice.pk}/send/',
+                          queries=9, size=2 * 1024)
+
+    def test_mark_paid(self):
+        self.assertBudget('post', lambda account: invoice_url(account, 'mark_paid/'), queries=10, size=2 * 1024)
+
+    def test_cancel(self):
+        self.assertBudget('post', lambda account: invoice_url(account, 'cancel/'), queries=10, size=2 * 1024)
+
+    def test_overdue(self):
+        self.assertBudget('get', '/api/invoices/overdue/', queries=4, size=35 * 1024)
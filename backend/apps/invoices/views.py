@@ -5,7 +5,9 @@ Views for Invoice management
 from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db.models import Prefetch
 from django_filters.rest_framework import DjangoFilterBackend
+from apps.clients.models import Client
 from .models import Invoice, InvoiceItem
 from .serializers import (
     InvoiceSerializer,
@@ -33,7 +35,13 @@ class InvoiceViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """Return invoices for the current user only"""
-        return Invoice.objects.filter(user=self.request.user).select_related('client', 'user').prefetch_related('items')
+        return Invoice.objects.filter(user=self.request.user).with_amount_paid().select_related('user').prefetch_related(
+            Prefetch('client', queryset=Client.objects.with_totals()), 'items'
+        )
+
+    def _refreshed(self, invoice):
+        """Reload an invoice after an action, so the client totals include the change"""
+        return self.get_queryset().get(pk=invoice.pk)
 
     def get_serializer_class(self):
         """Use different serializers for different actions"""
@@ -46,7 +54,7 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         """Mark invoice as sent"""
         invoice = self.get_object()
         invoice.mark_as_sent()
-        serializer = self.get_serializer(invoice)
+        serializer = self.get_serializer(self._refreshed(invoice))
         return Response({
             'invoice': serializer.data,
             'message': 'Invoice marked as sent'
@@ -57,7 +65,7 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         """Mark invoice as paid"""
         invoice = self.get_object()
         invoice.mark_as_paid()
-        serializer = self.get_serializer(invoice)
+        serializer = self.get_serializer(self._refreshed(invoice))
         return Response({
             'invoice': serializer.data,
             'message': 'Invoice marked as paid'
@@ -69,7 +77,7 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         invoice = self.get_object()
         invoice.status = 'CANCELLED'
         invoice.save()
-        serializer = self.get_serializer(invoice)
+        serializer = self.get_serializer(self._refreshed(invoice))
         return Response({
             'invoice': serializer.data,
             'message': 'Invoice cancelled'
@@ -78,6 +86,7 @@ class InvoiceViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def overdue(self, request):
         """Get all overdue invoices"""
-        overdue_invoices = [inv for inv in self.get_queryset() if inv.is_overdue()]
-        serializer = self.get_serializer(overdue_invoices, many=True)
-        return Response(serializer.data)
+        queryset = self.filter_queryset(self.get_queryset().overdue())
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
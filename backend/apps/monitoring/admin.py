@@ -0,0 +1,102 @@
+"""
+Admin configuration for monitoring models
+"""
+
+from django.contrib import admin
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+from .models import RequestProfile, SlowQuery
+from .profiling import render_flame_graph
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    """Admin for RequestProfile model; profiles are created by RequestProfilerMiddleware"""
+
+    list_display = ['path', 'method', 'view_name', 'status_code', 'duration_ms', 'queries', 'peak_memory_kib', 'user', 'created_at']
+    list_filter = ['view_name', 'method', 'created_at']
+    search_fields = ['path', 'view_name', 'user__email']
+    ordering = ['-created_at']
+    readonly_fields = [
+        'id', 'user', 'method', 'path', 'view_name', 'status_code', 'duration_ms', 'queries', 'db_ms',
+        'sample_interval_ms', 'sample_count', 'flame_graph', 'peak_memory_kib', 'allocation_table', 'created_at'
+    ]
+    exclude = ['folded_stacks', 'allocations']
+
+    fieldsets = (
+        (None, {'fields': ('id', 'user', 'method', 'path', 'view_name', 'status_code', 'created_at')}),
+        ('Cost', {'fields': ('duration_ms', 'queries', 'db_ms')}),
+        ('CPU', {'fields': ('sample_interval_ms', 'sample_count', 'flame_graph')}),
+        ('Memory', {'fields': ('peak_memory_kib', 'allocation_table')}),
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                '<uuid:profile_id>/flame-graph.svg',
+                self.admin_site.admin_view(self.flame_graph_view),
+                name='monitoring_requestprofile_flame_graph',
+            ),
+        ] + super().get_urls()
+
+    def flame_graph_view(self, request, profile_id):
+        profile = get_object_or_404(RequestProfile, pk=profile_id)
+        response = HttpResponse(render_flame_graph(profile.folded_stacks), content_type='image/svg+xml')
+        response['Content-Disposition'] = f'inline; filename="profile-{profile.pk}.svg"'
+        return response
+
+    @admin.display(description='Flame graph')
+    def flame_graph(self, obj):
+        url = reverse('admin:monitoring_requestprofile_flame_graph', args=[obj.pk])
+        # Rendered from escaped frame names, so safe to inline
+        return format_html(
+            '<div style="overflow-x:auto">{}</div><a href="{}">Open as SVG</a>',
+            mark_safe(render_flame_graph(obj.folded_stacks)), url
+        )
+
+    @admin.display(description='Allocations')
+    def allocation_table(self, obj):
+        if not obj.allocations:
+            return '-'
+        rows = format_html_join(
+            '', '<tr><td>{}</td><td style="text-align:right">{}</td><td style="text-align:right">{}</td></tr>',
+            ((entry['location'], entry['size_kib'], entry['count']) for entry in obj.allocations)
+        )
+        return format_html(
+            '<table><thead><tr><th>Location</th><th>KiB</th><th>Blocks</th></tr></thead><tbody>{}</tbody></table>',
+            rows
+        )
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    """Admin for SlowQuery model; rows are maintained by the capture_slow_query task"""
+
+    list_display = ['sql_preview', 'call_site', 'view_name', 'count', 'total_ms', 'max_ms', 'last_seen']
+    list_filter = ['view_name', 'database']
+    search_fields = ['sql', 'call_site', 'view_name']
+    ordering = ['-total_ms']
+    readonly_fields = [
+        'fingerprint', 'sql', 'call_site', 'view_name', 'database', 'count', 'total_ms', 'max_ms',
+        'plan', 'plan_captured_at', 'first_seen', 'last_seen'
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='SQL')
+    def sql_preview(self, obj):
+        return obj.sql if len(obj.sql) <= 100 else obj.sql[:97] + '...'
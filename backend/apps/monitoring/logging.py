@@ -0,0 +1,24 @@
+"""
+Logging helpers for InvoiceFlow monitoring
+"""
+
+import json
+import logging
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as one JSON object per line, including `request_metrics`"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        metrics = getattr(record, 'request_metrics', None)
+        if metrics is not None:
+            entry.update(metrics)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
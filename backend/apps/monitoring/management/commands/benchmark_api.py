@@ -0,0 +1,251 @@
+"""
+Management command to benchmark API endpoints against a generated dataset
+"""
+
+import json
+import logging
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client as HttpClient, override_settings
+
+from apps.clients.models import Client
+from apps.invoices.models import Invoice
+from apps.monitoring.queries import record_queries
+from apps.reports.cache import bump_generation
+from apps.users.models import User
+from apps.users.tokens import RefreshToken
+
+BASELINE_VERSION = 1
+
+# Read-only requests, so runs do not change the dataset they measure
+ENDPOINTS = [
+    ('clients', '/api/clients/'),
+    ('client', '/api/clients/{client}/'),
+    ('invoices', '/api/invoices/'),
+    ('invoices-search', '/api/invoices/?search=GEN&ordering=-total_amount'),
+    ('invoice', '/api/invoices/{invoice}/'),
+    ('invoices-overdue', '/api/invoices/overdue/'),
+    ('payments', '/api/payments/'),
+    ('expenses', '/api/expenses/'),
+    ('expense-rules', '/api/expense-rules/'),
+    ('report-dashboard', '/api/reports/dashboard/'),
+    ('report-income', '/api/reports/income/'),
+    ('report-expenses', '/api/reports/expenses/'),
+    ('report-clients', '/api/reports/clients/'),
+    ('report-timeseries', '/api/reports/timeseries/?metric=net&bucket=week'),
+    ('report-cashflow', '/api/reports/cashflow-forecast/'),
+    ('profile', '/api/auth/user/'),
+]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks API latency, queries and allocations per endpoint, and compares runs against a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', default='gen-00000@dataset.invoiceflow.local',
+                            help='Email of the user whose data is requested (see generate_dataset)')
+        parser.add_argument('--endpoint', action='append', dest='endpoints', metavar='NAME',
+                            help='Only benchmark this endpoint; may be repeated')
+        parser.add_argument('--runs', type=int, default=50, help='Timed requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per endpoint first')
+        parser.add_argument('--alloc-runs', type=int, default=5,
+                            help='Extra requests per endpoint traced for memory allocations')
+        parser.add_argument('--cold-reports', action='store_true',
+                            help='Invalidate cached reports before each request, to time their computation')
+        parser.add_argument('--save', metavar='PATH', help='Write the results to a JSON baseline')
+        parser.add_argument('--compare', metavar='PATH', help='Compare the results with a JSON baseline')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative increase of p50, p95 or peak memory reported as a regression')
+        parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                            help='Ignore latency increases smaller than this, as noise')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError('--runs must be positive')
+
+        endpoints = ENDPOINTS
+        if options['endpoints']:
+            unknown = set(options['endpoints']) - {name for name, _ in ENDPOINTS}
+            if unknown:
+                raise CommandError(
+                    f"Unknown endpoints: {', '.join(sorted(unknown))}. "
+                    f"Choose from: {', '.join(name for name, _ in ENDPOINTS)}"
+                )
+            endpoints = [(name, path) for name, path in ENDPOINTS if name in options['endpoints']]
+
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as baseline_file:
+                    baseline = json.load(baseline_file)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read baseline {options['compare']}: {e}")
+            if baseline.get('version') != BASELINE_VERSION:
+                raise CommandError(f"Baseline {options['compare']} has an unsupported format")
+
+        user = User.objects.filter(email=options['user']).first()
+        if user is None:
+            raise CommandError(f"No user {options['user']}, create one with generate_dataset first")
+        ids = {
+            'client': Client.objects.filter(user=user).order_by('pk').values_list('pk', flat=True).first(),
+            'invoice': Invoice.objects.filter(user=user).order_by('pk').values_list('pk', flat=True).first(),
+        }
+        if None in ids.values():
+            raise CommandError(f'{user.email} has no clients or invoices to request')
+
+        http = HttpClient(
+            HTTP_HOST=settings.ALLOWED_HOSTS[0],
+            HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}',
+        )
+
+        # Without this, rate limits would turn repeated requests into 429s
+        rest_framework = dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={
+            scope: '1000000/s' for scope in settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']
+        })
+        request_logger = logging.getLogger('apps.monitoring.requests')
+        log_level = request_logger.level
+        request_logger.setLevel(logging.WARNING)
+        try:
+            with override_settings(REST_FRAMEWORK=rest_framework):
+                results = {
+                    name: self.measure(http, user, path.format(**ids), options)
+                    for name, path in endpoints
+                }
+        finally:
+            request_logger.setLevel(log_level)
+
+        self.report(results, user, options)
+
+        if options['save']:
+            with open(options['save'], 'w') as baseline_file:
+                json.dump({
+                    'version': BASELINE_VERSION,
+                    'created_at': datetime.now(dt_timezone.utc).isoformat(),
+                    'database': connection.vendor,
+                    'user': user.email,
+                    'runs': options['runs'],
+                    'endpoints': results,
+                }, baseline_file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Saved baseline to {options['save']}"))
+
+        if baseline is not None:
+            self.compare(results, baseline, options)
+
+    def request(self, http, path):
+        response = http.get(path)
+        if response.status_code != 200:
+            raise CommandError(f'GET {path} returned {response.status_code}: {response.content[:200]!r}')
+        return response
+
+    def measure(self, http, user, path, options):
+        """Time, count queries and trace allocations of one endpoint"""
+        cold_reports = options['cold_reports'] and path.startswith('/api/reports/')
+
+        def prepare():
+            if cold_reports:
+                bump_generation(user.pk)
+
+        for _ in range(options['warmup']):
+            prepare()
+            self.request(http, path)
+
+        timings = []
+        query_counts = []
+        query_timings = []
+        for _ in range(options['runs']):
+            prepare()
+            with record_queries() as queries:
+                started = time.perf_counter()
+                response = self.request(http, path)
+                timings.append((time.perf_counter() - started) * 1000)
+            query_counts.append(queries.count)
+            query_timings.append(queries.duration * 1000)
+
+        # Tracing slows requests down, so allocations are measured separately
+        peaks = []
+        if options['alloc_runs'] > 0:
+            tracemalloc.start()
+            try:
+                for _ in range(options['alloc_runs']):
+                    prepare()
+                    tracemalloc.reset_peak()
+                    before, _ = tracemalloc.get_traced_memory()
+                    self.request(http, path)
+                    _, peak = tracemalloc.get_traced_memory()
+                    peaks.append(peak - before)
+            finally:
+                tracemalloc.stop()
+
+        timings.sort()
+        return {
+            'path': path,
+            'p50_ms': round(percentile(timings, 0.50), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'p99_ms': round(percentile(timings, 0.99), 3),
+            'mean_ms': round(statistics.mean(timings), 3),
+            'queries': max(query_counts),
+            'db_ms': round(statistics.median(query_timings), 3),
+            'peak_kib': round(statistics.median(peaks) / 1024, 1) if peaks else None,
+            'bytes': len(response.content),
+        }
+
+    def report(self, results, user, options):
+        self.stdout.write(
+            f"user={user.email}  runs={options['runs']}  db={connection.vendor}"
+            f"{'  cold reports' if options['cold_reports'] else ''}"
+        )
+        self.stdout.write(
+            f"{'endpoint':<20} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} "
+            f"{'db ms':>8} {'peak KiB':>9} {'bytes':>9}"
+        )
+        for name, result in results.items():
+            peak = '-' if result['peak_kib'] is None else f"{result['peak_kib']:.1f}"
+            self.stdout.write(
+                f"{name:<20} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                f"{result['queries']:>8} {result['db_ms']:>8.2f} {peak:>9} {result['bytes']:>9}"
+            )
+
+    def compare(self, results, baseline, options):
+        """Report changes against the baseline and fail on regressions"""
+        threshold = options['threshold']
+        regressions = []
+        self.stdout.write(f"Compared with {options['compare']} ({baseline.get('created_at', 'unknown date')}):")
+
+        for name, result in results.items():
+            before = baseline['endpoints'].get(name)
+            if before is None:
+                self.stdout.write(f'{name:<20} not in baseline')
+                continue
+
+            problems = []
+            for metric in ('p50_ms', 'p95_ms'):
+                delta = result[metric] - before[metric]
+                if delta > options['min_delta_ms'] and result[metric] > before[metric] * (1 + threshold):
+                    problems.append(f'{metric} {before[metric]:.2f} -> {result[metric]:.2f}')
+            if result['queries'] > before['queries']:
+                problems.append(f"queries {before['queries']} -> {result['queries']}")
+            if result['peak_kib'] and before.get('peak_kib') and result['peak_kib'] > before['peak_kib'] * (1 + threshold):
+                problems.append(f"peak_kib {before['peak_kib']:.1f} -> {result['peak_kib']:.1f}")
+
+            change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+            if problems:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(f"{name:<20} REGRESSION  {'; '.join(problems)}"))
+            else:
+                self.stdout.write(f'{name:<20} ok  p95 {change:+.0f}%')
+
+        if regressions:
+            raise CommandError(f"{len(regressions)} endpoints regressed beyond {threshold:.0%}: {', '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS('No regressions'))
@@ -0,0 +1,242 @@
+"""
+Management command to microbenchmark model methods on the write paths
+"""
+
+import json
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.clients.models import Client
+from apps.invoices.models import Invoice, InvoiceItem
+from apps.monitoring.queries import record_queries
+from apps.payments.models import Payment
+from apps.users.models import User
+
+BATCH_SIZE = 2000
+
+
+class Rollback(Exception):
+    """Raised to discard the benchmark data"""
+
+
+class Fixtures:
+    """Benchmark rows, created in bulk so that setup stays fast at large sizes"""
+
+    def __init__(self):
+        self.user = User.objects.create_user(
+            email=f'benchmark-{uuid.uuid4().hex[:12]}@invoiceflow.local',
+            first_name='Benchmark',
+            last_name='User',
+            tax_rate=Decimal('10.00'),
+        )
+        # As authentication would load it, with decimal fields as Decimals
+        self.user.refresh_from_db()
+        self.prefix = uuid.uuid4().hex[:8]
+        self.count = 0
+
+    def client(self):
+        self.count += 1
+        return Client.objects.create(user=self.user, name=f'Client {self.count}', email=f'c{self.count}@example.com')
+
+    def invoices(self, client, size, number_format=None):
+        today = timezone.localdate()
+        statuses = ['DRAFT', 'SENT', 'PAID', 'OVERDUE', 'CANCELLED']
+        invoices = [
+            Invoice(
+                user=self.user,
+                client=client,
+                invoice_number=(number_format or f'BENCH-{self.prefix}-{client.pk.hex[:6]}-{{:07d}}').format(index + 1),
+                issue_date=today,
+                due_date=today + timedelta(days=30),
+                status=statuses[index % len(statuses)],
+                subtotal=Decimal('100.00'),
+                total_amount=Decimal('110.00'),
+            )
+            for index in range(size)
+        ]
+        return Invoice.objects.bulk_create(invoices, batch_size=BATCH_SIZE)
+
+    def invoice(self, total=Decimal('1000000.00')):
+        """A sent invoice too large to be paid off during a benchmark"""
+        client = self.client()
+        self.count += 1
+        return Invoice.objects.create(
+            user=self.user,
+            client=client,
+            invoice_number=f'BENCH-{self.prefix}-{self.count:07d}',
+            issue_date=timezone.localdate(),
+            due_date=timezone.localdate() + timedelta(days=30),
+            status='SENT',
+            sent_at=timezone.now(),
+            total_amount=total,
+        )
+
+    def items(self, invoice, size):
+        InvoiceItem.objects.bulk_create([
+            InvoiceItem(invoice=invoice, description=f'Item {index}', quantity=Decimal('1.00'),
+                        unit_price=Decimal('10.00'), amount=Decimal('10.00'), order=index)
+            for index in range(size)
+        ], batch_size=BATCH_SIZE)
+
+    def payments(self, invoice, size):
+        Payment.objects.bulk_create([
+            Payment(invoice=invoice, amount=Decimal('1.00'), payment_date=timezone.localdate())
+            for _ in range(size)
+        ], batch_size=BATCH_SIZE)
+
+
+def bench_generate_invoice_number(fixtures, size):
+    """The user already has `size` invoices numbered for this year"""
+    client = fixtures.client()
+    fixtures.user.invoices.filter(invoice_number__startswith='INV-').delete()
+    fixtures.invoices(client, size, number_format=f'INV-{timezone.now().year}-{{:05d}}')
+    invoice = Invoice(user=fixtures.user, client=client)
+    return invoice.generate_invoice_number
+
+
+def bench_calculate_totals(fixtures, size):
+    """The invoice has `size` items"""
+    invoice = fixtures.invoice()
+    fixtures.items(invoice, size)
+    return invoice.calculate_totals
+
+
+def bench_update_status(fixtures, size):
+    """Pure Python; `size` does not apply"""
+    invoice = fixtures.invoice()
+    return invoice.update_status
+
+
+def bench_get_amount_paid(fixtures, size):
+    """The invoice has `size` payments"""
+    invoice = fixtures.invoice()
+    fixtures.payments(invoice, size)
+    return invoice.get_amount_paid
+
+
+def _client_with_invoices(fixtures, size):
+    client = fixtures.client()
+    fixtures.invoices(client, size)
+    return client
+
+
+def bench_client_total_invoiced(fixtures, size):
+    """The client has `size` invoices"""
+    return _client_with_invoices(fixtures, size).get_total_invoiced
+
+
+def bench_client_total_paid(fixtures, size):
+    """The client has `size` invoices"""
+    return _client_with_invoices(fixtures, size).get_total_paid
+
+
+def bench_client_total_outstanding(fixtures, size):
+    """The client has `size` invoices"""
+    return _client_with_invoices(fixtures, size).get_total_outstanding
+
+
+def bench_payment_save(fixtures, size):
+    """The invoice already has `size` payments; each call records another"""
+    invoice = fixtures.invoice()
+    fixtures.payments(invoice, size)
+    today = timezone.localdate()
+
+    def save():
+        Payment(invoice=invoice, amount=Decimal('1.00'), payment_date=today).save()
+    return save
+
+
+BENCHMARKS = {
+    'Invoice.generate_invoice_number': bench_generate_invoice_number,
+    'Invoice.calculate_totals': bench_calculate_totals,
+    'Invoice.update_status': bench_update_status,
+    'Invoice.get_amount_paid': bench_get_amount_paid,
+    'Client.get_total_invoiced': bench_client_total_invoiced,
+    'Client.get_total_paid': bench_client_total_paid,
+    'Client.get_total_outstanding': bench_client_total_outstanding,
+    'Payment.save': bench_payment_save,
+}
+
+# Benchmarks whose cost does not depend on the size of the data
+SIZE_INDEPENDENT = {'Invoice.update_status'}
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmarks model methods on the write paths at increasing data sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000,10000',
+                            help='Comma-separated numbers of related rows to benchmark with')
+        parser.add_argument('--benchmark', action='append', dest='benchmarks', metavar='NAME',
+                            help='Only run this benchmark; may be repeated')
+        parser.add_argument('--min-time', type=float, default=0.5, help='Seconds to run each measurement for')
+        parser.add_argument('--min-calls', type=int, default=5, help='Minimum calls per measurement')
+        parser.add_argument('--json', metavar='PATH', help='Also write the results to a JSON file')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted({int(size) for size in options['sizes'].split(',')})
+        except ValueError:
+            raise CommandError('--sizes must be comma-separated integers')
+        if not sizes or sizes[0] < 0:
+            raise CommandError('--sizes must be non-negative')
+
+        names = options['benchmarks'] or list(BENCHMARKS)
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(sorted(unknown))}. Choose from: {', '.join(BENCHMARKS)}")
+
+        results = []
+        try:
+            with transaction.atomic():
+                self.run(names, sizes, options, results)
+                raise Rollback
+        except Rollback:
+            pass
+
+        if options['json']:
+            with open(options['json'], 'w') as output:
+                json.dump({'database': connection.vendor, 'results': results}, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote results to {options['json']}"))
+
+    def run(self, names, sizes, options, results):
+        fixtures = Fixtures()
+        self.stdout.write(f'db={connection.vendor}')
+        self.stdout.write(f"{'benchmark':<32} {'size':>7} {'ops/s':>11} {'us/op':>10} {'queries':>8}")
+
+        for name in names:
+            for size in sizes[:1] if name in SIZE_INDEPENDENT else sizes:
+                call = BENCHMARKS[name](fixtures, size)
+                result = self.measure(call, options['min_time'], options['min_calls'])
+                result.update(benchmark=name, size=None if name in SIZE_INDEPENDENT else size)
+                results.append(result)
+                self.stdout.write(
+                    f"{name:<32} {'-' if result['size'] is None else size:>7} {result['ops_per_sec']:>11,.0f} "
+                    f"{result['us_per_op']:>10.1f} {result['queries']:>8g}"
+                )
+
+    def measure(self, call, min_time, min_calls):
+        """Queries of one call, then ops/sec over at least `min_time` seconds"""
+        with record_queries() as queries:
+            call()
+
+        calls = 0
+        started = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < min_time or calls < min_calls:
+            call()
+            calls += 1
+            elapsed = time.perf_counter() - started
+
+        return {
+            'calls': calls,
+            'ops_per_sec': round(calls / elapsed, 1),
+            'us_per_op': round(elapsed / calls * 1e6, 1),
+            'queries': queries.count,
+        }
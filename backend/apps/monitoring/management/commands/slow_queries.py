@@ -0,0 +1,62 @@
+"""
+Management command to report the slowest queries recorded by the slow-query log
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from django.utils import timezone
+
+from apps.monitoring.models import SlowQuery
+
+ORDERINGS = {
+    'total': F('total_ms').desc(),
+    'mean': (F('total_ms') / F('count')).desc(),
+    'max': F('max_ms').desc(),
+    'count': F('count').desc(),
+}
+
+
+class Command(BaseCommand):
+    help = 'Reports the top slow queries by total, mean or maximum time, with their call sites and plans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help='Number of queries to report')
+        parser.add_argument('--order-by', choices=list(ORDERINGS), default='total',
+                            help='Rank by total time (default), mean time, maximum time or occurrences')
+        parser.add_argument('--since', type=float, metavar='HOURS',
+                            help='Only queries seen within the last HOURS hours')
+        parser.add_argument('--view', help='Only queries run by this view (URL name)')
+        parser.add_argument('--plans', action='store_true', help='Print the captured query plans')
+        parser.add_argument('--width', type=int, default=160, help='Truncate SQL to this many characters')
+        parser.add_argument('--clear', action='store_true', help='Delete the slow-query log instead')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted, _ = SlowQuery.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} slow queries'))
+            return
+
+        queries = SlowQuery.objects.all()
+        if options['since'] is not None:
+            queries = queries.filter(last_seen__gte=timezone.now() - timedelta(hours=options['since']))
+        if options['view']:
+            queries = queries.filter(view_name=options['view'])
+        queries = list(queries.order_by(ORDERINGS[options['order_by']], 'pk')[:options['top']])
+
+        if not queries:
+            self.stdout.write('No slow queries recorded')
+            return
+
+        self.stdout.write(f"{'#':>3} {'count':>7} {'total ms':>11} {'mean ms':>9} {'max ms':>9}  view / call site")
+        for rank, query in enumerate(queries, 1):
+            self.stdout.write(
+                f'{rank:>3} {query.count:>7} {query.total_ms:>11.1f} {query.mean_ms:>9.1f} {query.max_ms:>9.1f}  '
+                f"{query.view_name or '-'}  {query.call_site or '-'}"
+            )
+            sql = query.sql if len(query.sql) <= options['width'] else query.sql[:options['width'] - 3] + '...'
+            self.stdout.write(f'{"":>43}{sql}')
+            if options['plans']:
+                plan = query.plan or '(no plan captured)'
+                self.stdout.write('\n'.join(f'{"":>47}{line}' for line in plan.splitlines()))
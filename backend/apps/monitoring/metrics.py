@@ -0,0 +1,175 @@
+"""
+Prometheus metrics for InvoiceFlow
+
+Metrics are recorded by QueryInstrumentationMiddleware (requests and their
+queries), the report and user caches, Celery task signals and the gunicorn
+hooks in gunicorn.conf.py, and served by the /metrics view.
+
+Under gunicorn or a prefork Celery worker every process keeps its own
+values. When PROMETHEUS_MULTIPROC_DIR is set, each process writes them to
+files in that directory and a scrape aggregates the files of all
+processes, so any worker can answer for the whole server. The variable
+must be set before prometheus_client is first imported, and the directory
+emptied when the server starts (gunicorn.conf.py does both).
+"""
+
+import logging
+import os
+import time
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# Label for requests that matched no URL pattern, so 404 scans cannot
+# create a time series per path
+UNMATCHED_VIEW = '<unmatched>'
+
+REQUEST_DURATION = Histogram(
+    'invoiceflow_http_request_duration_seconds',
+    'Time to handle a request, by URL name and viewset action',
+    ['view', 'action'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+REQUESTS = Counter(
+    'invoiceflow_http_requests_total',
+    'Requests handled, by URL name, viewset action and status code',
+    ['view', 'action', 'status'],
+)
+REQUEST_QUERIES = Histogram(
+    'invoiceflow_db_queries_per_request',
+    'SQL queries run by a request',
+    ['view', 'action'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 20, 30, 50, 100, 200),
+)
+REQUEST_DB_DURATION = Histogram(
+    'invoiceflow_db_request_duration_seconds',
+    'Time a request spent running SQL queries',
+    ['view', 'action'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+CACHE_LOOKUPS = Counter(
+    'invoiceflow_cache_lookups_total',
+    'Cache lookups by cache and result (hit, miss or stale)',
+    ['cache', 'result'],
+)
+
+TASK_DURATION = Histogram(
+    'invoiceflow_celery_task_duration_seconds',
+    'Time to run a Celery task, by task name and final state',
+    ['task', 'state'],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0),
+)
+
+# Summed over live worker processes only, so dead workers drop out
+GUNICORN_BUSY_THREADS = Gauge(
+    'invoiceflow_gunicorn_busy_threads',
+    'Gunicorn worker threads handling a request',
+    multiprocess_mode='livesum',
+)
+GUNICORN_THREADS = Gauge(
+    'invoiceflow_gunicorn_threads',
+    'Gunicorn worker threads available to handle requests',
+    multiprocess_mode='livesum',
+)
+
+
+def observe_request(view, action, status, duration, queries, db_duration):
+    """Record a finished request"""
+    view = view or UNMATCHED_VIEW
+    action = action or ''
+    REQUEST_DURATION.labels(view, action).observe(duration)
+    REQUESTS.labels(view, action, str(status)).inc()
+    REQUEST_QUERIES.labels(view, action).observe(queries)
+    REQUEST_DB_DURATION.labels(view, action).observe(db_duration)
+
+
+def record_cache_lookup(cache, result):
+    """Count a cache lookup; `result` is 'hit', 'miss' or 'stale'"""
+    CACHE_LOOKUPS.labels(cache, result).inc()
+
+
+def view_action(view_func, method):
+    """Viewset action handling `method`, e.g. 'list' or 'overdue', else the lowercased method"""
+    actions = getattr(view_func, 'actions', None) or {}
+    return actions.get(method.lower(), method.lower())
+
+
+_task_started = {}
+
+
+def task_started(task_id):
+    _task_started[task_id] = time.perf_counter()
+
+
+def task_finished(task_id, task_name, state):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_DURATION.labels(task_name, state or 'UNKNOWN').observe(time.perf_counter() - started)
+
+
+@lru_cache(maxsize=None)
+def _broker():
+    return redis.Redis.from_url(
+        settings.CELERY_BROKER_URL,
+        socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    )
+
+
+class CeleryQueueCollector:
+    """
+    Messages waiting in each Celery queue, read from the Redis broker at
+    scrape time. Queues are listed in CELERY_METRICS_QUEUES.
+    """
+
+    def collect(self):
+        family = GaugeMetricFamily(
+            'invoiceflow_celery_queue_length', 'Messages waiting in a Celery queue', labels=['queue']
+        )
+        try:
+            client = _broker()
+            with client.pipeline(transaction=False) as pipe:
+                for queue in settings.CELERY_METRICS_QUEUES:
+                    pipe.llen(queue)
+                lengths = pipe.execute()
+        except Exception:
+            logger.warning('Celery broker unavailable, no queue lengths', exc_info=True)
+            return
+        for queue, length in zip(settings.CELERY_METRICS_QUEUES, lengths):
+            family.add_metric([queue], length)
+        yield family
+
+
+class _ProcessCollector:
+    """Metrics of this process only, when not in multiprocess mode"""
+
+    def collect(self):
+        return REGISTRY.collect()
+
+
+def multiprocess_enabled():
+    return bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+
+def build_registry(include_queues=True):
+    """Registry to serve: every process's metrics, plus Celery queue lengths"""
+    registry = CollectorRegistry()
+    if multiprocess_enabled():
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry.register(_ProcessCollector())
+    if include_queues:
+        registry.register(CeleryQueueCollector())
+    return registry
+
+
+def mark_process_dead(pid):
+    """Drop the live gauges of a process that exited"""
+    if multiprocess_enabled():
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,110 @@
+"""
+Per-request SQL instrumentation for InvoiceFlow
+
+QueryInstrumentationMiddleware counts the queries of each request and
+times them, then:
+
+- adds a Server-Timing header with database and total time
+- logs one structured line per request to `apps.monitoring.requests`
+- warns about query shapes repeated QUERY_N_PLUS_ONE_THRESHOLD times or
+  more, the signature of an N+1
+- checks the view's query budget: over budget is logged, and under DEBUG
+  with QUERY_BUDGET_STRICT the request fails instead
+- records latency and query metrics per view and action for /metrics
+- names the view in the slow-query log (see apps.monitoring.slow_queries)
+
+A view's budget is its URL name's entry in QUERY_BUDGETS, else the view
+class's `query_budget` attribute, else QUERY_BUDGET_DEFAULT.
+"""
+
+import logging
+import time
+
+from django.conf import settings
+
+from .metrics import observe_request, view_action
+from .queries import record_queries
+from .slow_queries import current_view
+
+logger = logging.getLogger('apps.monitoring.requests')
+
+
+class QueryBudgetExceeded(Exception):
+    """A view ran more queries than its budget allows"""
+
+
+def query_budget(request, view_func):
+    """Query budget of the view handling `request`, or None"""
+    match = getattr(request, 'resolver_match', None)
+    if match is not None and match.view_name in settings.QUERY_BUDGETS:
+        return settings.QUERY_BUDGETS[match.view_name]
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    budget = getattr(view_class, 'query_budget', None)
+    if budget is not None:
+        return budget
+    return settings.QUERY_BUDGET_DEFAULT
+
+
+class QueryInstrumentationMiddleware:
+    """Count, time and check the SQL queries of each request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        view_token = current_view.set('')
+        try:
+            with record_queries() as recorder:
+                response = self.get_response(request)
+        finally:
+            current_view.reset(view_token)
+        duration = time.perf_counter() - started
+
+        request.query_recorder = recorder
+        response['Server-Timing'] = (
+            f'db;desc="{recorder.count} queries";dur={recorder.duration * 1000:.1f}, '
+            f'total;dur={duration * 1000:.1f}'
+        )
+
+        view_name = getattr(getattr(request, 'resolver_match', None), 'view_name', None)
+        view_func = getattr(request, '_monitoring_view', None)
+        observe_request(
+            view_name, view_func and view_action(view_func, request.method),
+            response.status_code, duration, recorder.count, recorder.duration
+        )
+        repeated = recorder.repeated(settings.QUERY_N_PLUS_ONE_THRESHOLD)
+        metrics = {
+            'method': request.method,
+            'path': request.path,
+            'view': view_name,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'db_ms': round(recorder.duration * 1000, 1),
+            'duration_ms': round(duration * 1000, 1),
+            'repeated_queries': [{'sql': shape, 'count': stats.count} for shape, stats in repeated],
+        }
+        logger.info(
+            '%s %s %s queries=%d db_ms=%.1f duration_ms=%.1f',
+            request.method, request.path, response.status_code,
+            recorder.count, metrics['db_ms'], metrics['duration_ms'],
+            extra={'request_metrics': metrics}
+        )
+        for shape, stats in repeated:
+            logger.warning(
+                'Possible N+1 in %s: query ran %d times: %s', view_name or request.path, stats.count, shape,
+                extra={'request_metrics': metrics}
+            )
+
+        budget = query_budget(request, view_func)
+        if budget is not None and recorder.count > budget:
+            message = f'{view_name or request.path} ran {recorder.count} queries, over its budget of {budget}'
+            if settings.DEBUG and settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message, extra={'request_metrics': metrics})
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._monitoring_view = view_func
+        current_view.set(request.resolver_match.view_name or '')
@@ -0,0 +1,82 @@
+"""
+Monitoring models for InvoiceFlow
+"""
+
+import uuid
+
+from django.conf import settings
+from django.db import models
+
+
+class RequestProfile(models.Model):
+    """A request run under the profiler at a staff user's request (see apps.monitoring.profiling)"""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='request_profiles'
+    )
+
+    # Request
+    method = models.CharField(max_length=10)
+    path = models.TextField()
+    view_name = models.CharField(max_length=200, blank=True)
+    status_code = models.PositiveSmallIntegerField()
+
+    # Cost
+    duration_ms = models.FloatField()
+    queries = models.PositiveIntegerField()
+    db_ms = models.FloatField()
+
+    # Profiles
+    sample_interval_ms = models.FloatField()
+    sample_count = models.PositiveIntegerField()
+    folded_stacks = models.TextField(
+        blank=True, help_text='Sampled call stacks, one "frame;frame;frame count" line per stack'
+    )
+    peak_memory_kib = models.FloatField(help_text='Peak memory traced while the request ran')
+    allocations = models.JSONField(
+        default=list, blank=True, help_text='Allocation sites whose memory grew most during the request'
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Request Profile'
+        verbose_name_plural = 'Request Profiles'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+
+class SlowQuery(models.Model):
+    """Queries of one shape from one call site that ran over SLOW_QUERY_THRESHOLD_MS (see apps.monitoring.slow_queries)"""
+
+    fingerprint = models.CharField(max_length=64, unique=True, help_text='SHA-256 of the shape and call site')
+    sql = models.TextField(help_text='Normalized SQL, without parameter values')
+    call_site = models.CharField(max_length=500, blank=True)
+    view_name = models.CharField(max_length=200, blank=True, help_text='View of the latest occurrence')
+    database = models.CharField(max_length=100, default='default')
+
+    # Occurrences over the threshold
+    count = models.PositiveIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+
+    plan = models.TextField(blank=True)
+    plan_captured_at = models.DateTimeField(null=True, blank=True)
+
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Slow Query'
+        verbose_name_plural = 'Slow Queries'
+        ordering = ['-total_ms']
+
+    def __str__(self):
+        return f"{self.sql[:80]} ({self.count}x)"
+
+    @property
+    def mean_ms(self):
+        return self.total_ms / self.count if self.count else 0
@@ -0,0 +1,276 @@
+"""
+On-demand request profiling for InvoiceFlow
+
+A staff user may ask for any request to be profiled by sending an
+`X-Profile: 1` header or a `_profile=1` query parameter, authenticated
+either by an admin session or by the API's usual bearer token. The request
+then runs with:
+
+- a sampling profiler: a background thread records the request thread's
+  call stack every PROFILER_SAMPLE_INTERVAL seconds, kept as folded stacks
+  and drawn as a flame graph
+- tracemalloc, for the peak memory traced and the allocation sites that
+  grew most during the request
+- query recording, for the query count and database time
+
+The result is stored as a RequestProfile, viewable in the admin, and its
+id returned in the X-Profile-Id response header. Flags sent by anyone
+else are ignored. One request per process is profiled at a time, since
+tracemalloc traces every thread; a request arriving while another is
+profiled runs normally with `X-Profile: busy`.
+"""
+
+import html
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import Counter
+
+from django.conf import settings
+from rest_framework.exceptions import APIException
+from rest_framework.settings import api_settings
+
+from .models import RequestProfile
+from .queries import record_queries
+
+logger = logging.getLogger(__name__)
+
+_profiling = threading.Lock()
+
+
+def _path_prefixes():
+    return sorted({os.path.join(os.path.abspath(path), '') for path in sys.path if path}, key=len, reverse=True)
+
+
+def short_path(filename, prefixes):
+    """`filename` relative to the sys.path entry it was imported from"""
+    for prefix in prefixes:
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+    return filename
+
+
+class StackSampler:
+    """Samples one thread's call stack from a background thread"""
+
+    def __init__(self, thread_id, interval, root_code):
+        self.thread_id = thread_id
+        self.interval = interval
+        # Frames above this code object (the server, outer middleware) are left out
+        self.root_code = root_code
+        self.samples = Counter()
+        self._labels = {}
+        self._prefixes = _path_prefixes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[self._fold(frame)] += 1
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            filename = short_path(code.co_filename, self._prefixes)
+            label = self._labels[code] = f'{code.co_qualname} ({filename}:{code.co_firstlineno})'
+        return label
+
+    def _fold(self, frame):
+        stack = []
+        while frame is not None and frame.f_code is not self.root_code:
+            if frame.f_code is StackSampler.stop.__code__:
+                # Sampled after the request finished, while the sampler was being stopped
+                return ''
+            stack.append(self._label(frame.f_code))
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    @property
+    def sample_count(self):
+        return sum(count for stack, count in self.samples.items() if stack)
+
+    def folded(self):
+        """Samples in the folded stack format used by flame graph tools"""
+        return '\n'.join(f'{stack} {count}' for stack, count in sorted(self.samples.items()) if stack)
+
+
+def allocation_summary(before, after, limit):
+    """Allocation sites that grew most between two tracemalloc snapshots"""
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    stats = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')
+    prefixes = _path_prefixes()
+    return [
+        {
+            'location': f'{short_path(stat.traceback[0].filename, prefixes)}:{stat.traceback[0].lineno}',
+            'size_kib': round(stat.size_diff / 1024, 1),
+            'count': stat.count_diff,
+        }
+        for stat in stats[:limit]
+        if stat.size_diff > 0
+    ]
+
+
+def staff_user(request):
+    """The staff user making the request, by session or API authentication, else None"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user if user.is_staff else None
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authentication_class().authenticate(request)
+        except APIException:
+            return None
+        if result is not None:
+            return result[0] if result[0].is_staff else None
+    return None
+
+
+def profile_requested(request):
+    return request.headers.get('X-Profile') == '1' or request.GET.get('_profile') == '1'
+
+
+class RequestProfilerMiddleware:
+    """Profile requests flagged by staff users; place after AuthenticationMiddleware"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.PROFILER_ENABLED or not profile_requested(request):
+            return self.get_response(request)
+        user = staff_user(request)
+        if user is None:
+            return self.get_response(request)
+
+        if not _profiling.acquire(blocking=False):
+            response = self.get_response(request)
+            response['X-Profile'] = 'busy'
+            return response
+        try:
+            return self.profile(request, user)
+        finally:
+            _profiling.release()
+
+    def profile(self, request, user):
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start(settings.PROFILER_TRACEMALLOC_FRAMES)
+        try:
+            before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+
+            interval = settings.PROFILER_SAMPLE_INTERVAL
+            sampler = StackSampler(threading.get_ident(), interval, self.profile.__code__)
+            with record_queries() as recorder:
+                sampler.start()
+                started = time.perf_counter()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    duration = time.perf_counter() - started
+                    sampler.stop()
+
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+        finally:
+            # Left running, tracemalloc would slow every later request in this worker
+            if not tracing:
+                tracemalloc.stop()
+
+        profile = RequestProfile.objects.create(
+            user=user,
+            method=request.method,
+            path=request.get_full_path(),
+            view_name=getattr(getattr(request, 'resolver_match', None), 'view_name', None) or '',
+            status_code=response.status_code,
+            duration_ms=round(duration * 1000, 2),
+            queries=recorder.count,
+            db_ms=round(recorder.duration * 1000, 2),
+            sample_interval_ms=interval * 1000,
+            sample_count=sampler.sample_count,
+            folded_stacks=sampler.folded(),
+            peak_memory_kib=round((peak - baseline) / 1024, 1),
+            allocations=allocation_summary(before, after, settings.PROFILER_ALLOCATION_LIMIT),
+        )
+        logger.info('Profiled %s %s as %s', request.method, request.path, profile.pk)
+        response['X-Profile-Id'] = str(profile.pk)
+        return response
+
+
+FRAME_HEIGHT = 17
+
+
+def _color(name):
+    # Stable warm colors, so a function keeps its color across profiles
+    value = zlib.crc32(name.encode())
+    return f'rgb({205 + value % 50},{(value >> 8) % 180},{(value >> 16) % 55})'
+
+
+def render_flame_graph(folded, width=1200):
+    """Draw folded stacks as an SVG flame graph, callers at the bottom"""
+    root = {'children': {}, 'value': 0}
+    for line in folded.splitlines():
+        stack, _, count = line.rpartition(' ')
+        if not stack:
+            continue
+        count = int(count)
+        root['value'] += count
+        node = root
+        for name in stack.split(';'):
+            node = node['children'].setdefault(name, {'children': {}, 'value': 0})
+            node['value'] += count
+
+    if not root['value']:
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{FRAME_HEIGHT * 2}">'
+            f'<text x="4" y="{FRAME_HEIGHT}" font-family="monospace" font-size="12">No samples</text></svg>'
+        )
+
+    frames = []
+    depth = 0
+
+    def layout(node, x, level):
+        nonlocal depth
+        depth = max(depth, level)
+        for name, child in sorted(node['children'].items()):
+            child_width = child['value'] / root['value'] * width
+            if child_width >= 0.5:
+                frames.append((name, child['value'], x, level, child_width))
+                layout(child, x, level + 1)
+            x += child_width
+
+    layout(root, 0.0, 0)
+    height = (depth + 1) * FRAME_HEIGHT
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">'
+    ]
+    for name, value, x, level, frame_width in frames:
+        y = height - (level + 1) * FRAME_HEIGHT
+        label = html.escape(name)
+        title = f'{label} — {value} samples ({value / root["value"]:.1%})'
+        text = ''
+        characters = int((frame_width - 6) // 7)
+        if characters >= 3:
+            shown = name if len(name) <= characters else name[:characters - 2] + '..'
+            text = f'<text x="{x + 3:.1f}" y="{y + 12}">{html.escape(shown)}</text>'
+        parts.append(
+            f'<g><title>{title}</title><rect x="{x:.1f}" y="{y}" width="{frame_width:.1f}" '
+            f'height="{FRAME_HEIGHT - 1}" fill="{_color(name)}" rx="2"/>{text}</g>'
+        )
+    parts.append('</svg>')
+    return ''.join(parts)
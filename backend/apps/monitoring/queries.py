@@ -0,0 +1,77 @@
+"""
+SQL query recording for InvoiceFlow
+
+QueryRecorder is installed with connection.execute_wrapper() and keeps
+per-shape counts and timings for one unit of work. A shape is the SQL text
+with its parameters stripped and IN lists collapsed, so the same query run
+for each row of a list (an N+1) maps to one shape with a high count.
+"""
+
+import re
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+IN_LIST_RE = re.compile(r'\bIN \((?:%s|\?)(?:, (?:%s|\?))*\)')
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def query_shape(sql):
+    """Normalize SQL so queries that differ only in their values compare equal"""
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    sql = LITERAL_RE.sub('?', sql)
+    return WHITESPACE_RE.sub(' ', sql).strip()
+
+
+class QueryShapeStats:
+    """Count and total duration of one query shape"""
+
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+class QueryRecorder:
+    """execute_wrapper that aggregates the queries it sees by shape"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            shape = query_shape(sql)
+            stats = self.shapes.get(shape)
+            if stats is None:
+                stats = self.shapes[shape] = QueryShapeStats()
+            stats.count += 1
+            stats.duration += elapsed
+
+    def repeated(self, threshold):
+        """Shapes run at least `threshold` times, most frequent first, as (shape, stats)"""
+        return sorted(
+            ((shape, stats) for shape, stats in self.shapes.items() if stats.count >= threshold),
+            key=lambda item: item[1].count,
+            reverse=True
+        )
+
+
+@contextmanager
+def record_queries(recorder=None):
+    """Record queries on every database connection of this thread"""
+    recorder = recorder or QueryRecorder()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder
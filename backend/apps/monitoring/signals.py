@@ -0,0 +1,43 @@
+"""
+Celery task metrics for InvoiceFlow
+
+Task durations are recorded in the worker process that runs the task. Set
+CELERY_METRICS_PORT to serve a worker's metrics, aggregated across its
+pool processes when PROMETHEUS_MULTIPROC_DIR is set, for Prometheus to
+scrape.
+"""
+
+import logging
+import os
+
+from celery.signals import task_postrun, task_prerun, worker_process_shutdown, worker_ready
+from django.conf import settings
+from prometheus_client import start_http_server
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@task_prerun.connect
+def record_task_start(task_id=None, **kwargs):
+    metrics.task_started(task_id)
+
+
+@task_postrun.connect
+def record_task_duration(task_id=None, task=None, state=None, **kwargs):
+    metrics.task_finished(task_id, task.name, state)
+
+
+@worker_ready.connect
+def serve_worker_metrics(**kwargs):
+    port = settings.CELERY_METRICS_PORT
+    if port:
+        # Queue lengths are scraped from the web servers, once per broker
+        start_http_server(port, registry=metrics.build_registry(include_queues=False))
+        logger.info('Serving Celery worker metrics on port %s', port)
+
+
+@worker_process_shutdown.connect
+def release_worker_metrics(**kwargs):
+    metrics.mark_process_dead(os.getpid())
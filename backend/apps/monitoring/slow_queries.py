@@ -0,0 +1,191 @@
+"""
+Slow-query log for InvoiceFlow
+
+An execute_wrapper, added to every database connection as it is opened,
+times each query. A query slower than SLOW_QUERY_THRESHOLD_MS is logged
+straight away to `apps.monitoring.slow_queries` with:
+
+- its shape, the SQL normalized by query_shape()
+- its call site: the view, serializer or service method that ran it
+  (see call_site())
+- the URL name of the view handling the request, if any
+
+and handed to the capture_slow_query Celery task, which aggregates it
+into a SlowQuery row per shape and call site and, at most once per
+SLOW_QUERY_EXPLAIN_INTERVAL for each row, records the query plan. Plans
+are captured off the request path because EXPLAIN ANALYZE runs the query
+again. `python manage.py slow_queries` reports the worst offenders.
+
+Bound parameters can hold email addresses, password hashes or token ids,
+so they are only sent through the broker when SLOW_QUERY_EXPLAIN_PARAMS is
+on. Otherwise only parameter-free statements are explained. Messages are
+published by a background thread from a bounded queue, so a slow or
+unreachable broker never holds up a request; captures that do not fit in
+the queue are dropped.
+"""
+
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
+from django.db.models.manager import BaseManager
+
+from .queries import query_shape
+
+logger = logging.getLogger('apps.monitoring.slow_queries')
+
+# URL name of the view handling the current request, set by QueryInstrumentationMiddleware
+current_view = contextvars.ContextVar('current_view', default='')
+
+# Queries run while capturing, EXPLAIN above all, must not be captured in turn
+_suppressed = contextvars.ContextVar('slow_queries_suppressed', default=False)
+
+_APPS_DIR = os.path.join(str(settings.BASE_DIR), 'apps', '')
+_OWN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '')
+
+
+@contextmanager
+def slow_query_logging_disabled():
+    token = _suppressed.set(True)
+    try:
+        yield
+    finally:
+        _suppressed.reset(token)
+
+
+def fingerprint(shape, call_site):
+    return hashlib.sha256(f'{shape}\n{call_site}'.encode()).hexdigest()
+
+
+def call_site(frame):
+    """
+    Where a query came from: 'path:line in function' of the innermost frame
+    in the project's own code outside apps.monitoring, else 'Class.method'
+    of the innermost library frame running on one of the project's objects,
+    such as a viewset's inherited list(). The project's querysets and
+    managers only say which model was queried, so they are skipped.
+    """
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_APPS_DIR) and not filename.startswith(_OWN_DIR):
+            relative = os.path.relpath(filename, settings.BASE_DIR)
+            return f'{relative}:{frame.f_lineno} in {frame.f_code.co_qualname}'
+        owner = type(frame.f_locals.get('self'))
+        if (owner.__module__.startswith('apps.') and not owner.__module__.startswith('apps.monitoring.')
+                and not issubclass(owner, (QuerySet, BaseManager))):
+            return f'{owner.__name__}.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return ''
+
+
+class CaptureSender:
+    """Publishes slow-query captures to the broker from a background thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+
+    def send(self, args):
+        """Queue a capture without waiting; returns False if it was dropped"""
+        try:
+            self._get_queue().put_nowait(args)
+        except queue.Full:
+            return False
+        return True
+
+    def flush(self):
+        """Wait until every queued capture has been published"""
+        if self._queue is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def _get_queue(self):
+        # A forked worker inherits the queue but not the thread that drains it
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=settings.SLOW_QUERY_QUEUE_SIZE)
+                    threading.Thread(target=self._run, args=(self._queue,), name='slow-query-sender',
+                                     daemon=True).start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def _run(self, captures):
+        from .tasks import capture_slow_query
+
+        while True:
+            args = captures.get()
+            try:
+                with slow_query_logging_disabled():
+                    capture_slow_query.apply_async(args=args, retry=False)
+            except Exception:
+                logger.warning('Could not queue slow query capture', exc_info=True)
+            finally:
+                captures.task_done()
+
+
+capture_sender = CaptureSender()
+
+
+def _json_params(params):
+    """Query parameters as the Celery JSON serializer can carry them, or None"""
+    if params is None:
+        return None
+    try:
+        return json.loads(json.dumps(list(params), cls=DjangoJSONEncoder))
+    except (TypeError, ValueError):
+        return None
+
+
+def log_slow_queries(execute, sql, params, many, context):
+    """execute_wrapper that logs and captures queries over SLOW_QUERY_THRESHOLD_MS"""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms >= settings.SLOW_QUERY_THRESHOLD_MS and not _suppressed.get():
+            _capture(sql, params, many, context['connection'].alias, duration_ms)
+
+
+def _statement(sql, params, many):
+    """The statement the capture task may explain, or None"""
+    if many:
+        # executemany() has no single statement to explain
+        return None
+    if not params:
+        return {'sql': sql, 'params': None}
+    if not settings.SLOW_QUERY_EXPLAIN_PARAMS:
+        return None
+    return {'sql': sql, 'params': _json_params(params)}
+
+
+def _capture(sql, params, many, alias, duration_ms):
+    shape = query_shape(sql)
+    site = call_site(sys._getframe(2))
+    view = current_view.get()
+    logger.warning(
+        'Slow query (%.1f ms) in %s at %s: %s', duration_ms, view or '-', site or '-', shape,
+        extra={'request_metrics': {
+            'view': view, 'call_site': site, 'duration_ms': round(duration_ms, 1), 'sql': shape,
+        }}
+    )
+
+    if not capture_sender.send([alias, shape, site, view, round(duration_ms, 3), _statement(sql, params, many)]):
+        logger.debug('Slow query capture queue is full, dropping %s', shape)
+
+
+def install(sender, connection, **kwargs):
+    """connection_created receiver that adds the wrapper to each new connection"""
+    if log_slow_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(log_slow_queries)
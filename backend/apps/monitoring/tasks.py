@@ -0,0 +1,78 @@
+"""
+Celery tasks for monitoring
+"""
+
+import logging
+
+from celery import shared_task
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import SlowQuery
+from .slow_queries import fingerprint, slow_query_logging_disabled
+
+logger = logging.getLogger(__name__)
+
+
+def explain(alias, sql, params):
+    """Query plan of `sql`, actually run when it is a SELECT on PostgreSQL"""
+    connection = connections[alias]
+    with transaction.atomic(using=alias), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            analyze = sql.lstrip().upper().startswith('SELECT')
+            cursor.execute('SET LOCAL statement_timeout = %s', [int(settings.SLOW_QUERY_EXPLAIN_TIMEOUT * 1000)])
+            cursor.execute(f"EXPLAIN {'(ANALYZE, BUFFERS) ' if analyze else ''}{sql}", params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = '\n'.join(row[-1] for row in cursor.fetchall())
+        else:
+            cursor.execute(f'EXPLAIN {sql}', params)
+            plan = '\n'.join(' | '.join(str(value) for value in row) for row in cursor.fetchall())
+        # Whatever the explained statement did is undone
+        transaction.set_rollback(True, using=alias)
+    return plan
+
+
+@shared_task(ignore_result=True)
+def capture_slow_query(alias, shape, call_site, view_name, duration_ms, statement=None):
+    """Add a slow query to its SlowQuery row, and record its plan if the row has none recent enough"""
+    with slow_query_logging_disabled():
+        key = fingerprint(shape, call_site)
+        now = timezone.now()
+        updates = dict(
+            count=F('count') + 1,
+            total_ms=F('total_ms') + duration_ms,
+            max_ms=Greatest(F('max_ms'), duration_ms),
+            view_name=view_name,
+            last_seen=now,
+        )
+        if not SlowQuery.objects.filter(fingerprint=key).update(**updates):
+            try:
+                with transaction.atomic():
+                    SlowQuery.objects.create(
+                        fingerprint=key, sql=shape, call_site=call_site[:500], view_name=view_name, database=alias,
+                        count=1, total_ms=duration_ms, max_ms=duration_ms, last_seen=now,
+                    )
+            except IntegrityError:
+                # Created by a concurrent capture
+                SlowQuery.objects.filter(fingerprint=key).update(**updates)
+
+        if statement is None or (statement['params'] is None and '%s' in statement['sql']):
+            return
+        cutoff = now - settings.SLOW_QUERY_EXPLAIN_INTERVAL
+        # Claim the row so concurrent captures of the same query explain it once
+        claimed = SlowQuery.objects.filter(
+            Q(plan_captured_at__isnull=True) | Q(plan_captured_at__lt=cutoff), fingerprint=key
+        ).update(plan_captured_at=now)
+        if not claimed:
+            return
+        try:
+            plan = explain(alias, statement['sql'], statement['params'])
+        except Exception as exc:
+            logger.warning('Could not explain slow query %s', key, exc_info=True)
+            plan = f'EXPLAIN failed: {exc}'
+        SlowQuery.objects.filter(fingerprint=key).update(plan=plan)
@@ -0,0 +1,220 @@
+"""
+Query budget assertions for API tests
+
+QueryBudgetTestCase seeds two accounts holding the same kinds of records at
+a small and a large scale, and assertBudget() sends the same request as
+each of them. A request passes when neither run exceeds its query budget
+or response size bound and both run the same number of queries, so a view
+whose query count grows with the number of rows fails even when it is
+still within budget at the scales tested.
+"""
+
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.clients.models import Client
+from apps.expenses.models import Expense, ExpenseCategoryRule, ReceiptUpload
+from apps.invoices.models import Invoice, InvoiceItem
+from apps.payments.models import Payment
+from apps.reports.client_metrics import rebuild_client_metrics
+from apps.reports.models import ReportJob
+from apps.reports.rollups import rebuild_rollups
+from apps.users.models import User
+
+PASSWORD = 'budget-Passw0rd!'
+
+# Rows per account; the large scale exceeds a page of every list. Invoice
+# numbers are unique across users, so each account numbers from its own range.
+SCALES = {
+    'small': {'clients': 2, 'invoices': 3, 'items': 1, 'expenses': 3, 'rules': 2, 'jobs': 1, 'first_number': 1},
+    'large': {'clients': 24, 'invoices': 5, 'items': 4, 'expenses': 60, 'rules': 25, 'jobs': 25, 'first_number': 1001},
+}
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'query-budget-tests',
+    }
+}
+
+
+def seed_account(name, clients, invoices, items, expenses, rules, jobs, first_number=1):
+    """Create a user with `clients` clients of `invoices` invoices each, and the rest of an account"""
+    today = timezone.localdate()
+    year = timezone.now().year
+    user = User.objects.create_user(
+        email=f'{name}@budget.invoiceflow.local',
+        password=PASSWORD,
+        first_name=name.title(),
+        last_name='Account',
+    )
+    # As authentication would load it, with decimal fields as Decimals
+    user.refresh_from_db()
+
+    client_rows = Client.objects.bulk_create([
+        Client(user=user, name=f'Client {index}', email=f'client{index}@{name}.example.com',
+               company_name=f'Company {index}', address='1 Main Street')
+        for index in range(clients)
+    ])
+
+    invoice_rows = []
+    for client_index, client in enumerate(client_rows):
+        for index in range(invoices):
+            issue_date = today - timedelta(days=20 * index + client_index)
+            status = ['PAID', 'SENT', 'DRAFT', 'OVERDUE', 'CANCELLED'][index % 5]
+            invoice_rows.append(Invoice(
+                user=user,
+                client=client,
+                invoice_number=f'INV-{year}-{first_number + len(invoice_rows):05d}',
+                issue_date=issue_date,
+                due_date=issue_date + timedelta(days=14),
+                status=status,
+                subtotal=Decimal('100.00') * items,
+                tax_amount=Decimal('0.00'),
+                total_amount=Decimal('100.00') * items,
+                sent_at=timezone.now() if status != 'DRAFT' else None,
+                paid_at=timezone.now() if status == 'PAID' else None,
+                terms='Net 14',
+            ))
+    Invoice.objects.bulk_create(invoice_rows)
+
+    InvoiceItem.objects.bulk_create([
+        InvoiceItem(invoice=invoice, description=f'Consulting {order}', quantity=Decimal('1.00'),
+                    unit_price=Decimal('100.00'), amount=Decimal('100.00'), order=order)
+        for invoice in invoice_rows
+        for order in range(items)
+    ])
+
+    Payment.objects.bulk_create([
+        Payment(invoice=invoice, amount=invoice.total_amount, payment_date=invoice.issue_date + timedelta(days=10),
+                payment_method='BANK_TRANSFER', transaction_id=f'TX-{invoice.invoice_number}')
+        for invoice in invoice_rows
+        if invoice.status == 'PAID'
+    ] + [
+        Payment(invoice=invoice, amount=Decimal('25.00'), payment_date=today,
+                payment_method='CREDIT_CARD', transaction_id=f'TX-{invoice.invoice_number}-PART')
+        for invoice in invoice_rows
+        if invoice.status == 'OVERDUE'
+    ])
+
+    Expense.objects.bulk_create([
+        Expense(user=user, description=f'Expense {index}', amount=Decimal('12.50') + index,
+                category=['SOFTWARE', 'TRAVEL', 'OFFICE_SUPPLIES'][index % 3],
+                expense_date=today - timedelta(days=3 * index), vendor=f'Vendor {index % 7}')
+        for index in range(expenses)
+    ])
+
+    ExpenseCategoryRule.objects.bulk_create([
+        ExpenseCategoryRule(user=user, name=f'Rule {index}', vendor_pattern=f'Vendor {index}',
+                            priority=index, category='SOFTWARE')
+        for index in range(rules)
+    ])
+
+    job_rows = ReportJob.objects.bulk_create([
+        ReportJob(user=user, report_type='INCOME', parameters={'index': index}, parameters_hash=f'{index:064d}',
+                  status='PENDING')
+        for index in range(jobs)
+    ])
+    job = job_rows[0]
+    job.store_result({'total': '100.00', 'invoices': []})
+
+    # Bulk inserts skip the signals that keep these up to date
+    rebuild_rollups(user.pk)
+    rebuild_client_metrics(user.pk)
+
+    return SimpleNamespace(
+        user=user,
+        client=client_rows[0],
+        idle_client=Client.objects.create(user=user, name='Idle Client', email=f'idle@{name}.example.com'),
+        invoice=next(invoice for invoice in invoice_rows if invoice.status == 'SENT'),
+        draft_invoice=next(invoice for invoice in invoice_rows if invoice.status == 'DRAFT'),
+        payment=Payment.objects.filter(invoice__user=user).first(),
+        expense=Expense.objects.filter(user=user).first(),
+        rule=ExpenseCategoryRule.objects.filter(user=user).first(),
+        upload=ReceiptUpload.objects.create(user=user, filename='receipt.png', total_size=1024),
+        job=job,
+    )
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class QueryBudgetTestCase(TestCase):
+    """Test case with a small and a large account and assertBudget()"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Throttles and the token blacklist log every failed Redis call; budgets only count queries
+        logging.disable(logging.ERROR)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.accounts = {name: seed_account(name, **scale) for name, scale in SCALES.items()}
+
+    def setUp(self):
+        cache.clear()
+
+    def request(self, account, method, path, data=None, authenticate=True, **extra):
+        """Send a request as the account's user, or anonymously"""
+        api_client = APIClient(HTTP_HOST='localhost')
+        if authenticate:
+            api_client.force_authenticate(account.user)
+        return getattr(api_client, method)(path, data, **extra)
+
+    def assertBudget(self, method, path, queries, size, data=None, status=200,
+                     authenticate=True, format='json', **extra):
+        """
+        Assert that a request runs at most `queries` queries and returns at
+        most `size` bytes, and runs as many queries for the large account as
+        for the small one.
+
+        `path` and `data` may be callables taking the account, for requests
+        about the account's own records.
+        """
+        if format is not None:
+            extra['format'] = format
+
+        counts = {}
+        for name, account in self.accounts.items():
+            request_path = path(account) if callable(path) else path
+            request_data = data(account) if callable(data) else data
+
+            with CaptureQueriesContext(connection) as captured:
+                response = self.request(account, method, request_path, request_data, authenticate, **extra)
+
+            self.assertEqual(
+                response.status_code, status,
+                f'{method.upper()} {request_path} as {name}: {getattr(response, "data", response.content)}'
+            )
+            counts[name] = len(captured)
+            self.assertLessEqual(
+                counts[name], queries,
+                f'{method.upper()} {request_path} as {name} ran {counts[name]} queries:\n'
+                + '\n'.join(query['sql'] for query in captured.captured_queries)
+            )
+            self.assertLessEqual(
+                len(response.content), size,
+                f'{method.upper()} {request_path} as {name} returned {len(response.content)} bytes'
+            )
+
+        self.assertEqual(
+            len(set(counts.values())), 1,
+            f'{method.upper()} {request_path} runs more queries as the account grows: {counts}'
+        )
+        return counts
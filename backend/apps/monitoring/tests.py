@@ -0,0 +1,408 @@
+"""
+Tests for the metrics endpoint, per-request query instrumentation,
+tracing, on-demand request profiling and the slow-query log
+"""
+
+import logging
+import threading
+import tracemalloc
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from opentelemetry.instrumentation.django import DjangoInstrumentor
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ALWAYS_OFF, ALWAYS_ON, Sampler
+from opentelemetry.trace import SpanKind
+from rest_framework import renderers, serializers
+from rest_framework.response import Response
+
+from apps.clients.models import Client
+from apps.clients.views import ClientViewSet
+from apps.monitoring.middleware import QueryBudgetExceeded
+from apps.monitoring import tracing
+from apps.monitoring.models import RequestProfile, SlowQuery
+from apps.monitoring.profiling import RequestProfilerMiddleware, render_flame_graph
+from apps.monitoring.queries import query_shape, record_queries
+from apps.monitoring.slow_queries import capture_sender
+from apps.monitoring.tasks import capture_slow_query
+from apps.monitoring.testing import TEST_CACHES
+from apps.users.models import User
+from apps.users.tokens import RefreshToken
+
+
+@override_settings(CACHES=TEST_CACHES)
+class MetricsEndpointTests(TestCase):
+    """/metrics is only readable with the scrape token, or in development"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        logging.disable(logging.ERROR)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+        super().tearDownClass()
+
+    def get(self, **extra):
+        return self.client.get('/metrics', HTTP_HOST='localhost', **extra)
+
+    @override_settings(DEBUG=False, METRICS_AUTH_TOKEN='')
+    def test_closed_in_production_without_a_token(self):
+        self.assertEqual(self.get().status_code, 403)
+
+    @override_settings(DEBUG=True, METRICS_AUTH_TOKEN='')
+    def test_open_in_development_without_a_token(self):
+        self.assertEqual(self.get().status_code, 200)
+
+    @override_settings(DEBUG=False, METRICS_AUTH_TOKEN='scrape-secret')
+    def test_token_is_required(self):
+        self.assertEqual(self.get().status_code, 403)
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class QueryInstrumentationTests(TestCase):
+    """Requests report their queries, repeated query shapes and budget overruns"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        logging.disable(logging.ERROR)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+        super().tearDownClass()
+
+    def warnings(self, path='/api/clients/'):
+        """Warnings logged by the middleware for one request"""
+        with mock.patch('apps.monitoring.middleware.logger') as logger:
+            response = self.get(path)
+        self.assertEqual(response.status_code, 200)
+        return [call.args[0] % call.args[1:] for call in logger.warning.call_args_list]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='x', first_name='Plain', last_name='User')
+
+    def get(self, path='/api/clients/'):
+        token = RefreshToken.for_user(self.user).access_token
+        return self.client.get(path, HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_query_shape(self):
+        self.assertEqual(
+            query_shape("SELECT *\n  FROM t WHERE id IN (%s, %s, %s) AND name = 'O''Brien' AND n > 42 AND t2.x IN (?)"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? AND n > ? AND t2.x IN (...)'
+        )
+
+    def test_repeated_shapes(self):
+        with record_queries() as recorder:
+            for pk in range(5):
+                User.objects.filter(pk=pk).exists()
+            User.objects.count()
+        self.assertEqual(recorder.count, 6)
+        [(shape, stats)] = recorder.repeated(5)
+        self.assertIn('"users_user"."id" = %s', shape)
+        self.assertEqual(stats.count, 5)
+        self.assertEqual(recorder.repeated(6), [])
+
+    def test_server_timing_header(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'^db;desc="\d+ queries";dur=[\d.]+, total;dur=[\d.]+$')
+
+    @override_settings(QUERY_N_PLUS_ONE_THRESHOLD=5)
+    def test_repeated_query_is_reported_as_n_plus_one(self):
+        def list_one_by_one(viewset, request, *args, **kwargs):
+            for client in range(5):
+                Client.objects.filter(user=request.user, name=f'Client {client}').exists()
+            return Response([])
+
+        with mock.patch.object(ClientViewSet, 'list', list_one_by_one):
+            [warning] = self.warnings()
+        self.assertTrue(warning.startswith('Possible N+1 in client-list: query ran 5 times: SELECT'))
+
+    def test_queries_under_the_threshold_are_not_reported(self):
+        self.assertEqual(self.warnings(), [])
+
+    @override_settings(DEBUG=True, QUERY_BUDGET_STRICT=True, QUERY_BUDGETS={'client-list': 0})
+    def test_budget_is_enforced_under_debug(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'over its budget of 0'):
+            self.get()
+
+    @override_settings(DEBUG=False, QUERY_BUDGET_STRICT=True, QUERY_BUDGETS={'client-list': 0})
+    def test_budget_overrun_is_logged_in_production(self):
+        [warning] = self.warnings()
+        self.assertRegex(warning, r'^client-list ran \d+ queries, over its budget of 0$')
+
+    @override_settings(DEBUG=True, QUERY_BUDGET_STRICT=True)
+    def test_hot_views_are_within_their_budgets(self):
+        for path in ('/api/reports/dashboard/', '/api/invoices/'):
+            self.assertEqual(self.get(path).status_code, 200, path)
+
+
+class SwitchSampler(Sampler):
+    """Samples every new trace, or none, as the test chooses"""
+
+    def __init__(self):
+        self.sampler = ALWAYS_ON
+
+    def should_sample(self, *args, **kwargs):
+        return self.sampler.should_sample(*args, **kwargs)
+
+    def get_description(self):
+        return 'SwitchSampler'
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class TracingTests(TestCase):
+    """Sampled requests are traced through the view, serializers, rendering and SQL"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        logging.disable(logging.ERROR)
+        cls.sampler = SwitchSampler()
+        cls.exporter = InMemorySpanExporter()
+        cls.provider = TracerProvider(sampler=cls.sampler)
+        cls.provider.add_span_processor(SimpleSpanProcessor(cls.exporter))
+        DjangoInstrumentor().instrument(tracer_provider=cls.provider)
+
+    @classmethod
+    def tearDownClass(cls):
+        DjangoInstrumentor().uninstrument()
+        logging.disable(logging.NOTSET)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='traced@example.com', password='x', first_name='Plain', last_name='User')
+        Client.objects.create(user=cls.user, name='Acme', email='acme@example.com')
+
+    def setUp(self):
+        self.sampler.sampler = ALWAYS_ON
+        self.exporter.clear()
+
+        # Instrument DRF and this connection for the test only
+        for cls, name in [(serializers.BaseSerializer, 'is_valid'), (serializers.Serializer, 'data'),
+                          (serializers.ListSerializer, 'data'), (renderers.JSONRenderer, 'render')]:
+            patcher = mock.patch.object(cls, name, cls.__dict__[name])
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(tracing, 'tracer', self.provider.get_tracer('invoiceflow'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tracing._instrument_rest_framework()
+        tracing._install_query_tracing(None, connection)
+        self.addCleanup(connection.execute_wrappers.remove, tracing.trace_query)
+
+    def spans(self, method, path, **extra):
+        token = RefreshToken.for_user(self.user).access_token
+        response = getattr(self.client, method)(
+            path, HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {token}', content_type='application/json', **extra
+        )
+        self.assertLess(response.status_code, 400, getattr(response, 'data', response.content))
+        return {span.name: span for span in self.exporter.get_finished_spans()}
+
+    def test_sampled_request_is_traced(self):
+        spans = self.spans('get', '/api/clients/')
+        view = spans['GET api/clients/$']
+        self.assertEqual(view.kind, SpanKind.SERVER)
+        for name in ('ClientSerializer[].data', 'JSONRenderer.render', 'SELECT'):
+            self.assertIn(name, spans)
+            self.assertEqual(spans[name].context.trace_id, view.context.trace_id, name)
+
+    def test_validation_is_traced(self):
+        spans = self.spans('post', '/api/clients/', data={'name': 'Globex', 'email': 'globex@example.com'})
+        self.assertIn('ClientCreateUpdateSerializer.is_valid', spans)
+        self.assertIn('INSERT', spans)
+
+    def test_query_statement_has_no_values(self):
+        with self.provider.get_tracer('test').start_as_current_span('request'):
+            User.objects.filter(email=self.user.email).exists()
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) FROM users_user WHERE email = 'traced@example.com' AND id > 42")
+
+        statements = [span.attributes['db.statement'] for span in self.exporter.get_finished_spans()
+                      if 'db.statement' in span.attributes]
+        self.assertEqual(len(statements), 2)
+        for statement in statements:
+            self.assertNotIn('traced@example.com', statement)
+            self.assertNotIn('42', statement)
+        self.assertIn("email = ?", statements[1])
+
+    def test_unsampled_request_emits_nothing(self):
+        self.sampler.sampler = ALWAYS_OFF
+        self.assertEqual(self.spans('get', '/api/clients/'), {})
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class RequestProfilerTests(TestCase):
+    """Only staff users can have their requests profiled"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        logging.disable(logging.ERROR)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(email='staff@example.com', password='x', is_staff=True,
+                                             is_superuser=True, first_name='Staff', last_name='User')
+        cls.user = User.objects.create_user(email='user@example.com', password='x',
+                                            first_name='Plain', last_name='User')
+
+    def get(self, user, path, **extra):
+        token = RefreshToken.for_user(user).access_token
+        return self.client.get(path, HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {token}', **extra)
+
+    def test_flag_from_non_staff_is_ignored(self):
+        response = self.get(self.user, '/api/clients/', HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_staff_request_is_profiled(self):
+        response = self.get(self.staff, '/api/clients/?_profile=1')
+        self.assertEqual(response.status_code, 200)
+
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual(profile.user, self.staff)
+        self.assertEqual(profile.view_name, 'client-list')
+        self.assertEqual(profile.status_code, 200)
+        self.assertGreater(profile.queries, 0)
+        self.assertGreater(profile.duration_ms, 0)
+
+    def test_tracemalloc_is_stopped_when_the_request_fails(self):
+        request = RequestFactory().get('/api/clients/', HTTP_X_PROFILE='1')
+        request.user = self.staff
+        middleware = RequestProfilerMiddleware(mock.Mock(side_effect=RuntimeError('request failed')))
+        with self.assertRaisesMessage(RuntimeError, 'request failed'):
+            middleware(request)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_unflagged_staff_request_is_not_profiled(self):
+        response = self.get(self.staff, '/api/clients/')
+        self.assertNotIn('X-Profile-Id', response)
+
+    def test_admin_flame_graph(self):
+        profile = RequestProfile.objects.create(
+            method='GET', path='/api/clients/', status_code=200, duration_ms=12.5, queries=2, db_ms=1.0,
+            sample_interval_ms=1.0, sample_count=3, peak_memory_kib=10.0,
+            folded_stacks='view (a.py:1);serialize <Client> (b.py:2) 2\nview (a.py:1) 1',
+            allocations=[{'location': 'b.py:3', 'size_kib': 4.0, 'count': 10}],
+        )
+        self.client.force_login(self.staff)
+
+        response = self.client.get(f'/admin/monitoring/requestprofile/{profile.pk}/flame-graph.svg', HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'serialize &lt;Client&gt;', response.content)
+
+        response = self.client.get(f'/admin/monitoring/requestprofile/{profile.pk}/change/', HTTP_HOST='localhost')
+        self.assertContains(response, '<svg')
+        self.assertContains(response, 'b.py:3')
+
+    def test_flame_graph_without_samples(self):
+        self.assertIn('No samples', render_flame_graph(''))
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SlowQueryLogTests(TestCase):
+    """Slow queries are queued with their call site, then aggregated and explained"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        logging.disable(logging.ERROR)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='x', first_name='Plain', last_name='User')
+
+    def capture(self, duration_ms):
+        capture_slow_query(
+            'default', 'SELECT * FROM "users_user" WHERE "users_user"."email" = ?', 'apps/users/views.py:10 in view',
+            'user-detail', duration_ms,
+            {'sql': 'SELECT * FROM "users_user" WHERE "users_user"."email" = %s', 'params': ['user@example.com']},
+        )
+
+    def get_clients(self, **settings):
+        token = RefreshToken.for_user(self.user).access_token
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0, **settings), \
+                mock.patch.object(capture_slow_query, 'apply_async') as apply_async:
+            response = self.client.get('/api/clients/', HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {token}')
+            capture_sender.flush()
+        self.assertEqual(response.status_code, 200)
+        return [call.kwargs['args'] for call in apply_async.call_args_list]
+
+    def test_slow_request_queries_are_queued(self):
+        captured = self.get_clients()
+        self.assertTrue(captured)
+        alias, shape, site, view, duration_ms, statement = captured[-1]
+        self.assertEqual(view, 'client-list')
+        self.assertEqual(site, 'ClientViewSet.paginate_queryset')
+        self.assertNotIn(self.user.email, shape)
+        # The query has parameters, which stay out of the broker by default
+        self.assertIsNone(statement)
+
+    def test_parameters_are_sent_when_opted_in(self):
+        captured = self.get_clients(SLOW_QUERY_EXPLAIN_PARAMS=True)
+        statement = captured[-1][-1]
+        self.assertIn('%s', statement['sql'])
+        self.assertTrue(statement['params'])
+
+    def test_request_does_not_wait_for_the_broker(self):
+        released = threading.Event()
+        senders = []
+
+        def publish(**kwargs):
+            senders.append(threading.current_thread())
+            released.wait(10)
+
+        token = RefreshToken.for_user(self.user).access_token
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0), \
+                mock.patch.object(capture_slow_query, 'apply_async', side_effect=publish):
+            response = self.client.get('/api/clients/', HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {token}')
+            released.set()
+            capture_sender.flush()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(senders)
+        self.assertNotIn(threading.current_thread(), senders)
+
+    def test_capture_aggregates_and_explains(self):
+        self.capture(300.0)
+        self.capture(500.0)
+
+        query = SlowQuery.objects.get()
+        self.assertEqual(query.count, 2)
+        self.assertEqual(query.total_ms, 800.0)
+        self.assertEqual(query.max_ms, 500.0)
+        self.assertEqual(query.view_name, 'user-detail')
+        self.assertIn('users_user', query.plan)
+        self.assertIsNotNone(query.plan_captured_at)
+
+    def test_report(self):
+        self.capture(300.0)
+        output = StringIO()
+        call_command('slow_queries', '--plans', stdout=output)
+        self.assertIn('apps/users/views.py:10 in view', output.getvalue())
+        self.assertIn('users_user', output.getvalue())
@@ -0,0 +1,140 @@
+"""
+OpenTelemetry tracing for InvoiceFlow
+
+Tracing is off unless TRACING_EXPORTER is 'otlp', to send spans to a
+collector at OTEL_EXPORTER_OTLP_ENDPOINT, or 'file', to append them as JSON
+lines to TRACING_FILE. configure_tracing() runs when the app registry is
+ready, in web and Celery worker processes alike, and traces:
+
+- every request, with a span per view
+- every SQL query, as an execute_wrapper on each new connection; the
+  statement is normalized with query_shape() so no values are exported
+- every Redis command, which covers the Django cache, the throttles and
+  the Celery broker
+- serializer validation, serializer output and JSON rendering
+- Celery tasks, with the trace context carried in the message headers so
+  a task joins the trace of the request that queued it
+
+New traces are sampled at TRACING_SAMPLE_RATIO and child spans follow
+their parent's decision. Query and serializer spans are only created
+inside a sampled span, so unsampled requests cost almost nothing.
+"""
+
+import functools
+import logging
+import os
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from opentelemetry import trace
+from opentelemetry.trace import SpanKind
+
+from .queries import query_shape
+
+logger = logging.getLogger(__name__)
+
+tracer = trace.get_tracer('invoiceflow')
+
+_configured = False
+
+
+def _recording():
+    return trace.get_current_span().is_recording()
+
+
+def trace_query(execute, sql, params, many, context):
+    """execute_wrapper that runs each query in a span"""
+    if not _recording():
+        return execute(sql, params, many, context)
+    connection = context['connection']
+    operation = sql.split(None, 1)[0].upper() if sql else 'SQL'
+    attributes = {
+        'db.system': connection.vendor,
+        'db.name': str(connection.settings_dict.get('NAME') or ''),
+        'db.statement': query_shape(sql),
+    }
+    with tracer.start_as_current_span(operation, kind=SpanKind.CLIENT, attributes=attributes):
+        return execute(sql, params, many, context)
+
+
+def _install_query_tracing(sender, connection, **kwargs):
+    if trace_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(trace_query)
+
+
+def _traced(name_of):
+    """Decorate a method so it runs in a span named by `name_of(self)` when tracing"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not _recording():
+                return method(self, *args, **kwargs)
+            with tracer.start_as_current_span(name_of(self)):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _serializer_name(serializer):
+    child = getattr(serializer, 'child', None)
+    return f'{type(child).__name__}[]' if child is not None else type(serializer).__name__
+
+
+def _instrument_rest_framework():
+    from rest_framework import renderers, serializers
+
+    serializers.BaseSerializer.is_valid = _traced(
+        lambda self: f'{_serializer_name(self)}.is_valid'
+    )(serializers.BaseSerializer.is_valid)
+    # Only top-level serializers go through .data; nested ones are part of their parent's span
+    for cls in (serializers.Serializer, serializers.ListSerializer):
+        cls.data = property(_traced(lambda self: f'{_serializer_name(self)}.data')(cls.data.fget))
+    renderers.JSONRenderer.render = _traced(lambda self: 'JSONRenderer.render')(renderers.JSONRenderer.render)
+
+
+def _exporter():
+    if settings.TRACING_EXPORTER == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    if settings.TRACING_EXPORTER == 'file':
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        return ConsoleSpanExporter(
+            out=open(settings.TRACING_FILE, 'a', buffering=1),
+            formatter=lambda span: span.to_json(indent=None) + os.linesep,
+        )
+    raise ValueError(f"TRACING_EXPORTER must be 'otlp' or 'file', not {settings.TRACING_EXPORTER!r}")
+
+
+def configure_tracing():
+    """Set up the tracer provider and instrumentation, once per process"""
+    global _configured
+    if _configured or not settings.TRACING_EXPORTER:
+        return
+    _configured = True
+
+    from opentelemetry.instrumentation.celery import CeleryInstrumentor
+    from opentelemetry.instrumentation.django import DjangoInstrumentor
+    from opentelemetry.instrumentation.redis import RedisInstrumentor
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    # Batch processors restart their export thread in forked children
+    provider = TracerProvider(
+        resource=Resource.create({'service.name': settings.TRACING_SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(settings.TRACING_SAMPLE_RATIO)),
+    )
+    provider.add_span_processor(BatchSpanProcessor(_exporter()))
+    trace.set_tracer_provider(provider)
+
+    DjangoInstrumentor().instrument()
+    RedisInstrumentor().instrument()
+    CeleryInstrumentor().instrument()
+    _instrument_rest_framework()
+    connection_created.connect(_install_query_tracing, dispatch_uid='monitoring.trace_query')
+
+    logger.info(
+        'Tracing to %s, sampling %.1f%% of new traces',
+        settings.TRACING_EXPORTER, settings.TRACING_SAMPLE_RATIO * 100
+    )
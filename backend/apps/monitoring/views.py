@@ -0,0 +1,30 @@
+"""
+Prometheus scrape endpoint for InvoiceFlow
+"""
+
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from .metrics import build_registry
+
+
+@require_GET
+def metrics_view(request):
+    """
+    GET /metrics
+
+    Scrapers must send METRICS_AUTH_TOKEN as a bearer token. Without a
+    token the endpoint is only open when DEBUG is on.
+    """
+    token = settings.METRICS_AUTH_TOKEN
+    if token:
+        expected = f'Bearer {token}'.encode()
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), expected):
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(build_registry()), content_type=CONTENT_TYPE_LATEST)
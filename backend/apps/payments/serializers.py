@@ -25,7 +25,7 @@ class PaymentSerializer(serializers.ModelSerializer):
     def validate_invoice(self, value):
         """Validate that invoice belongs to the current user"""
         user = self.context['request'].user
-        if value.user != user:
+        if value.user_id != user.pk:
             raise serializers.ValidationError("You don't have permission to add payments to this invoice.")
         return value
 
@@ -46,7 +46,7 @@ class PaymentCreateSerializer(serializers.ModelSerializer):
     def validate_invoice(self, value):
         """Validate that invoice belongs to the current user"""
         user = self.context['request'].user
-        if value.user != user:
+        if value.user_id != user.pk:
             raise serializers.ValidationError("You don't have permission to add payments to this invoice.")
         return value
 
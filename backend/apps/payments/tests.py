@@ -1,3 +1,35 @@
-from django.test import TestCase
+"""
+Query budget tests for the payment API
+"""
 
-# Create your tests here.
+from django.utils import timezone
+
+from apps.monitoring.testing import QueryBudgetTestCase
+
+
+def payment_url(account):
+    return f'/api/payments/{account.payment.pk}/'
+
+
+class PaymentQueryBudgetTests(QueryBudgetTestCase):
+    """Payments are listed with their invoice and client in one query"""
+
+    def test_list(self):
+        self.assertBudget('get', '/api/payments/', queries=2, size=10 * 1024)
+
+    def test_retrieve(self):
+        self.assertBudget('get', payment_url, queries=1, size=1024)
+
+    def test_create(self):
+        self.assertBudget('post', '/api/payments/', queries=5, size=1024, status=201, data=lambda account: {
+            'invoice': str(account.invoice.pk),
+            'amount': '40.00',
+            'payment_date': str(timezone.localdate()),
+            'payment_method': 'BANK_TRANSFER',
+        })
+
+    def test_update(self):
+        self.assertBudget('patch', payment_url, queries=6, size=1024, data={'notes': 'Wire reference 123'})
+
+    def test_destroy(self):
+        self.assertBudget('delete', payment_url, queries=4, size=0, status=204)
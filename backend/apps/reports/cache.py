@@ -0,0 +1,276 @@
+"""
+Per-user response cache for report endpoints
+
+Cached responses are keyed by a per-user generation counter. Any write to
+a user's invoices, payments, expenses or clients bumps the counter once the
+transaction commits (see apps.reports.signals), so every cached report for
+that user is invalidated with a single increment and old entries simply
+age out.
+
+Expensive reports are filled single-flight: within a process concurrent
+misses share one computation, and across processes a lock taken with
+cache.add() (SET NX on Redis) lets one worker compute while the others
+wait briefly for its result. Entries outlive their fresh period by a
+grace period during which one request refreshes them while the rest are
+served the previous value.
+
+The cache is an optimization only: any cache error is logged and the
+report is computed as if it were a miss.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from apps.monitoring.metrics import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'reports'
+LOCK_POLL_INTERVAL = 0.05
+
+
+def _generation_key(user_id):
+    return f'{KEY_PREFIX}:gen:{user_id}'
+
+
+def _stats_key(name, outcome):
+    return f'{KEY_PREFIX}:stats:{name}:{outcome}'
+
+
+def _new_generation():
+    # Time-based, so a counter that was evicted never restarts at a value
+    # that older cached responses were stored under
+    return time.time_ns()
+
+
+def get_generation(user_id):
+    """Return the user's current cache generation"""
+    key = _generation_key(user_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, _new_generation(), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(user_id):
+    """Invalidate every cached report for the user"""
+    key = _generation_key(user_id)
+    try:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_generation(), timeout=None)
+    except Exception:
+        logger.exception('Could not bump report cache generation for user %s', user_id)
+
+
+def invalidate_reports(user_id):
+    """Bump the user's generation once the current transaction commits"""
+    transaction.on_commit(lambda: bump_generation(user_id))
+
+
+def request_fingerprint(request):
+    """Fingerprint of the request URL, independent of query parameter order"""
+    params = sorted((key, value) for key, values in request.query_params.lists() for value in values)
+    raw = f'{request.get_host()}|{request.path}|{params}'
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _record(name, outcome):
+    record_cache_lookup(f'report:{name}', outcome)
+    key = _stats_key(name, outcome)
+    try:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 0, timeout=None)
+            cache.incr(key)
+    except Exception:
+        logger.warning('Could not record report cache %s for %s', outcome, name)
+
+
+class _Flight:
+    """A computation in progress in this process, shared by concurrent callers"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+        self.failed = False
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _single_flight(key, compute):
+    """
+    Run `compute` once per key in this process; concurrent callers wait for
+    the leader's result. Returns (data, shared).
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        if flight.done.wait(settings.REPORT_CACHE_LOCK_WAIT) and not flight.failed:
+            return flight.data, True
+        # The leader failed or is too slow, so compute independently
+        return compute(), False
+
+    try:
+        flight.data = compute()
+    except BaseException:
+        flight.failed = True
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+    return flight.data, False
+
+
+def _acquire(lock_key, token):
+    """Take the cross-process fill lock: True, False if held elsewhere, None if the cache is down"""
+    try:
+        return bool(cache.add(lock_key, token, timeout=settings.REPORT_CACHE_LOCK_TIMEOUT))
+    except Exception:
+        logger.warning('Report cache unavailable, using the local lock only', exc_info=True)
+        return None
+
+
+def _release(lock_key, token):
+    try:
+        # The lock may have expired and been taken over by another worker
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+    except Exception:
+        logger.warning('Could not release report cache lock %s', lock_key)
+
+
+def _get_entry(key):
+    try:
+        return cache.get(key)
+    except Exception:
+        logger.warning('Report cache unavailable', exc_info=True)
+        return None
+
+
+def _store(key, data):
+    """Cache `data` as fresh for REPORT_CACHE_TIMEOUT, then stale for REPORT_CACHE_STALE_TIMEOUT"""
+    entry = (time.time() + settings.REPORT_CACHE_TIMEOUT, data)
+    try:
+        cache.set(key, entry, timeout=settings.REPORT_CACHE_TIMEOUT + settings.REPORT_CACHE_STALE_TIMEOUT)
+    except Exception:
+        logger.warning('Could not cache %s', key, exc_info=True)
+
+
+def _compute_and_store(key, lock_key, compute):
+    """Fill an empty cache entry, letting only one worker across processes compute it"""
+    token = uuid.uuid4().hex
+    locked = _acquire(lock_key, token)
+    if locked is False:
+        # Another process is computing this entry: wait briefly for it
+        deadline = time.monotonic() + settings.REPORT_CACHE_LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            entry = _get_entry(key)
+            if entry is not None:
+                return entry[1], 'HIT'
+
+    try:
+        data = compute()
+        if locked is not None:
+            _store(key, data)
+    finally:
+        if locked:
+            _release(lock_key, token)
+    return data, 'MISS'
+
+
+def cached_report(user_id, name, fingerprint, compute):
+    """
+    Return (data, outcome) for a report, computing and caching it on a miss.
+
+    `name` identifies the report for statistics and `fingerprint` its
+    parameters. `outcome` is one of:
+
+    HIT: served from the cache, or from a computation another request ran
+    MISS: computed by this request
+    STALE: the entry is past its fresh period and another request is
+        recomputing it, so the previous value was served
+
+    Stale values are only ever served within the same generation, so a
+    write is never hidden behind a stale response.
+    """
+    try:
+        key = f'{KEY_PREFIX}:resp:{user_id}:{get_generation(user_id)}:{name}:{fingerprint}'
+    except Exception:
+        logger.warning('Report cache unavailable, computing %s', name, exc_info=True)
+        key = None
+
+    if key is None:
+        # No shared cache: still coalesce concurrent requests in this process
+        data, shared = _single_flight(f'{user_id}:{name}:{fingerprint}', compute)
+        outcome = 'HIT' if shared else 'MISS'
+        _record(name, outcome.lower())
+        return data, outcome
+
+    lock_key = f'{key}:lock'
+    entry = _get_entry(key)
+    if entry is not None:
+        fresh_until, data = entry
+        if time.time() < fresh_until:
+            _record(name, 'hit')
+            return data, 'HIT'
+
+        token = uuid.uuid4().hex
+        if not _acquire(lock_key, token):
+            _record(name, 'stale')
+            return data, 'STALE'
+        try:
+            data = compute()
+            _store(key, data)
+        finally:
+            _release(lock_key, token)
+        _record(name, 'miss')
+        return data, 'MISS'
+
+    (data, outcome), shared = _single_flight(key, lambda: _compute_and_store(key, lock_key, compute))
+    outcome = 'HIT' if shared else outcome
+    _record(name, outcome.lower())
+    return data, outcome
+
+
+def cache_stats(names):
+    """Hit, miss and stale counters for the given report names"""
+    outcomes = ('hit', 'miss', 'stale')
+    keys = {(name, outcome): _stats_key(name, outcome) for name in names for outcome in outcomes}
+    try:
+        values = cache.get_many(list(keys.values()))
+    except Exception:
+        logger.warning('Report cache unavailable, no statistics', exc_info=True)
+        values = {}
+
+    stats = {}
+    for name in names:
+        hits = values.get(keys[(name, 'hit')], 0)
+        misses = values.get(keys[(name, 'miss')], 0)
+        stale = values.get(keys[(name, 'stale')], 0)
+        total = hits + misses + stale
+        stats[name] = {
+            'hits': hits,
+            'misses': misses,
+            'stale': stale,
+            'hit_ratio': round((hits + stale) / total, 4) if total else None,
+        }
+    return stats
@@ -0,0 +1,185 @@
+"""
+Client payment metrics for InvoiceFlow
+
+Days-to-pay, late-payment ratio and days sales outstanding (DSO) need
+every invoice of a client joined with its payments, which is too slow to
+compute on each request. They are stored per client in
+ClientPaymentMetrics instead: recomputed for every client by a nightly
+task, and in between for clients whose invoices or payments changed, which
+the signals in apps.reports.signals mark dirty.
+
+Definitions:
+
+days to pay: issue date to the last payment of a paid invoice, or to the
+    day it was marked paid when no payment was recorded
+late: settled after its due date
+DSO: open balance / amount invoiced in the last DSO_WINDOW_DAYS
+    * DSO_WINDOW_DAYS
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from apps.clients.models import Client
+from apps.invoices.models import Invoice
+from apps.payments.models import Payment
+
+from .cache import bump_generation
+from .models import ClientMetricsDirty, ClientPaymentMetrics
+
+BATCH_SIZE = 500
+DSO_WINDOW_DAYS = 90
+OPEN_STATUSES = ['SENT', 'OVERDUE']
+
+ONE_DECIMAL = Decimal('0.1')
+RATIO = Decimal('0.0001')
+
+
+def mark_client_dirty(client_ids):
+    """
+    Mark clients whose payment metrics must be recomputed.
+
+    An existing marker is updated rather than skipped, so that the write
+    waits for a refresh holding the marker's lock and re-marks the client
+    once that refresh commits. Clients are upserted in id order, the order
+    refresh_client_metrics() locks them in.
+    """
+    client_ids = sorted({client_id for client_id in client_ids if client_id is not None})
+    if client_ids:
+        ClientMetricsDirty.objects.bulk_create(
+            [ClientMetricsDirty(client_id=client_id) for client_id in client_ids],
+            update_conflicts=True,
+            unique_fields=['client'],
+            update_fields=['marked_at'],
+        )
+
+
+def _days(value):
+    return Decimal(float(value)).quantize(ONE_DECIMAL)
+
+
+def compute_client_metrics(client_ids, today=None):
+    """Compute unsaved metrics rows for the given clients with four grouped queries"""
+    today = today or timezone.localdate()
+    now = timezone.now()
+
+    settled = Invoice.objects.filter(client_id__in=client_ids, status='PAID').annotate(
+        settled_on=Coalesce(Max('payments__payment_date'), TruncDate('paid_at'))
+    ).values_list('client_id', 'issue_date', 'due_date', 'settled_on').order_by()
+
+    days_to_pay = defaultdict(list)
+    late = defaultdict(int)
+    for client_id, issue_date, due_date, settled_on in settled:
+        if settled_on is None:
+            continue
+        days_to_pay[client_id].append((settled_on - issue_date).days)
+        if settled_on > due_date:
+            late[client_id] += 1
+
+    open_totals = dict(Invoice.objects.filter(
+        client_id__in=client_ids, status__in=OPEN_STATUSES
+    ).values('client_id').annotate(total=Sum('total_amount')).values_list('client_id', 'total').order_by())
+
+    open_paid = dict(Payment.objects.filter(
+        invoice__client_id__in=client_ids, invoice__status__in=OPEN_STATUSES
+    ).values('invoice__client_id').annotate(total=Sum('amount')).values_list('invoice__client_id', 'total').order_by())
+
+    recent_sales = dict(Invoice.objects.filter(
+        client_id__in=client_ids, issue_date__gt=today - timedelta(days=DSO_WINDOW_DAYS)
+    ).exclude(status__in=['DRAFT', 'CANCELLED']).values('client_id').annotate(
+        total=Sum('total_amount')
+    ).values_list('client_id', 'total').order_by())
+
+    clients = Client.objects.filter(pk__in=client_ids).values_list('pk', 'user_id')
+    metrics = []
+    for client_id, user_id in clients:
+        days = days_to_pay.get(client_id, [])
+        outstanding = max(
+            (open_totals.get(client_id) or Decimal('0.00')) - (open_paid.get(client_id) or Decimal('0.00')),
+            Decimal('0.00')
+        )
+        sales = recent_sales.get(client_id)
+
+        metrics.append(ClientPaymentMetrics(
+            client_id=client_id,
+            user_id=user_id,
+            paid_invoice_count=len(days),
+            late_invoice_count=late[client_id],
+            avg_days_to_pay=_days(np.mean(days)) if days else None,
+            p90_days_to_pay=_days(np.percentile(days, 90)) if days else None,
+            late_ratio=(Decimal(late[client_id]) / len(days)).quantize(RATIO) if days else None,
+            outstanding_amount=outstanding,
+            dso=(outstanding / sales * DSO_WINDOW_DAYS).quantize(ONE_DECIMAL) if sales else None,
+            computed_at=now,
+        ))
+    return metrics
+
+
+def _replace_metrics(client_ids):
+    """Recompute and overwrite the metrics of the given clients, returning their owners"""
+    metrics = compute_client_metrics(client_ids)
+    ClientPaymentMetrics.objects.filter(client_id__in=client_ids).delete()
+    ClientPaymentMetrics.objects.bulk_create(metrics)
+    return {row.user_id for row in metrics}
+
+
+def refresh_client_metrics(skip_locked=False):
+    """
+    Recompute every dirty client and return how many were refreshed.
+
+    Dirty rows are locked while their clients are recomputed. A concurrent
+    write to one of those clients blocks in mark_client_dirty() until the
+    refresh commits, then marks the client again, so its change is picked
+    up by the next refresh.
+    """
+    refreshed = 0
+    users = set()
+    while True:
+        with transaction.atomic():
+            dirty = list(
+                ClientMetricsDirty.objects.select_for_update(skip_locked=skip_locked).order_by(
+                    'client_id'
+                ).values_list('client_id', flat=True)[:BATCH_SIZE]
+            )
+            if not dirty:
+                break
+            users |= _replace_metrics(dirty)
+            ClientMetricsDirty.objects.filter(client_id__in=dirty).delete()
+        refreshed += len(dirty)
+
+    # Cached client reports include these metrics
+    for user_id in users:
+        bump_generation(user_id)
+    return refreshed
+
+
+def rebuild_client_metrics(user_id=None):
+    """Recompute the metrics of every client, or of one user's clients"""
+    clients = Client.objects.order_by('pk').values_list('pk', flat=True)
+    if user_id is not None:
+        clients = clients.filter(user_id=user_id)
+
+    rebuilt = 0
+    users = set()
+    last = None
+    while True:
+        batch = clients.filter(pk__gt=last) if last is not None else clients
+        batch = list(batch[:BATCH_SIZE])
+        if not batch:
+            break
+        with transaction.atomic():
+            ClientMetricsDirty.objects.filter(client_id__in=batch).delete()
+            users |= _replace_metrics(batch)
+        rebuilt += len(batch)
+        last = batch[-1]
+
+    for user_id in users:
+        bump_generation(user_id)
+    return rebuilt
@@ -0,0 +1,126 @@
+"""
+Management command to benchmark dashboard computation at scale
+"""
+
+import random
+import statistics
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.clients.models import Client
+from apps.expenses.models import Expense
+from apps.invoices.models import Invoice
+from apps.reports.rollups import rebuild_rollups
+from apps.reports.services import build_dashboard
+from apps.users.models import User
+
+
+class Rollback(Exception):
+    """Raised to discard the benchmark data"""
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks dashboard latency and query count for a user with many invoices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=100000, help='Invoices for the benchmark user')
+        parser.add_argument('--clients', type=int, default=50, help='Clients for the benchmark user')
+        parser.add_argument('--runs', type=int, default=10, help='Timed dashboard computations')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the generated data')
+        parser.add_argument('--max-ms', type=float, help='Fail if the median latency exceeds this many ms')
+        parser.add_argument('--max-queries', type=int, help='Fail if a computation issues more queries')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        user = User.objects.create_user(
+            email=f'benchmark-{uuid.uuid4().hex[:12]}@invoiceflow.local',
+            first_name='Benchmark',
+            last_name='User',
+        )
+
+        self.stdout.write(f"Generating {options['invoices']} invoices...")
+        started = time.perf_counter()
+        self.generate(user, rng, options['clients'], options['invoices'])
+        self.stdout.write(self.style.SUCCESS(f' Generated data in {time.perf_counter() - started:.1f}s'))
+
+        # Warm up connection and query caches
+        build_dashboard(user)
+
+        timings = []
+        query_counts = []
+        for _ in range(options['runs']):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                build_dashboard(user)
+                timings.append((time.perf_counter() - started) * 1000)
+            query_counts.append(len(queries))
+
+        median = statistics.median(timings)
+        self.stdout.write(
+            f"dashboard  invoices={options['invoices']}  runs={options['runs']}  "
+            f"median={median:.1f}ms  min={min(timings):.1f}ms  max={max(timings):.1f}ms  "
+            f"queries={max(query_counts)}  db={connection.vendor}"
+        )
+
+        if options['max_ms'] is not None and median > options['max_ms']:
+            raise CommandError(f"Median latency {median:.1f}ms exceeds {options['max_ms']}ms")
+        if options['max_queries'] is not None and max(query_counts) > options['max_queries']:
+            raise CommandError(f"{max(query_counts)} queries exceeds {options['max_queries']}")
+
+    def generate(self, user, rng, client_count, invoice_count):
+        """Bulk insert clients, invoices and expenses, bypassing model save() hooks and signals"""
+        clients = Client.objects.bulk_create([
+            Client(user=user, name=f'Client {i}', email=f'client{i}@example.com')
+            for i in range(client_count)
+        ])
+
+        now = timezone.now()
+        today = now.date()
+        prefix = uuid.uuid4().hex[:8]
+        statuses = ['DRAFT', 'SENT', 'PAID', 'PAID', 'PAID', 'OVERDUE', 'CANCELLED']
+
+        invoices = []
+        for i in range(invoice_count):
+            issue_date = today - timedelta(days=rng.randint(0, 540))
+            status = rng.choice(statuses)
+            total = Decimal(rng.randint(5000, 500000)) / 100
+            invoices.append(Invoice(
+                user=user,
+                client=rng.choice(clients),
+                invoice_number=f'BENCH-{prefix}-{i:07d}',
+                issue_date=issue_date,
+                due_date=issue_date + timedelta(days=30),
+                status=status,
+                subtotal=total,
+                total_amount=total,
+                sent_at=now if status != 'DRAFT' else None,
+                paid_at=now - timedelta(days=rng.randint(0, 400)) if status == 'PAID' else None,
+            ))
+        Invoice.objects.bulk_create(invoices, batch_size=2000)
+
+        Expense.objects.bulk_create([
+            Expense(
+                user=user,
+                description=f'Expense {i}',
+                amount=Decimal(rng.randint(100, 50000)) / 100,
+                expense_date=today - timedelta(days=rng.randint(0, 365)),
+            )
+            for i in range(invoice_count // 10)
+        ], batch_size=2000)
+
+        rebuild_rollups(user.pk)
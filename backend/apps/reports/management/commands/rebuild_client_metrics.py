@@ -0,0 +1,35 @@
+"""
+Management command to rebuild client payment metrics from raw data
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.reports.client_metrics import rebuild_client_metrics, refresh_client_metrics
+from apps.users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Recomputes days-to-pay, late-payment ratio and DSO per client'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', help='Email of a user to rebuild (repeatable, default all)')
+        parser.add_argument('--dirty', action='store_true', help='Only recompute clients changed since the last run')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['dirty']:
+            count = refresh_client_metrics()
+        elif options['user']:
+            users = User.objects.filter(email__in=options['user'])
+            missing = set(options['user']) - set(users.values_list('email', flat=True))
+            if missing:
+                raise CommandError(f"Unknown user(s): {', '.join(sorted(missing))}")
+            count = sum(rebuild_client_metrics(user_id) for user_id in users.values_list('id', flat=True))
+        else:
+            count = rebuild_client_metrics()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated payment metrics for {count} client(s) in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,39 @@
+"""
+Management command to rebuild report rollups from raw data
+"""
+
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.reports.rollups import rebuild_rollups
+from apps.users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Recomputes daily report rollups from invoices, payments and expenses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', help='Email of a user to rebuild (repeatable, default all)')
+        parser.add_argument('--from', dest='start_date', type=date.fromisoformat, help='Only rebuild days on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end_date', type=date.fromisoformat, help='Only rebuild days on or before this date (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('email')
+        if options['user']:
+            users = users.filter(email__in=options['user'])
+            missing = set(options['user']) - set(users.values_list('email', flat=True))
+            if missing:
+                raise CommandError(f"Unknown user(s): {', '.join(sorted(missing))}")
+
+        started = time.perf_counter()
+        count = 0
+        for user_id, email in users.values_list('id', 'email').iterator():
+            rebuild_rollups(user_id, options['start_date'], options['end_date'])
+            count += 1
+            self.stdout.write(f' Rebuilt rollups for {email}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt rollups for {count} user(s) in {time.perf_counter() - started:.1f}s'
+        ))
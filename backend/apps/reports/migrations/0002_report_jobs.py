@@ -0,0 +1,46 @@
+# Generated by Django 5.0.6 on 2026-10-19 08:06
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('report_type', models.CharField(choices=[('INCOME', 'Income'), ('EXPENSES', 'Expenses'), ('CLIENTS', 'Clients'), ('TIMESERIES', 'Time Series')], max_length=20)),
+                ('parameters', models.JSONField(blank=True, default=dict)),
+                ('parameters_hash', models.CharField(editable=False, max_length=64)),
+                ('notify', models.BooleanField(default=False, help_text='Email the user when the report is ready')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('COMPLETE', 'Complete'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('result', models.BinaryField(blank=True, help_text='Gzip-compressed JSON result', null=True)),
+                ('result_size', models.PositiveIntegerField(blank=True, help_text='Uncompressed result size in bytes', null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Report Job',
+                'verbose_name_plural': 'Report Jobs',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', '-created_at'], name='reports_rep_user_id_b0889a_idx'), models.Index(fields=['expires_at'], name='reports_rep_expires_93fccc_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='reportjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['PENDING', 'RUNNING'])), fields=('user', 'report_type', 'parameters_hash'), name='unique_in_flight_report_job'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.0.6 on 2026-10-19 08:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0002_initial'),
+        ('reports', '0002_report_jobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientMetricsDirty',
+            fields=[
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='metrics_dirty', serialize=False, to='clients.client')),
+                ('marked_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Client Metrics Dirty',
+                'verbose_name_plural': 'Client Metrics Dirty',
+                'ordering': ['marked_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ClientPaymentMetrics',
+            fields=[
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='payment_metrics', serialize=False, to='clients.client')),
+                ('paid_invoice_count', models.PositiveIntegerField(default=0)),
+                ('late_invoice_count', models.PositiveIntegerField(default=0)),
+                ('avg_days_to_pay', models.DecimalField(blank=True, decimal_places=1, max_digits=8, null=True)),
+                ('p90_days_to_pay', models.DecimalField(blank=True, decimal_places=1, max_digits=8, null=True)),
+                ('late_ratio', models.DecimalField(blank=True, decimal_places=4, max_digits=5, null=True)),
+                ('outstanding_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('dso', models.DecimalField(blank=True, decimal_places=1, max_digits=10, null=True)),
+                ('computed_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='client_payment_metrics', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Client Payment Metrics',
+                'verbose_name_plural': 'Client Payment Metrics',
+                'ordering': ['-computed_at'],
+                'indexes': [models.Index(fields=['user', 'dso'], name='reports_cli_user_id_e42200_idx'), models.Index(fields=['user', 'avg_days_to_pay'], name='reports_cli_user_id_7786b2_idx'), models.Index(fields=['user', 'late_ratio'], name='reports_cli_user_id_6e43e2_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,262 @@
-from django.db import models
+"""
+Reporting models for InvoiceFlow
 
-# Create your models here.
+Reports read the per-user daily rollups instead of aggregating raw
+invoices, payments and expenses, so their cost depends on the number of
+days in the range rather than on account history. Rollup rows are
+maintained by apps.reports.rollups.
+"""
+
+import gzip
+import hashlib
+import json
+import uuid
+
+from django.db import models, transaction
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from apps.expenses.models import Expense
+
+
+class DailyRollup(models.Model):
+    """Per-user invoice, payment and expense totals for one day"""
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='daily_rollups')
+    date = models.DateField()
+
+    # Invoices issued that day (drafts and cancelled invoices excluded)
+    invoiced_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    invoiced_count = models.PositiveIntegerField(default=0)
+
+    # Invoices marked paid that day
+    income_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    income_count = models.PositiveIntegerField(default=0)
+
+    # Payments received that day
+    paid_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid_count = models.PositiveIntegerField(default=0)
+
+    # Expenses incurred that day
+    expense_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expense_count = models.PositiveIntegerField(default=0)
+    tax_deductible_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Daily Rollup'
+        verbose_name_plural = 'Daily Rollups'
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_daily_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} - {self.date}"
+
+
+class DailyExpenseCategoryRollup(models.Model):
+    """Per-user expense totals for one category on one day"""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='daily_expense_category_rollups'
+    )
+    date = models.DateField()
+    category = models.CharField(max_length=50, choices=Expense.CATEGORY_CHOICES)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Daily Expense Category Rollup'
+        verbose_name_plural = 'Daily Expense Category Rollups'
+        ordering = ['-date', 'category']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date', 'category'], name='unique_daily_expense_category_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} - {self.date} - {self.category}"
+
+
+class RollupDirtyDay(models.Model):
+    """A day whose rollups are stale and must be recomputed"""
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='rollup_dirty_days')
+    date = models.DateField()
+    marked_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Rollup Dirty Day'
+        verbose_name_plural = 'Rollup Dirty Days'
+        ordering = ['marked_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_rollup_dirty_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.date}"
+
+
+class ClientPaymentMetrics(models.Model):
+    """How quickly a client pays, materialized by apps.reports.client_metrics"""
+
+    client = models.OneToOneField(
+        'clients.Client', on_delete=models.CASCADE, primary_key=True, related_name='payment_metrics'
+    )
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='client_payment_metrics')
+
+    # Paid invoices, measured from issue date to the day they were settled
+    paid_invoice_count = models.PositiveIntegerField(default=0)
+    late_invoice_count = models.PositiveIntegerField(default=0)
+    avg_days_to_pay = models.DecimalField(max_digits=8, decimal_places=1, null=True, blank=True)
+    p90_days_to_pay = models.DecimalField(max_digits=8, decimal_places=1, null=True, blank=True)
+    late_ratio = models.DecimalField(max_digits=5, decimal_places=4, null=True, blank=True)
+
+    # Days sales outstanding: open balance relative to recent invoicing
+    outstanding_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    dso = models.DecimalField(max_digits=10, decimal_places=1, null=True, blank=True)
+
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Client Payment Metrics'
+        verbose_name_plural = 'Client Payment Metrics'
+        ordering = ['-computed_at']
+        indexes = [
+            models.Index(fields=['user', 'dso']),
+            models.Index(fields=['user', 'avg_days_to_pay']),
+            models.Index(fields=['user', 'late_ratio']),
+        ]
+
+    def __str__(self):
+        return f"{self.client_id} - DSO {self.dso}"
+
+
+class ClientMetricsDirty(models.Model):
+    """A client whose payment metrics are stale and must be recomputed"""
+
+    client = models.OneToOneField(
+        'clients.Client', on_delete=models.CASCADE, primary_key=True, related_name='metrics_dirty'
+    )
+    marked_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Client Metrics Dirty'
+        verbose_name_plural = 'Client Metrics Dirty'
+        ordering = ['marked_at']
+
+    def __str__(self):
+        return str(self.client_id)
+
+
+class ReportJob(models.Model):
+    """Report computed in the background, with a compressed, expiring result"""
+
+    REPORT_TYPE_CHOICES = [
+        ('INCOME', 'Income'),
+        ('EXPENSES', 'Expenses'),
+        ('CLIENTS', 'Clients'),
+        ('TIMESERIES', 'Time Series'),
+    ]
+
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('COMPLETE', 'Complete'),
+        ('FAILED', 'Failed'),
+    ]
+
+    IN_FLIGHT_STATUSES = ['PENDING', 'RUNNING']
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='report_jobs')
+
+    # Request
+    report_type = models.CharField(max_length=20, choices=REPORT_TYPE_CHOICES)
+    parameters = models.JSONField(default=dict, blank=True)
+    parameters_hash = models.CharField(max_length=64, editable=False)
+    notify = models.BooleanField(default=False, help_text='Email the user when the report is ready')
+
+    # Outcome
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    result = models.BinaryField(null=True, blank=True, help_text='Gzip-compressed JSON result')
+    result_size = models.PositiveIntegerField(null=True, blank=True, help_text='Uncompressed result size in bytes')
+    error = models.TextField(blank=True)
+
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Report Job'
+        verbose_name_plural = 'Report Jobs'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+            models.Index(fields=['expires_at']),
+        ]
+        constraints = [
+            # Identical requests coalesce onto the job already queued or running
+            models.UniqueConstraint(
+                fields=['user', 'report_type', 'parameters_hash'],
+                condition=models.Q(status__in=['PENDING', 'RUNNING']),
+                name='unique_in_flight_report_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_report_type_display()} report {self.id} ({self.status})"
+
+    def save(self, *args, **kwargs):
+        """Override save to fingerprint the parameters"""
+        self.parameters_hash = self.hash_parameters(self.parameters)
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def hash_parameters(parameters):
+        """Stable fingerprint of a parameter dict"""
+        canonical = json.dumps(parameters, sort_keys=True, separators=(',', ':'), cls=JSONEncoder)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def schedule(self):
+        """Queue the report on the reports queue once the transaction commits"""
+        from .tasks import run_report_job
+
+        job_id = str(self.pk)
+        transaction.on_commit(lambda: run_report_job.delay(job_id))
+
+    @property
+    def is_expired(self):
+        return self.expires_at is not None and self.expires_at <= timezone.now()
+
+    def _update(self, *fields):
+        """Write `fields` to the job's row, returning False if the job has been deleted"""
+        return ReportJob.objects.filter(pk=self.pk).update(**{field: getattr(self, field) for field in fields}) > 0
+
+    def store_result(self, data):
+        """
+        Compress and store the report result, starting its expiry clock.
+
+        Returns False if the job was deleted while it ran.
+        """
+        payload = json.dumps(data, cls=JSONEncoder, separators=(',', ':')).encode()
+        now = timezone.now()
+        self.result = gzip.compress(payload, compresslevel=6)
+        self.result_size = len(payload)
+        self.status = 'COMPLETE'
+        self.completed_at = now
+        self.expires_at = now + settings.REPORT_JOB_RESULT_TTL
+        return self._update('result', 'result_size', 'status', 'completed_at', 'expires_at')
+
+    def mark_failed(self, error):
+        """Record a failed run, returning False if the job was deleted while it ran"""
+        now = timezone.now()
+        self.status = 'FAILED'
+        self.error = error
+        self.completed_at = now
+        self.expires_at = now + settings.REPORT_JOB_RESULT_TTL
+        return self._update('status', 'error', 'completed_at', 'expires_at')
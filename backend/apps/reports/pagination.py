@@ -0,0 +1,21 @@
+"""
+Pagination for report detail rows
+"""
+
+from rest_framework.pagination import CursorPagination
+
+
+class ReportCursorPagination(CursorPagination):
+    """Cursor pagination for report rows; stable under concurrent inserts"""
+
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class IncomeReportPagination(ReportCursorPagination):
+    ordering = ('-paid_at', '-id')
+
+
+class ExpenseReportPagination(ReportCursorPagination):
+    ordering = ('-expense_date', '-id')
@@ -0,0 +1,164 @@
+"""
+Daily rollup maintenance for InvoiceFlow
+
+Writes to invoices, payments and expenses mark the affected (user, day)
+pairs dirty in the same transaction (see apps.reports.signals). Dirty days
+are recomputed from the raw rows by a periodic Celery task, and by reports
+right before they read, so reports never serve stale totals.
+
+Recomputing a day from scratch, rather than applying deltas, keeps status
+changes, edits that move a row to another day and deletes simple to get right.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+from apps.expenses.models import Expense
+from apps.invoices.models import Invoice
+from apps.payments.models import Payment
+
+from .models import DailyExpenseCategoryRollup, DailyRollup, RollupDirtyDay
+
+DIRTY_BATCH_SIZE = 500
+WRITE_BATCH_SIZE = 1000
+
+
+def mark_dirty(user_id, dates):
+    """
+    Mark days whose rollups must be recomputed for `user_id`.
+
+    An existing marker is updated rather than skipped, so that the write
+    waits for a refresh holding the marker's lock and re-marks the day once
+    that refresh commits. Days are upserted in date order, the order
+    refresh_rollups() locks them in.
+    """
+    dates = sorted({day for day in dates if day is not None})
+    if dates:
+        RollupDirtyDay.objects.bulk_create(
+            [RollupDirtyDay(user_id=user_id, date=day) for day in dates],
+            update_conflicts=True,
+            unique_fields=['user', 'date'],
+            update_fields=['marked_at'],
+        )
+
+
+def _date_lookup(field, dates=None, start_date=None, end_date=None):
+    """Filter kwargs restricting `field` to a list of dates or a date range"""
+    if dates is not None:
+        return {f'{field}__in': dates}
+    lookup = {}
+    if start_date:
+        lookup[f'{field}__gte'] = start_date
+    if end_date:
+        lookup[f'{field}__lte'] = end_date
+    return lookup
+
+
+def compute_rollups(user_id, **scope):
+    """
+    Compute unsaved rollup rows for the days in `scope`.
+
+    `scope` is either ``dates=[...]`` or ``start_date``/``end_date``; with
+    neither, every day with activity is computed. Uses four grouped queries.
+    """
+    days = defaultdict(dict)
+
+    invoiced = Invoice.objects.filter(
+        user_id=user_id, **_date_lookup('issue_date', **scope)
+    ).exclude(status__in=['DRAFT', 'CANCELLED']).values('issue_date').annotate(
+        total=Sum('total_amount'), count=Count('id')
+    ).order_by()
+    for row in invoiced:
+        days[row['issue_date']].update(invoiced_amount=row['total'], invoiced_count=row['count'])
+
+    income = Invoice.objects.filter(
+        user_id=user_id, status='PAID', **_date_lookup('paid_at__date', **scope)
+    ).annotate(day=TruncDate('paid_at')).values('day').annotate(
+        total=Sum('total_amount'), count=Count('id')
+    ).order_by()
+    for row in income:
+        days[row['day']].update(income_amount=row['total'], income_count=row['count'])
+
+    paid = Payment.objects.filter(
+        invoice__user_id=user_id, **_date_lookup('payment_date', **scope)
+    ).values('payment_date').annotate(
+        total=Sum('amount'), count=Count('id')
+    ).order_by()
+    for row in paid:
+        days[row['payment_date']].update(paid_amount=row['total'], paid_count=row['count'])
+
+    categories = []
+    expenses = Expense.objects.filter(
+        user_id=user_id, **_date_lookup('expense_date', **scope)
+    ).values('expense_date', 'category').annotate(
+        total=Sum('amount'),
+        count=Count('id'),
+        tax_deductible=Sum('amount', filter=Q(tax_deductible=True))
+    ).order_by()
+    for row in expenses:
+        day = days[row['expense_date']]
+        day['expense_amount'] = day.get('expense_amount', Decimal('0.00')) + row['total']
+        day['expense_count'] = day.get('expense_count', 0) + row['count']
+        day['tax_deductible_amount'] = (
+            day.get('tax_deductible_amount', Decimal('0.00')) + (row['tax_deductible'] or Decimal('0.00'))
+        )
+        categories.append(DailyExpenseCategoryRollup(
+            user_id=user_id,
+            date=row['expense_date'],
+            category=row['category'],
+            amount=row['total'],
+            count=row['count'],
+        ))
+
+    rollups = [DailyRollup(user_id=user_id, date=day, **totals) for day, totals in days.items()]
+    return rollups, categories
+
+
+def _replace_rollups(user_id, **scope):
+    """Recompute and overwrite the rollups for the days in `scope`"""
+    rollups, categories = compute_rollups(user_id, **scope)
+    DailyRollup.objects.filter(user_id=user_id, **_date_lookup('date', **scope)).delete()
+    DailyExpenseCategoryRollup.objects.filter(user_id=user_id, **_date_lookup('date', **scope)).delete()
+    DailyRollup.objects.bulk_create(rollups, batch_size=WRITE_BATCH_SIZE)
+    DailyExpenseCategoryRollup.objects.bulk_create(categories, batch_size=WRITE_BATCH_SIZE)
+
+
+def refresh_rollups(user_id, skip_locked=False):
+    """
+    Recompute the user's dirty days and return how many were refreshed.
+
+    Dirty rows are locked while their days are recomputed. A concurrent
+    write to one of those days blocks in mark_dirty() until the refresh
+    commits, then marks the day again, so its row is picked up by the next
+    refresh.
+    """
+    if not RollupDirtyDay.objects.filter(user_id=user_id).exists():
+        return 0
+
+    refreshed = 0
+    while True:
+        with transaction.atomic():
+            dirty = list(
+                RollupDirtyDay.objects.select_for_update(skip_locked=skip_locked).filter(
+                    user_id=user_id
+                ).order_by('date').values_list('pk', 'date')[:DIRTY_BATCH_SIZE]
+            )
+            if not dirty:
+                return refreshed
+
+            _replace_rollups(user_id, dates=[day for _, day in dirty])
+            RollupDirtyDay.objects.filter(pk__in=[pk for pk, _ in dirty]).delete()
+        refreshed += len(dirty)
+
+
+def rebuild_rollups(user_id, start_date=None, end_date=None):
+    """Recompute all of a user's rollups, optionally limited to a date range"""
+    with transaction.atomic():
+        RollupDirtyDay.objects.filter(
+            user_id=user_id, **_date_lookup('date', start_date=start_date, end_date=end_date)
+        ).delete()
+        _replace_rollups(user_id, start_date=start_date, end_date=end_date)
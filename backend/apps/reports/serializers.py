@@ -0,0 +1,181 @@
+"""
+Serializers for report query parameters and report jobs
+"""
+
+import json
+
+from dateutil.relativedelta import relativedelta
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.reverse import reverse
+from rest_framework.utils.encoders import JSONEncoder
+
+from .forecasting import FORECAST_WEEKS, MAX_FORECAST_WEEKS
+from .models import ReportJob
+from .services import CLIENT_ORDERING, bucket_count, bucket_start, next_bucket
+
+
+class ReportQuerySerializer(serializers.Serializer):
+    """Validates the date range and detail mode of a report request"""
+
+    DETAIL_CHOICES = [
+        ('none', 'Totals only'),
+        ('page', 'Totals and one page of detail rows'),
+    ]
+
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    detail = serializers.ChoiceField(choices=DETAIL_CHOICES, default='page')
+
+    def validate(self, attrs):
+        """Validate that the range is not reversed"""
+        start_date = attrs.get('start_date')
+        end_date = attrs.get('end_date')
+        if start_date and end_date and start_date > end_date:
+            raise serializers.ValidationError({
+                'end_date': "End date must be on or after start date."
+            })
+        return attrs
+
+
+class TimeSeriesQuerySerializer(serializers.Serializer):
+    """Validates time-series parameters; `from` defaults to one year before `to`"""
+
+    METRIC_CHOICES = ['invoiced', 'paid', 'expenses', 'net']
+    BUCKET_CHOICES = ['day', 'week', 'month', 'quarter']
+    MAX_BUCKETS = 4000
+
+    metric = serializers.ChoiceField(choices=METRIC_CHOICES)
+    bucket = serializers.ChoiceField(choices=BUCKET_CHOICES, default='month')
+
+    def get_fields(self):
+        # `from` is a Python keyword, so these cannot be declared as attributes
+        fields = super().get_fields()
+        fields['from'] = serializers.DateField(required=False)
+        fields['to'] = serializers.DateField(required=False)
+        return fields
+
+    def validate(self, attrs):
+        """Fill in the default range and bound the number of buckets"""
+        end_date = attrs.get('to') or timezone.localdate()
+        try:
+            start_date = attrs.get('from') or end_date - relativedelta(years=1) + relativedelta(days=1)
+            # Listing the buckets steps past the last one
+            next_bucket(bucket_start(end_date, attrs['bucket']), attrs['bucket'])
+        except (OverflowError, ValueError):
+            raise serializers.ValidationError({
+                'to': "End date is out of the supported range."
+            })
+        if start_date > end_date:
+            raise serializers.ValidationError({
+                'to': "End date must be on or after start date."
+            })
+        if bucket_count(start_date, end_date, attrs['bucket']) > self.MAX_BUCKETS:
+            raise serializers.ValidationError({
+                'bucket': f"Range spans more than {self.MAX_BUCKETS} buckets, use a larger bucket."
+            })
+
+        attrs['from'], attrs['to'] = start_date, end_date
+        return attrs
+
+
+class ClientReportQuerySerializer(serializers.Serializer):
+    """Validates the ordering and metric filters of the client report"""
+
+    ORDERING_CHOICES = [prefix + name for name in CLIENT_ORDERING for prefix in ('', '-')]
+
+    ordering = serializers.ChoiceField(choices=ORDERING_CHOICES, default='-total_invoiced')
+    min_dso = serializers.FloatField(min_value=0, required=False)
+    min_avg_days_to_pay = serializers.FloatField(required=False)
+    min_p90_days_to_pay = serializers.FloatField(required=False)
+    min_late_ratio = serializers.FloatField(min_value=0, max_value=1, required=False)
+
+
+class CashflowForecastQuerySerializer(serializers.Serializer):
+    """Validates the forecast horizon"""
+
+    weeks = serializers.IntegerField(min_value=1, max_value=MAX_FORECAST_WEEKS, default=FORECAST_WEEKS)
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    """Serializer for ReportJob model"""
+
+    # Parameter validation for each report type
+    QUERY_SERIALIZERS = {
+        'INCOME': ReportQuerySerializer,
+        'EXPENSES': ReportQuerySerializer,
+        'CLIENTS': ClientReportQuerySerializer,
+        'TIMESERIES': TimeSeriesQuerySerializer,
+    }
+
+    result_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = [
+            'id', 'report_type', 'parameters', 'notify', 'status', 'result_url',
+            'result_size', 'error', 'created_at', 'started_at', 'completed_at', 'expires_at'
+        ]
+        read_only_fields = [
+            'id', 'status', 'result_url', 'result_size', 'error', 'created_at',
+            'started_at', 'completed_at', 'expires_at'
+        ]
+
+    def get_result_url(self, obj):
+        """Get the result URL once the report is ready"""
+        if obj.status != 'COMPLETE' or obj.is_expired:
+            return None
+        return reverse('report-job-result', args=[obj.pk], request=self.context.get('request'))
+
+    def validate(self, attrs):
+        """Validate and normalize the parameters for the report type"""
+        query_serializer = self.QUERY_SERIALIZERS[attrs['report_type']]
+        parameters = attrs.get('parameters') or {}
+        if not isinstance(parameters, dict):
+            raise serializers.ValidationError({'parameters': "Expected an object."})
+
+        query = query_serializer(data=parameters)
+        if not query.is_valid():
+            raise serializers.ValidationError({'parameters': query.errors})
+        # Normalized so that equivalent requests share a fingerprint
+        parameters = json.loads(json.dumps(query.validated_data, cls=JSONEncoder))
+
+        attrs['parameters'] = parameters
+        return attrs
+
+    def create(self, validated_data):
+        """Queue a job for the current user, or join an identical one in flight"""
+        user = self.context['request'].user
+        in_flight = ReportJob.objects.filter(
+            user=user,
+            report_type=validated_data['report_type'],
+            parameters_hash=ReportJob.hash_parameters(validated_data['parameters']),
+            status__in=ReportJob.IN_FLIGHT_STATUSES,
+        )
+
+        job = in_flight.first()
+        if job is None:
+            try:
+                with transaction.atomic():
+                    job = ReportJob.objects.create(user=user, **validated_data)
+            except IntegrityError:
+                # Lost a race with an identical request
+                job = in_flight.first()
+                if job is None:
+                    raise
+            else:
+                job.schedule()
+                return job
+
+        if validated_data.get('notify') and not job.notify:
+            job.notify = True
+            job.save(update_fields=['notify'])
+        return job
+
+
+def report_job_params(job):
+    """Typed query parameters for running a ReportJob"""
+    query = ReportJobSerializer.QUERY_SERIALIZERS[job.report_type](data=job.parameters)
+    query.is_valid(raise_exception=True)
+    return query.validated_data
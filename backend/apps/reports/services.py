@@ -0,0 +1,342 @@
+"""
+Report computations for InvoiceFlow
+
+These functions work on plain arguments rather than requests so the same
+numbers can be produced by API views and background jobs.
+"""
+
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncQuarter, TruncWeek
+from django.utils import timezone
+
+from apps.clients.models import Client
+from apps.expenses.models import Expense
+from apps.invoices.models import Invoice
+
+from .models import DailyExpenseCategoryRollup, DailyRollup
+from .rollups import refresh_rollups
+
+DASHBOARD_MONTHS = 6
+
+TRUNCATE_FUNCTIONS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+    'quarter': TruncQuarter,
+}
+
+
+def start_of_day(day):
+    """Return the aware datetime at the start of `day` in the current timezone"""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def build_dashboard(user, today=None):
+    """
+    Dashboard statistics for `user`.
+
+    The invoice overview is a single conditional aggregate and monthly
+    figures a single TruncMonth group-by over the daily rollups, so the
+    number of queries does not depend on how many invoices the user has.
+    """
+    refresh_rollups(user.pk)
+    today = today or timezone.localdate()
+    first_day_of_month = today.replace(day=1)
+    invoices = Invoice.objects.filter(user=user)
+
+    open_invoice = ~Q(status__in=['PAID', 'CANCELLED'])
+    overdue_invoice = open_invoice & Q(due_date__lt=today)
+    overview = invoices.aggregate(
+        total_outstanding=Sum('total_amount', filter=open_invoice),
+        pending_invoices=Count('id', filter=Q(status__in=['SENT', 'DRAFT'])),
+        overdue_invoices=Count('id', filter=overdue_invoice),
+        overdue_amount=Sum('total_amount', filter=overdue_invoice),
+    )
+
+    # Monthly revenue (current month and the five before it), plus this
+    # month's income and expenses, from the daily rollups
+    months = [first_day_of_month - relativedelta(months=i) for i in reversed(range(DASHBOARD_MONTHS))]
+    by_month = {
+        row['month']: row
+        for row in DailyRollup.objects.filter(
+            user=user,
+            date__gte=months[0]
+        ).annotate(month=TruncMonth('date')).values('month').annotate(
+            revenue=Sum('income_amount'),
+            expenses=Sum('expense_amount')
+        ).order_by()
+    }
+    monthly_revenue = [
+        {
+            'month': month.strftime('%b %Y'),
+            'revenue': float(by_month[month]['revenue'] if month in by_month else Decimal('0.00'))
+        }
+        for month in months
+    ]
+    # Include anything dated after the current month, as the raw filters did
+    paid_this_month = sum(
+        (row['revenue'] for month, row in by_month.items() if month >= first_day_of_month), Decimal('0.00')
+    )
+    expenses_this_month = sum(
+        (row['expenses'] for month, row in by_month.items() if month >= first_day_of_month), Decimal('0.00')
+    )
+
+    recent_invoices = invoices.order_by('-created_at')[:5].values(
+        'id', 'invoice_number', 'client__name', 'total_amount', 'status', 'due_date'
+    )
+
+    top_clients = Client.objects.filter(user=user).annotate(
+        total_invoiced=Sum('invoices__total_amount')
+    ).order_by(F('total_invoiced').desc(nulls_last=True))[:5].values(
+        'name', 'company_name', 'total_invoiced'
+    )
+
+    return {
+        'overview': {
+            'total_outstanding': float(overview['total_outstanding'] or Decimal('0.00')),
+            'paid_this_month': float(paid_this_month),
+            'pending_invoices': overview['pending_invoices'],
+            'overdue_invoices': overview['overdue_invoices'],
+            'overdue_amount': float(overview['overdue_amount'] or Decimal('0.00')),
+            'expenses_this_month': float(expenses_this_month),
+        },
+        'recent_invoices': list(recent_invoices),
+        'monthly_revenue': monthly_revenue,
+        'top_clients': list(top_clients),
+    }
+
+
+def paid_invoices(user, start_date=None, end_date=None):
+    """Return the user's paid invoices with `paid_at` inside the date range"""
+    invoices = Invoice.objects.filter(user=user, status='PAID')
+    if start_date:
+        invoices = invoices.filter(paid_at__gte=start_of_day(start_date))
+    if end_date:
+        invoices = invoices.filter(paid_at__lt=start_of_day(end_date + timedelta(days=1)))
+    return invoices
+
+
+def user_rollups(model, user, start_date=None, end_date=None):
+    """Return the user's rollup rows of `model` inside the date range"""
+    rollups = model.objects.filter(user=user)
+    if start_date:
+        rollups = rollups.filter(date__gte=start_date)
+    if end_date:
+        rollups = rollups.filter(date__lte=end_date)
+    return rollups
+
+
+def income_summary(user, start_date=None, end_date=None):
+    """Total income and invoice count for the date range, from the daily rollups"""
+    refresh_rollups(user.pk)
+    totals = user_rollups(DailyRollup, user, start_date, end_date).aggregate(
+        total=Sum('income_amount'),
+        count=Sum('income_count')
+    )
+    return {
+        'total_income': float(totals['total'] or Decimal('0.00')),
+        'invoice_count': totals['count'] or 0,
+    }
+
+
+def user_expenses(user, start_date=None, end_date=None):
+    """Return the user's expenses inside the date range"""
+    expenses = Expense.objects.filter(user=user)
+    if start_date:
+        expenses = expenses.filter(expense_date__gte=start_date)
+    if end_date:
+        expenses = expenses.filter(expense_date__lte=end_date)
+    return expenses
+
+
+def expense_summary(user, start_date=None, end_date=None):
+    """Expense totals and per-category breakdown for the date range, from the daily rollups"""
+    refresh_rollups(user.pk)
+    totals = user_rollups(DailyRollup, user, start_date, end_date).aggregate(
+        total=Sum('expense_amount'),
+        tax_deductible=Sum('tax_deductible_amount')
+    )
+
+    by_category = user_rollups(DailyExpenseCategoryRollup, user, start_date, end_date).values(
+        'category'
+    ).annotate(
+        total=Sum('amount'),
+        count=Sum('count')
+    ).order_by('-total')
+
+    return {
+        'total_expenses': float(totals['total'] or Decimal('0.00')),
+        'tax_deductible': float(totals['tax_deductible'] or Decimal('0.00')),
+        'by_category': list(by_category),
+    }
+
+
+CLIENT_METRICS = ['dso', 'avg_days_to_pay', 'p90_days_to_pay', 'late_ratio']
+CLIENT_ORDERING = ['name', 'total_invoiced', 'total_paid', 'invoice_count'] + CLIENT_METRICS
+
+
+def client_report(user, ordering='-total_invoiced', minimums=None):
+    """
+    Invoiced and paid totals per client, with their stored payment metrics.
+
+    `ordering` is a CLIENT_ORDERING name, optionally prefixed with '-', and
+    `minimums` maps CLIENT_METRICS names to lower bounds. Clients without a
+    metric sort last either way.
+    """
+    clients = Client.objects.filter(user=user).annotate(
+        total_invoiced=Sum('invoices__total_amount'),
+        total_paid=Sum(
+            'invoices__total_amount',
+            filter=Q(invoices__status='PAID')
+        ),
+        invoice_count=Count('invoices'),
+        **{name: F(f'payment_metrics__{name}') for name in CLIENT_METRICS},
+        metrics_computed_at=F('payment_metrics__computed_at')
+    ).filter(**{f'{name}__gte': value for name, value in (minimums or {}).items()})
+
+    field = F(ordering.lstrip('-'))
+    clients = clients.order_by(
+        field.desc(nulls_last=True) if ordering.startswith('-') else field.asc(nulls_last=True), 'pk'
+    )
+
+    return {
+        'clients': list(clients.values(
+            'id', 'name', 'company_name', 'email',
+            'total_invoiced', 'total_paid', 'invoice_count',
+            *CLIENT_METRICS, 'metrics_computed_at'
+        ))
+    }
+
+
+def client_minimums(params):
+    """The `min_<metric>` bounds among validated client report parameters"""
+    return {
+        name: params[f'min_{name}'] for name in CLIENT_METRICS if params.get(f'min_{name}') is not None
+    }
+
+
+def bucket_start(day, bucket):
+    """Return the first day of the `bucket` containing `day`"""
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    if bucket == 'quarter':
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    return day
+
+
+def next_bucket(day, bucket):
+    """Return the first day of the bucket after the one starting on `day`"""
+    if bucket == 'week':
+        return day + timedelta(weeks=1)
+    if bucket == 'month':
+        return day + relativedelta(months=1)
+    if bucket == 'quarter':
+        return day + relativedelta(months=3)
+    return day + timedelta(days=1)
+
+
+def bucket_count(start_date, end_date, bucket):
+    """Count the buckets overlapping [start_date, end_date] without listing them"""
+    if bucket == 'week':
+        return (bucket_start(end_date, bucket) - bucket_start(start_date, bucket)).days // 7 + 1
+    if bucket == 'month':
+        return (end_date.year - start_date.year) * 12 + end_date.month - start_date.month + 1
+    if bucket == 'quarter':
+        return (end_date.year - start_date.year) * 4 + (end_date.month - 1) // 3 - (start_date.month - 1) // 3 + 1
+    return (end_date - start_date).days + 1
+
+
+def bucket_range(start_date, end_date, bucket):
+    """List the starts of every bucket overlapping [start_date, end_date]"""
+    buckets = []
+    current = bucket_start(start_date, bucket)
+    while current <= end_date:
+        buckets.append(current)
+        current = next_bucket(current, bucket)
+    return buckets
+
+
+ROLLUP_METRICS = {
+    'invoiced': F('invoiced_amount'),
+    'paid': F('paid_amount'),
+    'expenses': F('expense_amount'),
+    'net': F('paid_amount') - F('expense_amount'),
+}
+
+
+def time_series(user, metric, bucket, start_date, end_date):
+    """
+    Time series of `metric` in `bucket` periods between two dates.
+
+    invoiced: invoices issued (drafts and cancelled excluded)
+    paid: payments received
+    expenses: expenses incurred
+    net: paid minus expenses
+
+    Computed as one grouped query over the daily rollups with
+    database-side truncation; periods without activity are filled with zero.
+    """
+    refresh_rollups(user.pk)
+    rollups = user_rollups(DailyRollup, user, bucket_start(start_date, bucket), end_date)
+    totals = {
+        row['period']: row['total']
+        for row in rollups.annotate(
+            period=TRUNCATE_FUNCTIONS[bucket]('date')
+        ).values('period').annotate(
+            total=Sum(ROLLUP_METRICS[metric])
+        ).order_by()
+    }
+
+    series = [
+        {'period': period, 'value': float(totals.get(period) or Decimal('0.00'))}
+        for period in bucket_range(start_date, end_date, bucket)
+    ]
+    return {
+        'metric': metric,
+        'bucket': bucket,
+        'from': start_date,
+        'to': end_date,
+        'total': float(sum(totals.values(), Decimal('0.00'))),
+        'series': series,
+    }
+
+
+def run_report(user, report_type, params):
+    """
+    Compute a full report for a ReportJob.
+
+    `params` are validated query parameters. Unlike the API views, income
+    and expense reports include every row in the range rather than a page.
+    """
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+
+    if report_type == 'INCOME':
+        data = income_summary(user, start_date, end_date)
+        if params.get('detail') != 'none':
+            data['invoices'] = list(paid_invoices(user, start_date, end_date).order_by('-paid_at', '-id').values(
+                'id', 'invoice_number', 'client__name', 'total_amount', 'paid_at'
+            ))
+        return data
+
+    if report_type == 'EXPENSES':
+        data = expense_summary(user, start_date, end_date)
+        if params.get('detail') != 'none':
+            data['expenses'] = list(user_expenses(user, start_date, end_date).order_by('-expense_date', '-id').values(
+                'id', 'description', 'amount', 'category', 'expense_date', 'vendor'
+            ))
+        return data
+
+    if report_type == 'CLIENTS':
+        return client_report(user, params['ordering'], client_minimums(params))
+
+    if report_type == 'TIMESERIES':
+        return time_series(user, params['metric'], params['bucket'], params['from'], params['to'])
+
+    raise ValueError(f'Unknown report type {report_type}')
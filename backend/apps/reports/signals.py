@@ -0,0 +1,179 @@
+"""
+Signal handlers that keep report rollups and cached reports in step with writes
+
+Each save or delete marks the days it affects dirty, including the days a
+row is moved away from, which are read in pre_save. Saves limited by
+`update_fields` to columns reports do not use are ignored by the rollups.
+
+Invoice and payment writes also mark the client's payment metrics dirty,
+and every write bumps the owner's report cache generation. Expenses and
+clients deleted along with their user mark nothing, since the user's
+markers are deleted in the same cascade. Payments deleted with their
+invoice hand their dates to the invoice, which marks them.
+"""
+
+from collections import defaultdict
+
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from apps.clients.models import Client
+from apps.expenses.models import Expense
+from apps.invoices.models import Invoice
+from apps.payments.models import Payment
+from apps.users.models import User
+
+from .cache import invalidate_reports
+from .client_metrics import mark_client_dirty
+from .rollups import mark_dirty
+
+INVOICE_FIELDS = {'user', 'issue_date', 'status', 'total_amount', 'paid_at'}
+INVOICE_METRICS_FIELDS = {'client', 'issue_date', 'due_date', 'status', 'total_amount', 'paid_at'}
+PAYMENT_FIELDS = {'invoice', 'amount', 'payment_date'}
+EXPENSE_FIELDS = {'user', 'amount', 'category', 'tax_deductible', 'expense_date'}
+
+# Fields whose previous value decides which days a change affects
+INVOICE_DATE_FIELDS = {'user', 'client', 'issue_date', 'paid_at'}
+PAYMENT_DATE_FIELDS = {'invoice', 'payment_date'}
+EXPENSE_DATE_FIELDS = {'user', 'expense_date'}
+
+
+def _affects(update_fields, fields):
+    return update_fields is None or not fields.isdisjoint(update_fields)
+
+
+def _cascades_from(origin, model):
+    """Whether a delete started from an instance or queryset of `model`"""
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return issubclass(origin_model, model)
+
+
+def _invoice_days(user_id, issue_date, paid_at):
+    return user_id, [issue_date, timezone.localdate(paid_at) if paid_at else None]
+
+
+def _capture_previous(instance, update_fields, raw, fields, values):
+    """Remember the stored (user, days) of a row about to be updated"""
+    instance._rollup_previous = None
+    if raw or instance._state.adding or not _affects(update_fields, fields):
+        return
+    instance._rollup_previous = type(instance)._default_manager.filter(
+        pk=instance.pk
+    ).values_list(*values).first()
+
+
+def _mark(current, previous=None):
+    user_id, days = current
+    if previous is not None and previous[0] != user_id:
+        mark_dirty(*previous)
+    elif previous is not None:
+        days = days + previous[1]
+    mark_dirty(user_id, days)
+
+
+@receiver(pre_save, sender=Invoice)
+def capture_invoice_days(sender, instance, update_fields=None, raw=False, **kwargs):
+    _capture_previous(
+        instance, update_fields, raw, INVOICE_DATE_FIELDS, ['user_id', 'issue_date', 'paid_at', 'client_id']
+    )
+
+
+@receiver(post_save, sender=Invoice)
+def invoice_saved(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_rollup_previous', None)
+    if _affects(update_fields, INVOICE_METRICS_FIELDS):
+        mark_client_dirty([instance.client_id, previous[3] if previous else None])
+    if _affects(update_fields, INVOICE_FIELDS):
+        _mark(
+            _invoice_days(instance.user_id, instance.issue_date, instance.paid_at),
+            _invoice_days(*previous[:3]) if previous else None
+        )
+
+
+@receiver(post_delete, sender=Invoice)
+def invoice_deleted(sender, instance, origin=None, **kwargs):
+    mark_client_dirty([instance.client_id])
+    user_id, days = _invoice_days(instance.user_id, instance.issue_date, instance.paid_at)
+    payment_days = getattr(origin, '_rollup_payment_days', {}).get(instance.pk, set())
+    _mark((user_id, days + sorted(payment_days)))
+
+
+@receiver(pre_save, sender=Payment)
+def capture_payment_days(sender, instance, update_fields=None, raw=False, **kwargs):
+    _capture_previous(
+        instance, update_fields, raw, PAYMENT_DATE_FIELDS, ['invoice__user_id', 'payment_date', 'invoice__client_id']
+    )
+
+
+@receiver(post_save, sender=Payment)
+def payment_saved(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or not _affects(update_fields, PAYMENT_FIELDS):
+        return
+    previous = getattr(instance, '_rollup_previous', None)
+    mark_client_dirty([instance.invoice.client_id, previous[2] if previous else None])
+    _mark(
+        (instance.invoice.user_id, [instance.payment_date]),
+        (previous[0], [previous[1]]) if previous else None
+    )
+
+
+@receiver(pre_delete, sender=Payment)
+def capture_cascaded_payment_days(sender, instance, origin=None, **kwargs):
+    # Handed to invoice_deleted, which knows the owner without a query per payment
+    if _cascades_from(origin, Invoice):
+        if not hasattr(origin, '_rollup_payment_days'):
+            origin._rollup_payment_days = defaultdict(set)
+        origin._rollup_payment_days[instance.invoice_id].add(instance.payment_date)
+
+
+@receiver(post_delete, sender=Payment)
+def payment_deleted(sender, instance, origin=None, **kwargs):
+    if _cascades_from(origin, Invoice):
+        return
+    mark_client_dirty([instance.invoice.client_id])
+    _mark((instance.invoice.user_id, [instance.payment_date]))
+
+
+@receiver(pre_save, sender=Expense)
+def capture_expense_days(sender, instance, update_fields=None, raw=False, **kwargs):
+    _capture_previous(instance, update_fields, raw, EXPENSE_DATE_FIELDS, ['user_id', 'expense_date'])
+
+
+@receiver(post_save, sender=Expense)
+def expense_saved(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or not _affects(update_fields, EXPENSE_FIELDS):
+        return
+    previous = getattr(instance, '_rollup_previous', None)
+    _mark(
+        (instance.user_id, [instance.expense_date]),
+        (previous[0], [previous[1]]) if previous else None
+    )
+
+
+@receiver(post_delete, sender=Expense)
+def expense_deleted(sender, instance, origin=None, **kwargs):
+    if _cascades_from(origin, User):
+        return
+    _mark((instance.user_id, [instance.expense_date]))
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def invalidate_user_reports(sender, instance, raw=False, origin=None, **kwargs):
+    if not raw and not _cascades_from(origin, User):
+        invalidate_reports(instance.user_id)
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def invalidate_payment_reports(sender, instance, raw=False, origin=None, **kwargs):
+    if not raw and not _cascades_from(origin, Invoice):
+        invalidate_reports(instance.invoice.user_id)
@@ -0,0 +1,106 @@
+"""
+Celery tasks for reports
+"""
+
+import logging
+
+from celery import shared_task
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.monitoring.tracing import tracer
+
+from .client_metrics import rebuild_client_metrics, refresh_client_metrics
+from .models import ReportJob, RollupDirtyDay
+from .rollups import refresh_rollups
+from .serializers import report_job_params
+from .services import run_report
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def refresh_dirty_rollups():
+    """Recompute every dirty day, skipping users a report is already refreshing"""
+    user_ids = RollupDirtyDay.objects.values_list('user_id', flat=True).distinct().order_by()
+    for user_id in list(user_ids):
+        refresh_rollups(user_id, skip_locked=True)
+
+
+@shared_task(ignore_result=True)
+def update_client_payment_metrics(full=False):
+    """Recompute client payment metrics: dirty clients only, or every client when `full`"""
+    if full:
+        count = rebuild_client_metrics()
+    else:
+        count = refresh_client_metrics(skip_locked=True)
+    logger.info('Updated payment metrics for %d clients', count)
+
+
+@shared_task(ignore_result=True)
+def run_report_job(job_id):
+    """Compute a queued report job and store its compressed result"""
+    # Claim the job so a redelivered message does not run it twice
+    claimed = ReportJob.objects.filter(pk=job_id, status='PENDING').update(
+        status='RUNNING', started_at=timezone.now()
+    )
+    if not claimed:
+        return
+
+    # The owner, or purge_report_jobs, may delete the job at any point
+    job = ReportJob.objects.select_related('user').filter(pk=job_id).first()
+    if job is None:
+        return
+    try:
+        stored = job.store_result(run_report(job.user, job.report_type, report_job_params(job)))
+    except Exception:
+        # The error is shown to the job's owner, so the details stay in the log
+        logger.exception('Report job %s failed', job_id)
+        stored = job.mark_failed('Report job failed')
+    if not stored:
+        logger.info('Report job %s was deleted while it ran', job_id)
+        return
+
+    notify = ReportJob.objects.filter(pk=job_id).values_list('notify', flat=True).first()
+    if notify:
+        notify_report_job(job)
+
+
+def notify_report_job(job):
+    """Email the job owner that the report has finished"""
+    if job.status == 'COMPLETE':
+        subject = f'Your {job.get_report_type_display().lower()} report is ready'
+        body = (
+            f'Your report is ready to download from '
+            f'{settings.SITE_URL.rstrip("/")}{reverse("report-job-result", args=[job.pk])} '
+            f'until {job.expires_at:%Y-%m-%d %H:%M %Z}.'
+        )
+    else:
+        subject = f'Your {job.get_report_type_display().lower()} report failed'
+        body = f'Report job {job.pk} could not be completed. Please try again.'
+
+    try:
+        with tracer.start_as_current_span('send_mail'):
+            send_mail(subject, body, settings.DEFAULT_FROM_EMAIL, [job.user.email])
+    except Exception:
+        logger.exception('Could not send notification for report job %s', job.pk)
+
+
+@shared_task(ignore_result=True)
+def purge_report_jobs():
+    """Delete expired report jobs and fail jobs that have been in flight too long"""
+    now = timezone.now()
+    ReportJob.objects.filter(expires_at__lte=now).delete()
+
+    cutoff = now - settings.REPORT_JOB_TIMEOUT
+    ReportJob.objects.filter(
+        Q(status='PENDING', created_at__lt=cutoff) | Q(status='RUNNING', started_at__lt=cutoff)
+    ).update(
+        status='FAILED',
+        error='Report job timed out',
+        completed_at=now,
+        expires_at=now + settings.REPORT_JOB_RESULT_TTL
+    )
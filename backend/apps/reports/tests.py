@@ -1,3 +1,692 @@
-from django.test import TestCase
+"""
+Tests for rollup and client metrics maintenance, report jobs, the cash-flow
+forecast, the report response cache, per-user concurrency limits, the
+report query budgets and read-replica routing
+"""
 
-# Create your tests here.
+import threading
+import time
+import unittest
+from datetime import date, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
+
+import fakeredis
+import numpy as np
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.clients.models import Client
+from apps.expenses.models import Expense
+from apps.invoices.models import Invoice
+from apps.payments.models import Payment
+from apps.monitoring.testing import TEST_CACHES, QueryBudgetTestCase
+from apps.users.models import User
+from apps.users.tokens import RefreshToken
+from invoiceflow import throttling
+from invoiceflow.db_router import PrimaryReplicaRouter
+
+from . import cache as report_cache
+from . import services as report_services
+from . import tasks as report_tasks
+from . import client_metrics, forecasting, rollups
+from .forecasting import cashflow_forecast
+from .serializers import TimeSeriesQuerySerializer
+from .services import bucket_count, bucket_range
+from .models import ClientMetricsDirty, ClientPaymentMetrics, DailyRollup, ReportJob, RollupDirtyDay
+
+LOCMEM_CACHE = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'report-cache-tests',
+    }
+}
+
+THREADS = 12
+
+
+def expense(user, day, amount):
+    return Expense.objects.create(user=user, description='Paper', amount=Decimal(amount), expense_date=day)
+
+
+def open_invoice(client, amount):
+    today = timezone.localdate()
+    return Invoice.objects.create(
+        user=client.user, client=client, issue_date=today - timedelta(days=10), due_date=today + timedelta(days=20),
+        sent_at=timezone.now(), total_amount=Decimal(amount),
+    )
+
+
+def run_during_refresh(module, name, refresh, write):
+    """
+    Run `refresh` with `write` starting on another connection once the
+    refresh has recomputed, before it clears its markers and commits
+    """
+    computed = threading.Event()
+    recompute = getattr(module, name)
+
+    def recompute_then_wait(*args, **kwargs):
+        result = recompute(*args, **kwargs)
+        computed.set()
+        # Long enough for the write to reach its marker and block
+        time.sleep(0.5)
+        return result
+
+    def writer():
+        computed.wait(5)
+        try:
+            with transaction.atomic():
+                write()
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    with mock.patch.object(module, name, recompute_then_wait):
+        refresh()
+    thread.join()
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RollupMaintenanceTests(TestCase):
+    """Writes mark their days dirty and refreshes recompute them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='x', first_name='Plain', last_name='User')
+        cls.day = date(2026, 3, 2)
+
+    def test_refresh_recomputes_dirty_days(self):
+        expense(self.user, self.day, '12.50')
+        expense(self.user, self.day, '7.50')
+        self.assertTrue(RollupDirtyDay.objects.filter(user=self.user, date=self.day).exists())
+
+        self.assertEqual(rollups.refresh_rollups(self.user.pk), 1)
+        self.assertFalse(RollupDirtyDay.objects.exists())
+        rollup = DailyRollup.objects.get(user=self.user, date=self.day)
+        self.assertEqual(rollup.expense_amount, Decimal('20.00'))
+        self.assertEqual(rollup.expense_count, 2)
+
+    def test_moved_row_marks_both_days(self):
+        row = expense(self.user, self.day, '10.00')
+        rollups.refresh_rollups(self.user.pk)
+
+        row.expense_date = self.day + timedelta(days=1)
+        row.save()
+        self.assertEqual(rollups.refresh_rollups(self.user.pk), 2)
+        self.assertEqual(list(DailyRollup.objects.values_list('date', flat=True)), [row.expense_date])
+
+    def test_marking_a_dirty_day_again_updates_its_marker(self):
+        rollups.mark_dirty(self.user.pk, [self.day])
+        long_ago = timezone.now() - timedelta(hours=1)
+        RollupDirtyDay.objects.update(marked_at=long_ago)
+
+        rollups.mark_dirty(self.user.pk, [self.day, None])
+        marker = RollupDirtyDay.objects.get()
+        self.assertGreater(marker.marked_at, long_ago)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class OwnerDeletionTests(TransactionTestCase):
+    """Rows deleted along with their user do not mark the user's rollups"""
+
+    def test_user_with_expenses_can_be_deleted(self):
+        user = User.objects.create_user(email='user@example.com', password='x', first_name='Plain', last_name='User')
+        expense(user, date(2026, 3, 2), '10.00')
+        Client.objects.create(user=user, name='Acme', email='acme@example.com')
+
+        user.delete()
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(RollupDirtyDay.objects.exists())
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'needs row locks held across connections')
+@override_settings(CACHES=LOCMEM_CACHE)
+class RollupRefreshRaceTests(TransactionTestCase):
+    """A write committed during a refresh is not lost"""
+
+    def test_write_during_refresh_marks_the_day_again(self):
+        user = User.objects.create_user(email='user@example.com', password='x', first_name='Plain', last_name='User')
+        day = date(2026, 3, 2)
+        expense(user, day, '10.00')
+
+        run_during_refresh(
+            rollups, '_replace_rollups', lambda: rollups.refresh_rollups(user.pk),
+            lambda: expense(user, day, '5.00'),
+        )
+
+        self.assertTrue(RollupDirtyDay.objects.filter(user=user, date=day).exists())
+        rollups.refresh_rollups(user.pk)
+        self.assertEqual(DailyRollup.objects.get(user=user, date=day).expense_amount, Decimal('15.00'))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ClientMetricsMaintenanceTests(TestCase):
+    """Invoice writes mark their client dirty and refreshes recompute it"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='x', first_name='Plain', last_name='User')
+        cls.client_row = Client.objects.create(user=cls.user, name='Acme', email='acme@example.com')
+
+    def test_refresh_recomputes_dirty_clients(self):
+        open_invoice(self.client_row, '100.00')
+        self.assertTrue(ClientMetricsDirty.objects.filter(client=self.client_row).exists())
+
+        self.assertEqual(client_metrics.refresh_client_metrics(), 1)
+        self.assertFalse(ClientMetricsDirty.objects.exists())
+        metrics = ClientPaymentMetrics.objects.get(client=self.client_row)
+        self.assertEqual(metrics.outstanding_amount, Decimal('100.00'))
+        self.assertEqual(metrics.dso, Decimal('90.0'))
+
+    def test_marking_a_dirty_client_again_updates_its_marker(self):
+        client_metrics.mark_client_dirty([self.client_row.pk])
+        long_ago = timezone.now() - timedelta(hours=1)
+        ClientMetricsDirty.objects.update(marked_at=long_ago)
+
+        client_metrics.mark_client_dirty([self.client_row.pk, None])
+        marker = ClientMetricsDirty.objects.get()
+        self.assertGreater(marker.marked_at, long_ago)
+
+
+    def test_deleting_an_invoice_does_not_look_up_each_payment(self):
+        query_counts = []
+        for payments in (1, 3):
+            invoice = open_invoice(self.client_row, '100.00')
+            for day in range(1, payments + 1):
+                Payment.objects.create(invoice=invoice, amount=Decimal('10.00'), payment_date=date(2026, 3, day))
+            RollupDirtyDay.objects.all().delete()
+            ClientMetricsDirty.objects.all().delete()
+
+            with CaptureQueriesContext(connection) as queries:
+                Invoice.objects.get(pk=invoice.pk).delete()
+            query_counts.append(len(queries))
+
+            self.assertTrue(ClientMetricsDirty.objects.filter(client=self.client_row).exists())
+            marked = set(RollupDirtyDay.objects.values_list('date', flat=True))
+            self.assertTrue({date(2026, 3, day) for day in range(1, payments + 1)} <= marked)
+        self.assertEqual(query_counts[0], query_counts[1])
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'needs row locks held across connections')
+@override_settings(CACHES=LOCMEM_CACHE)
+class ClientMetricsRefreshRaceTests(TransactionTestCase):
+    """A write committed during a refresh is not lost"""
+
+    def test_write_during_refresh_marks_the_client_again(self):
+        user = User.objects.create_user(email='user@example.com', password='x', first_name='Plain', last_name='User')
+        client = Client.objects.create(user=user, name='Acme', email='acme@example.com')
+        open_invoice(client, '100.00')
+
+        run_during_refresh(
+            client_metrics, '_replace_metrics', client_metrics.refresh_client_metrics,
+            lambda: open_invoice(client, '50.00'),
+        )
+
+        self.assertTrue(ClientMetricsDirty.objects.filter(client=client).exists())
+        client_metrics.refresh_client_metrics()
+        self.assertEqual(ClientPaymentMetrics.objects.get(client=client).outstanding_amount, Decimal('150.00'))
+
+
+@override_settings(CACHES=LOCMEM_CACHE, SITE_URL='https://api.invoiceflow.example/')
+class ReportJobTaskTests(TestCase):
+    """Report jobs run to completion, or stop cleanly when deleted meanwhile"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='x', first_name='Plain', last_name='User')
+
+    def setUp(self):
+        self.job = ReportJob.objects.create(
+            user=self.user, report_type='INCOME', parameters={}, parameters_hash='0' * 64, notify=True
+        )
+
+    def delete_job_while_running(self, result=None, error=None):
+        def run_report(*args):
+            ReportJob.objects.filter(pk=self.job.pk).delete()
+            if error:
+                raise error
+            return result or {}
+        return mock.patch.object(report_tasks, 'run_report', run_report)
+
+    def test_completed_job_emails_an_absolute_link(self):
+        report_tasks.run_report_job(self.job.pk)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, 'COMPLETE')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(f'https://api.invoiceflow.example/api/reports/jobs/{self.job.pk}/result/', mail.outbox[0].body)
+
+    def test_job_deleted_while_running(self):
+        with self.delete_job_while_running():
+            report_tasks.run_report_job(self.job.pk)
+        self.assertFalse(ReportJob.objects.exists())
+        self.assertEqual(mail.outbox, [])
+
+    def test_failed_job_deleted_while_running(self):
+        with self.delete_job_while_running(error=ValueError('bad parameters')):
+            report_tasks.run_report_job(self.job.pk)
+        self.assertFalse(ReportJob.objects.exists())
+        self.assertEqual(mail.outbox, [])
+
+    def test_failed_job_is_recorded(self):
+        error = ValueError('relation "reports_secret" does not exist')
+        with mock.patch.object(report_tasks, 'run_report', side_effect=error), \
+                self.assertLogs('apps.reports.tasks', 'ERROR') as logs:
+            report_tasks.run_report_job(self.job.pk)
+        self.job.refresh_from_db()
+        # Details are logged, never shown to the owner
+        self.assertEqual((self.job.status, self.job.error), ('FAILED', 'Report job failed'))
+        self.assertIn('reports_secret', logs.output[0])
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class DelayQuantileTests(SimpleTestCase):
+    """Per-client delay quantiles match NumPy's and fall back to the account's"""
+
+    def setUp(self):
+        random = np.random.default_rng(7)
+        # Clients 0-2 have enough history, client 3 too little and client 4 none
+        self.client_codes = np.repeat(np.arange(4), [5, 8, forecasting.MIN_CLIENT_HISTORY, 1])
+        self.delays = random.integers(-10, 60, len(self.client_codes))
+        random.shuffle(self.client_codes)
+        self.quantiles = forecasting.delay_quantiles(self.client_codes, self.delays, 5)
+
+    def test_client_quantiles_match_numpy(self):
+        self.assertEqual(self.quantiles.shape, (5, len(forecasting.QUANTILES)))
+        for client in range(3):
+            expected = np.quantile(self.delays[self.client_codes == client], forecasting.QUANTILES)
+            np.testing.assert_allclose(self.quantiles[client], expected)
+
+    def test_short_history_uses_account_quantiles(self):
+        pooled = np.quantile(self.delays, forecasting.QUANTILES)
+        np.testing.assert_allclose(self.quantiles[3], pooled)
+        np.testing.assert_allclose(self.quantiles[4], pooled)
+
+    def test_no_history_means_no_delay(self):
+        quantiles = forecasting.delay_quantiles(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), 2)
+        np.testing.assert_array_equal(quantiles, np.zeros((2, len(forecasting.QUANTILES))))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CashflowForecastTests(TestCase):
+    """Open invoices are spread over the weeks their client usually pays in"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='x', first_name='Plain', last_name='User')
+        cls.client_row = Client.objects.create(user=cls.user, name='Acme', email='acme@example.com')
+        cls.today = timezone.localdate()
+        # Acme has always paid between 2 and 10 days late
+        for delay in (2, 5, 10):
+            due = cls.today - timedelta(days=90 + delay)
+            paid = cls.invoice(due, '50.00')
+            Payment.objects.create(invoice=paid, amount=Decimal('50.00'), payment_date=due + timedelta(days=delay))
+
+    @classmethod
+    def invoice(cls, due_date, amount):
+        return Invoice.objects.create(
+            user=cls.user, client=cls.client_row, issue_date=due_date - timedelta(days=30), due_date=due_date,
+            sent_at=timezone.now(), total_amount=Decimal(amount),
+        )
+
+    def test_invoice_later_than_every_recorded_delay_is_at_risk(self):
+        self.invoice(self.today - timedelta(days=30), '120.00')
+        forecast = cashflow_forecast(self.user, today=self.today)
+        self.assertEqual(forecast['open_invoices'], 1)
+        self.assertEqual(forecast['at_risk'], 120.0)
+        self.assertEqual(forecast['total_expected'], 0.0)
+
+    def test_open_amount_is_fully_accounted_for(self):
+        self.invoice(self.today - timedelta(days=30), '120.00')
+        self.invoice(self.today - timedelta(days=4), '80.00')
+        self.invoice(self.today + timedelta(days=20), '310.55')
+        self.invoice(self.today + timedelta(days=200), '999.99')
+        forecast = cashflow_forecast(self.user, today=self.today)
+
+        self.assertEqual(forecast['open_amount'], 1510.54)
+        self.assertEqual(forecast['beyond_horizon'], 999.99)
+        self.assertEqual(forecast['at_risk'], 120.0)
+        weekly = sum(week['expected'] for week in forecast['weeks'])
+        self.assertAlmostEqual(weekly, forecast['total_expected'], delta=0.05)
+        self.assertAlmostEqual(
+            forecast['total_expected'] + forecast['beyond_horizon'] + forecast['at_risk'], forecast['open_amount'],
+            delta=0.01
+        )
+
+
+class TimeSeriesQueryTests(SimpleTestCase):
+    """Time-series ranges are bounded before any bucket is listed"""
+
+    def validate(self, **params):
+        serializer = TimeSeriesQuerySerializer(data={'metric': 'paid', **params})
+        return serializer.is_valid(), serializer.errors
+
+    def test_bucket_count_matches_the_buckets_listed(self):
+        ranges = [(date(2023, 11, 15), date(2025, 2, 3)), (date(2024, 1, 1), date(2024, 1, 1)),
+                  (date(2024, 3, 31), date(2024, 4, 1)), (date(2023, 12, 31), date(2026, 1, 1))]
+        for start_date, end_date in ranges:
+            for bucket in TimeSeriesQuerySerializer.BUCKET_CHOICES:
+                self.assertEqual(
+                    bucket_count(start_date, end_date, bucket), len(bucket_range(start_date, end_date, bucket)),
+                    (start_date, end_date, bucket)
+                )
+
+    def test_range_ending_at_the_last_date_is_refused(self):
+        for bucket in TimeSeriesQuerySerializer.BUCKET_CHOICES:
+            valid, errors = self.validate(**{'from': '9999-12-01', 'to': '9999-12-31', 'bucket': bucket})
+            self.assertFalse(valid, bucket)
+            self.assertIn('to', errors)
+
+    def test_default_range_before_the_first_year_is_refused(self):
+        valid, errors = self.validate(to='0001-06-01')
+        self.assertFalse(valid)
+        self.assertIn('to', errors)
+
+    def test_long_range_is_refused_without_listing_its_buckets(self):
+        with mock.patch('apps.reports.services.next_bucket', wraps=report_services.next_bucket) as stepped:
+            valid, errors = self.validate(**{'from': '0001-01-01', 'to': '9999-12-30', 'bucket': 'day'})
+        self.assertFalse(valid)
+        self.assertIn('bucket', errors)
+        self.assertLessEqual(stepped.call_count, 1)
+
+    def test_range_within_bounds(self):
+        valid, _ = self.validate(**{'from': '2024-01-01', 'to': '2024-12-31', 'bucket': 'day'})
+        self.assertTrue(valid)
+
+
+class CountingReport:
+    """Report computation that counts its calls and takes a while"""
+
+    def __init__(self, duration=0.2, value='fresh'):
+        self.duration = duration
+        self.value = value
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.duration)
+        return {'value': self.value}
+
+
+def run_concurrently(target, count=THREADS):
+    """Call `target` from `count` threads released at the same moment"""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def worker(index):
+        barrier.wait()
+        results[index] = target()
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class BrokenCache:
+    """Cache whose every operation fails, as when Redis is unreachable"""
+
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError('cache unavailable')
+        return fail
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHE,
+    REPORT_CACHE_TIMEOUT=300,
+    REPORT_CACHE_STALE_TIMEOUT=60,
+    REPORT_CACHE_LOCK_WAIT=5.0,
+)
+class SingleFlightCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_misses_compute_once(self):
+        report = CountingReport()
+
+        results = run_concurrently(lambda: report_cache.cached_report(1, 'dashboard', 'params', report))
+
+        self.assertEqual(report.calls, 1)
+        self.assertTrue(all(data == {'value': 'fresh'} for data, _ in results))
+        outcomes = [outcome for _, outcome in results]
+        self.assertEqual(outcomes.count('MISS'), 1)
+        self.assertEqual(outcomes.count('HIT'), THREADS - 1)
+
+    def test_waits_for_computation_in_another_process(self):
+        key = f'reports:resp:1:{report_cache.get_generation(1)}:dashboard:params'
+        # Another worker holds the fill lock and stores its result shortly
+        cache.add(f'{key}:lock', 'other-worker', timeout=30)
+        timer = threading.Timer(0.2, report_cache._store, args=(key, {'value': 'other'}))
+        timer.start()
+        report = CountingReport()
+
+        data, outcome = report_cache.cached_report(1, 'dashboard', 'params', report)
+        timer.join()
+
+        self.assertEqual(report.calls, 0)
+        self.assertEqual(data, {'value': 'other'})
+        self.assertEqual(outcome, 'HIT')
+
+    def test_expired_entry_is_refreshed_once_and_served_stale(self):
+        report_cache.cached_report(1, 'dashboard', 'params', CountingReport(duration=0, value='old'))
+        report = CountingReport(value='new')
+
+        with mock.patch.object(report_cache.time, 'time', return_value=time.time() + 301):
+            results = run_concurrently(lambda: report_cache.cached_report(1, 'dashboard', 'params', report))
+
+        self.assertEqual(report.calls, 1)
+        outcomes = sorted(outcome for _, outcome in results)
+        self.assertEqual(outcomes, ['MISS'] + ['STALE'] * (THREADS - 1))
+        self.assertEqual(
+            sorted(data['value'] for data, _ in results),
+            ['new'] + ['old'] * (THREADS - 1)
+        )
+
+    def test_write_is_never_served_stale(self):
+        report_cache.cached_report(1, 'dashboard', 'params', CountingReport(duration=0, value='old'))
+        report_cache.bump_generation(1)
+
+        with mock.patch.object(report_cache.time, 'time', return_value=time.time() + 301):
+            data, outcome = report_cache.cached_report(1, 'dashboard', 'params', CountingReport(duration=0, value='new'))
+
+        self.assertEqual(data, {'value': 'new'})
+        self.assertEqual(outcome, 'MISS')
+
+    def test_local_lock_when_cache_is_unavailable(self):
+        report = CountingReport()
+
+        with mock.patch.object(report_cache, 'cache', BrokenCache()), \
+                self.assertLogs(report_cache.logger, 'WARNING'):
+            results = run_concurrently(lambda: report_cache.cached_report(1, 'dashboard', 'params', report))
+
+        self.assertEqual(report.calls, 1)
+        self.assertTrue(all(data == {'value': 'fresh'} for data, _ in results))
+
+    def test_failed_computation_is_not_shared(self):
+        def failing():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            report_cache.cached_report(1, 'dashboard', 'params', failing)
+
+        data, outcome = report_cache.cached_report(1, 'dashboard', 'params', CountingReport(duration=0))
+        self.assertEqual(data, {'value': 'fresh'})
+        self.assertEqual(outcome, 'MISS')
+
+
+@override_settings(CACHES=LOCMEM_CACHE, THROTTLE_CONCURRENCY_LIMITS={'reports': 2})
+class ConcurrencyLimitTests(TestCase):
+    """Report requests one user may have in flight at once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='x', first_name='Plain', last_name='User')
+        cls.other = User.objects.create_user(email='other@example.com', password='x', first_name='Other', last_name='User')
+
+    def setUp(self):
+        cache.clear()
+        self.redis = fakeredis.FakeRedis()
+        for patcher in (mock.patch.object(throttling, 'get_redis', return_value=self.redis),
+                        mock.patch.dict(throttling._scripts, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.view = SimpleNamespace(concurrency_scope='reports')
+
+    def acquire(self, user):
+        throttle = throttling.ConcurrencyThrottle()
+        allowed = throttle.allow_request(SimpleNamespace(user=user), self.view)
+        return throttle if allowed else None
+
+    def dashboard(self, user):
+        token = RefreshToken.for_user(user).access_token
+        return self.client.get('/api/reports/dashboard/', HTTP_HOST='localhost',
+                               HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_limit_per_user(self):
+        first, second = self.acquire(self.user), self.acquire(self.user)
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        self.assertIsNone(self.acquire(self.user))
+        self.assertIsNotNone(self.acquire(self.other))
+
+        first.release()
+        self.assertIsNotNone(self.acquire(self.user))
+
+    def test_expired_leases_are_dropped(self):
+        key = f'{throttling.KEY_PREFIX}:concurrency:reports:user:{self.user.pk}'
+        self.redis.zadd(key, {'dead-worker-1': 0, 'dead-worker-2': 0})
+        self.assertIsNotNone(self.acquire(self.user))
+
+    def test_view_releases_its_slot(self):
+        self.assertEqual(self.dashboard(self.user).status_code, 200)
+        self.assertEqual(self.dashboard(self.user).status_code, 200)
+        self.assertEqual(self.dashboard(self.user).status_code, 200)
+
+    def test_view_refuses_requests_over_the_limit(self):
+        held = [self.acquire(self.user), self.acquire(self.user)]
+        self.assertEqual(self.dashboard(self.user).status_code, 429)
+        self.assertEqual(self.dashboard(self.other).status_code, 200)
+        held[0].release()
+        self.assertEqual(self.dashboard(self.user).status_code, 200)
+
+
+class ReportQueryBudgetTests(QueryBudgetTestCase):
+    """Reports are computed with a fixed number of grouped queries, whatever the volume"""
+
+    def test_dashboard(self):
+        self.assertBudget('get', '/api/reports/dashboard/', queries=5, size=3 * 1024)
+
+    def test_income(self):
+        self.assertBudget('get', '/api/reports/income/', queries=3, size=6 * 1024)
+
+    def test_income_totals(self):
+        self.assertBudget('get', '/api/reports/income/?detail=none&start_date=2020-01-01', queries=2, size=1024)
+
+    def test_expenses(self):
+        self.assertBudget('get', '/api/reports/expenses/', queries=4, size=11 * 1024)
+
+    def test_clients(self):
+        self.assertBudget('get', '/api/reports/clients/?ordering=-dso&min_late_ratio=0', queries=1, size=10 * 1024)
+
+    def test_timeseries(self):
+        self.assertBudget('get', '/api/reports/timeseries/?metric=net&bucket=week', queries=2, size=3 * 1024)
+
+    def test_cashflow_forecast(self):
+        self.assertBudget('get', '/api/reports/cashflow-forecast/', queries=2, size=2 * 1024)
+
+    def test_cache_stats(self):
+        for account in self.accounts.values():
+            account.user.is_staff = True
+        self.assertBudget('get', '/api/reports/cache-stats/', queries=0, size=1024)
+
+
+class ReportJobQueryBudgetTests(QueryBudgetTestCase):
+    """Report jobs are listed without their result payloads"""
+
+    def job_url(self, account, suffix=''):
+        return f'/api/reports/jobs/{account.job.pk}/{suffix}'
+
+    def test_list(self):
+        self.assertBudget('get', '/api/reports/jobs/', queries=2, size=7 * 1024)
+
+    def test_retrieve(self):
+        self.assertBudget('get', self.job_url, queries=1, size=1024)
+
+    def test_create(self):
+        self.assertBudget('post', '/api/reports/jobs/', queries=4, size=1024, status=202, data={
+            'report_type': 'TIMESERIES', 'parameters': {'metric': 'paid', 'bucket': 'month'},
+        })
+
+    def test_result(self):
+        self.assertBudget('get', lambda account: self.job_url(account, 'result/'), queries=2, size=1024)
+
+    def test_destroy(self):
+        self.assertBudget('delete', self.job_url, queries=2, size=0, status=204)
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    DATABASE_REPLICAS=['replica1'],
+)
+class ReplicaRoutingTests(TestCase):
+    """Report and list reads go to a replica, except for users who just wrote"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='x', first_name='Plain', last_name='User')
+        cls.other = User.objects.create_user(email='other@example.com', password='x', first_name='Other', last_name='User')
+
+    def setUp(self):
+        cache.clear()
+
+    def request(self, user, method, path, **extra):
+        """Send a request; returns the response and the database each read was routed to"""
+        routed = []
+        db_for_read = PrimaryReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            routed.append(db_for_read(router, model, **hints) or 'default')
+            # The test database stands in for the replica
+            return None
+
+        token = RefreshToken.for_user(user).access_token
+        with mock.patch.object(PrimaryReplicaRouter, 'db_for_read', record):
+            response = getattr(self.client, method)(
+                path, HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {token}',
+                content_type='application/json', **extra
+            )
+        return response, routed
+
+    def test_reports_and_lists_read_from_replica(self):
+        for path in ['/api/reports/dashboard/', '/api/clients/']:
+            response, routed = self.request(self.user, 'get', path)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('replica1', routed, path)
+
+    def test_other_reads_use_primary(self):
+        response, routed = self.request(self.user, 'get', '/api/auth/user/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('replica1', routed)
+
+    def test_writer_is_pinned_to_primary(self):
+        response, _ = self.request(self.user, 'post', '/api/clients/', data={'name': 'Acme', 'email': 'acme@example.com'})
+        self.assertEqual(response.status_code, 201)
+
+        response, routed = self.request(self.user, 'get', '/api/clients/')
+        self.assertEqual(response.data['count'], 1)
+        self.assertNotIn('replica1', routed)
+
+        _, routed = self.request(self.other, 'get', '/api/clients/')
+        self.assertIn('replica1', routed)
@@ -2,203 +2,245 @@
 Views for Dashboard and Reports
 """
 
+import gzip
+
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.decorators import action
+from rest_framework.reverse import reverse
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import permissions
-from django.db.models import Sum, Count, Q
-from django.utils import timezone
-from datetime import timedelta
-from decimal import Decimal
+from rest_framework import mixins, permissions, status, viewsets
+
+from invoiceflow.throttling import ConcurrencyLimitMixin
+
+from .cache import cache_stats, cached_report, request_fingerprint
+from .forecasting import cashflow_forecast
+from .models import ReportJob
+from .pagination import IncomeReportPagination, ExpenseReportPagination
+from .serializers import (
+    CashflowForecastQuerySerializer,
+    ClientReportQuerySerializer,
+    ReportJobSerializer,
+    ReportQuerySerializer,
+    TimeSeriesQuerySerializer
+)
+from .services import (
+    build_dashboard,
+    client_minimums,
+    client_report,
+    expense_summary,
+    income_summary,
+    paid_invoices,
+    time_series,
+    user_expenses
+)
+
+
+class CachedReportView(ConcurrencyLimitMixin, APIView):
+    """
+    Base view for reports cached per user and query string
+
+    Query parameters are validated with `query_serializer_class` before
+    the cache is consulted, so invalid requests are never cached. The
+    X-Cache response header reports HIT, MISS or STALE.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'reports'
+    concurrency_scope = 'reports'
+    cache_name = None
+    query_serializer_class = None
+
+    def get(self, request):
+        params = {}
+        if self.query_serializer_class is not None:
+            query = self.query_serializer_class(data=request.query_params)
+            query.is_valid(raise_exception=True)
+            params = query.validated_data
+
+        data, outcome = cached_report(
+            request.user.pk,
+            self.cache_name,
+            request_fingerprint(request),
+            lambda: self.get_report(request, params)
+        )
+        response = Response(data)
+        response['X-Cache'] = outcome
+        return response
 
-from apps.invoices.models import Invoice
-from apps.payments.models import Payment
-from apps.expenses.models import Expense
-from apps.clients.models import Client
+    def get_report(self, request, params):
+        raise NotImplementedError
 
 
-class DashboardView(APIView):
+class DashboardView(CachedReportView):
     """
     API endpoint for dashboard statistics
     GET /api/reports/dashboard/
     """
-    permission_classes = [permissions.IsAuthenticated]
-
-    def get(self, request):
-        user = request.user
-        today = timezone.now().date()
-        first_day_of_month = today.replace(day=1)
-
-        # Invoice statistics
-        invoices = Invoice.objects.filter(user=user)
-        total_outstanding = invoices.exclude(
-            status__in=['PAID', 'CANCELLED']
-        ).aggregate(total=Sum('total_amount'))['total'] or Decimal('0.00')
-
-        # Paid this month
-        paid_this_month = invoices.filter(
-            status='PAID',
-            paid_at__gte=first_day_of_month
-        ).aggregate(total=Sum('total_amount'))['total'] or Decimal('0.00')
-
-        # Pending invoices count
-        pending_count = invoices.filter(
-            status__in=['SENT', 'DRAFT']
-        ).count()
-
-        # Overdue invoices
-        overdue_invoices = [inv for inv in invoices if inv.is_overdue()]
-        overdue_count = len(overdue_invoices)
-        overdue_amount = sum(inv.total_amount for inv in overdue_invoices)
-
-        # Recent invoices
-        recent_invoices = invoices.order_by('-created_at')[:5].values(
-            'id', 'invoice_number', 'client__name', 'total_amount', 'status', 'due_date'
-        )
+    cache_name = 'dashboard'
 
-        # Monthly revenue (last 6 months)
-        monthly_revenue = []
-        for i in range(6):
-            month_start = (today.replace(day=1) - timedelta(days=i*30)).replace(day=1)
-            next_month = (month_start + timedelta(days=32)).replace(day=1)
-
-            revenue = invoices.filter(
-                status='PAID',
-                paid_at__gte=month_start,
-                paid_at__lt=next_month
-            ).aggregate(total=Sum('total_amount'))['total'] or Decimal('0.00')
-
-            monthly_revenue.append({
-                'month': month_start.strftime('%b %Y'),
-                'revenue': float(revenue)
-            })
-
-        monthly_revenue.reverse()
-
-        # Top clients
-        top_clients = Client.objects.filter(user=user).annotate(
-            total_invoiced=Sum('invoices__total_amount')
-        ).order_by('-total_invoiced')[:5].values('name', 'company_name', 'total_invoiced')
-
-        # Expense statistics
-        expenses_this_month = Expense.objects.filter(
-            user=user,
-            expense_date__gte=first_day_of_month
-        ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-
-        return Response({
-            'overview': {
-                'total_outstanding': float(total_outstanding),
-                'paid_this_month': float(paid_this_month),
-                'pending_invoices': pending_count,
-                'overdue_invoices': overdue_count,
-                'overdue_amount': float(overdue_amount),
-                'expenses_this_month': float(expenses_this_month),
-            },
-            'recent_invoices': list(recent_invoices),
-            'monthly_revenue': monthly_revenue,
-            'top_clients': list(top_clients),
-        })
+    def get_report(self, request, params):
+        return build_dashboard(request.user)
 
 
-class IncomeReportView(APIView):
+class IncomeReportView(CachedReportView):
     """
     API endpoint for income reports
-    GET /api/reports/income/
+    GET /api/reports/income/?start_date=&end_date=&detail=none|page
     """
-    permission_classes = [permissions.IsAuthenticated]
+    cache_name = 'income'
+    query_serializer_class = ReportQuerySerializer
 
-    def get(self, request):
-        user = request.user
-        start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date')
+    def get_report(self, request, params):
+        start_date = params.get('start_date')
+        end_date = params.get('end_date')
 
-        invoices = Invoice.objects.filter(user=user, status='PAID')
+        data = income_summary(request.user, start_date, end_date)
 
-        if start_date:
-            invoices = invoices.filter(paid_at__gte=start_date)
-        if end_date:
-            invoices = invoices.filter(paid_at__lte=end_date)
+        if params['detail'] == 'page':
+            invoices = paid_invoices(request.user, start_date, end_date).values(
+                'id', 'invoice_number', 'client__name', 'total_amount', 'paid_at'
+            )
+            paginator = IncomeReportPagination()
+            data['invoices'] = paginator.paginate_queryset(invoices, request, view=self)
+            data['next'] = paginator.get_next_link()
+            data['previous'] = paginator.get_previous_link()
 
-        total_income = invoices.aggregate(total=Sum('total_amount'))['total'] or Decimal('0.00')
-        invoice_count = invoices.count()
+        return data
 
-        invoices_data = invoices.values(
-            'invoice_number', 'client__name', 'total_amount', 'paid_at'
-        ).order_by('-paid_at')
 
-        return Response({
-            'total_income': float(total_income),
-            'invoice_count': invoice_count,
-            'invoices': list(invoices_data)
-        })
+class ExpenseReportView(CachedReportView):
+    """
+    API endpoint for expense reports
+    GET /api/reports/expenses/?start_date=&end_date=&detail=none|page
+    """
+    cache_name = 'expenses'
+    query_serializer_class = ReportQuerySerializer
+
+    def get_report(self, request, params):
+        start_date = params.get('start_date')
+        end_date = params.get('end_date')
+
+        data = expense_summary(request.user, start_date, end_date)
 
+        if params['detail'] == 'page':
+            expenses = user_expenses(request.user, start_date, end_date).values(
+                'id', 'description', 'amount', 'category', 'expense_date', 'vendor'
+            )
+            paginator = ExpenseReportPagination()
+            data['expenses'] = paginator.paginate_queryset(expenses, request, view=self)
+            data['next'] = paginator.get_next_link()
+            data['previous'] = paginator.get_previous_link()
 
-class ExpenseReportView(APIView):
+        return data
+
+
+class TimeSeriesReportView(CachedReportView):
     """
-    API endpoint for expense reports
-    GET /api/reports/expenses/
+    API endpoint for revenue/expense time series
+    GET /api/reports/timeseries/?metric=invoiced|paid|expenses|net&bucket=day|week|month|quarter&from=&to=
     """
-    permission_classes = [permissions.IsAuthenticated]
+    cache_name = 'timeseries'
+    query_serializer_class = TimeSeriesQuerySerializer
 
-    def get(self, request):
-        user = request.user
-        start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date')
-
-        expenses = Expense.objects.filter(user=user)
-
-        if start_date:
-            expenses = expenses.filter(expense_date__gte=start_date)
-        if end_date:
-            expenses = expenses.filter(expense_date__lte=end_date)
-
-        total_expenses = expenses.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-        tax_deductible = expenses.filter(tax_deductible=True).aggregate(
-            total=Sum('amount')
-        )['total'] or Decimal('0.00')
-
-        # Group by category
-        by_category = expenses.values('category').annotate(
-            total=Sum('amount'),
-            count=Count('id')
-        ).order_by('-total')
-
-        expenses_data = expenses.values(
-            'description', 'amount', 'category', 'expense_date', 'vendor'
-        ).order_by('-expense_date')
-
-        return Response({
-            'total_expenses': float(total_expenses),
-            'tax_deductible': float(tax_deductible),
-            'by_category': list(by_category),
-            'expenses': list(expenses_data)
-        })
+    def get_report(self, request, params):
+        return time_series(request.user, params['metric'], params['bucket'], params['from'], params['to'])
 
 
-class ClientReportView(APIView):
+class ClientReportView(CachedReportView):
     """
     API endpoint for client revenue reports
-    GET /api/reports/clients/
+    GET /api/reports/clients/?ordering=-dso&min_late_ratio=0.5
     """
-    permission_classes = [permissions.IsAuthenticated]
+    cache_name = 'clients'
+    query_serializer_class = ClientReportQuerySerializer
+
+    def get_report(self, request, params):
+        return client_report(request.user, params['ordering'], client_minimums(params))
+
+
+class CashflowForecastView(CachedReportView):
+    """
+    API endpoint for the cash-flow forecast of open invoices
+    GET /api/reports/cashflow-forecast/?weeks=13
+    """
+    cache_name = 'cashflow'
+    query_serializer_class = CashflowForecastQuerySerializer
+
+    def get_report(self, request, params):
+        return cashflow_forecast(request.user, weeks=params['weeks'])
+
+
+class ReportCacheStatsView(APIView):
+    """
+    API endpoint for report cache hit/miss statistics (staff only)
+    GET /api/reports/cache-stats/
+    """
+    permission_classes = [permissions.IsAdminUser]
 
     def get(self, request):
-        user = request.user
-
-        clients = Client.objects.filter(user=user).annotate(
-            total_invoiced=Sum('invoices__total_amount'),
-            total_paid=Sum(
-                'invoices__total_amount',
-                filter=Q(invoices__status='PAID')
-            ),
-            invoice_count=Count('invoices')
-        ).order_by('-total_invoiced')
-
-        clients_data = clients.values(
-            'id', 'name', 'company_name', 'email',
-            'total_invoiced', 'total_paid', 'invoice_count'
-        )
+        names = [view.cache_name for view in CachedReportView.__subclasses__()]
+        return Response(cache_stats(names))
+
+
+class ReportJobViewSet(mixins.CreateModelMixin,
+                       mixins.ListModelMixin,
+                       mixins.RetrieveModelMixin,
+                       mixins.DestroyModelMixin,
+                       viewsets.GenericViewSet):
+    """
+    ViewSet for background report jobs
 
-        return Response({
-            'clients': list(clients_data)
+    create: POST /api/reports/jobs/
+    list: GET /api/reports/jobs/
+    retrieve: GET /api/reports/jobs/{id}/
+    result: GET /api/reports/jobs/{id}/result/
+    destroy: DELETE /api/reports/jobs/{id}/
+
+    Submitting the same report with the same parameters while an earlier
+    job is still queued or running returns that job instead of a new one.
+    """
+    serializer_class = ReportJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        """Return jobs for the current user only, without result payloads"""
+        return ReportJob.objects.filter(user=self.request.user).defer('result')
+
+    def get_throttles(self):
+        if self.action == 'create':
+            self.throttle_scope = 'report_jobs'
+        return super().get_throttles()
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = serializer.save()
+        data = self.get_serializer(job).data
+        return Response(data, status=status.HTTP_202_ACCEPTED, headers={
+            'Location': reverse('report-job-detail', args=[job.pk], request=request)
         })
+
+    @action(detail=True, methods=['get'])
+    def result(self, request, pk=None):
+        """Download the report result as JSON"""
+        job = self.get_object()
+        if job.is_expired:
+            return Response({
+                'error': 'Report result has expired'
+            }, status=status.HTTP_410_GONE)
+        if job.status != 'COMPLETE':
+            return Response({
+                'error': 'Report is not ready',
+                'status': job.status
+            }, status=status.HTTP_409_CONFLICT)
+
+        # Results are stored gzipped, so clients that accept gzip get them as is
+        payload = bytes(job.result)
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            response = HttpResponse(payload, content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(gzip.decompress(payload), content_type='application/json')
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
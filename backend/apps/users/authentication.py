@@ -0,0 +1,111 @@
+"""
+Authentication backends for InvoiceFlow
+
+JWTAuthentication loads the user row on every request. CachedJWTAuthentication
+resolves it from a short-lived cache entry instead. Entries are keyed by a
+per-user version that is bumped whenever the user is saved or deleted (see
+User.save), so profile updates, password changes and deactivation take
+effect on the next request. Changes that bypass save(), such as
+QuerySet.update(), are picked up once the entry expires after
+AUTH_USER_CACHE_TIMEOUT seconds.
+
+The cache is an optimization only: when it is unavailable the user is read
+from the database as usual.
+"""
+
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from apps.monitoring.metrics import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'auth:user'
+
+# Bump when the User model changes, so entries pickled by older code are ignored
+SCHEMA_VERSION = 1
+
+
+def _version_key(user_id):
+    return f'{KEY_PREFIX}:version:{user_id}'
+
+
+def _user_key(user_id, version):
+    return f'{KEY_PREFIX}:{SCHEMA_VERSION}:{user_id}:{version}'
+
+
+def bump_user_version(user_id):
+    """Invalidate the cached user"""
+    key = _version_key(user_id)
+    try:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=None)
+    except Exception:
+        logger.exception('Could not invalidate cached user %s', user_id)
+
+
+def invalidate_cached_user(user_id):
+    """
+    Invalidate the cached user once the current transaction commits.
+
+    Bumping only after commit means a request that read the old row in the
+    meantime cannot cache it under the new version.
+    """
+    transaction.on_commit(lambda: bump_user_version(user_id))
+
+
+def _get_version(user_id):
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Time-based, so an evicted counter never restarts at an old value
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWT authentication that resolves the user from the cache when it can"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        try:
+            key = _user_key(user_id, _get_version(user_id))
+            user = cache.get(key)
+        except Exception:
+            logger.warning('User cache unavailable, reading user %s from the database', user_id, exc_info=True)
+            return super().get_user(validated_token)
+
+        record_cache_lookup('auth_user', 'miss' if user is None else 'hit')
+        if user is None:
+            user = super().get_user(validated_token)
+            try:
+                cache.set(key, user, timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+            except Exception:
+                logger.warning('Could not cache user %s', user_id, exc_info=True)
+            return user
+
+        # Same checks as JWTAuthentication, against the cached row
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
@@ -0,0 +1,185 @@
+"""
+Redis mirror of the refresh token blacklist
+
+With token rotation every refresh checks the token_blacklist tables, which
+only grow. Blacklisted tokens are mirrored to Redis so that the common
+case, a token that is not blacklisted, is answered without scanning the
+blacklist.
+
+Each token is stored twice, in the Redis bucket for the day the token
+expires:
+
+- an exact key, `auth:blacklist:jti:<jti>`, that expires with the token
+- its bits in a Bloom filter for that day, so a token that was never
+  blacklisted is ruled out with one round trip, however large the
+  blacklist is
+
+A day's filter is trusted only once sync_day() has loaded that day's
+tokens from the database and set the filter's sentinel bit. A missing
+filter (never synced, evicted or flushed) has no sentinel, so lookups for
+that day, a Bloom positive without an exact key, and any Redis error all
+fall back to the database. The database remains the source of truth.
+
+A token that could not be mirrored leaves its day's filter incomplete,
+sentinel and all. add() then records the day as a BlacklistResyncDay in
+the same transaction as the blacklisting, and the filter is not trusted to
+rule a token out until resync_day() has reloaded it. Ruling a token out
+therefore also reads the (usually empty) resync table by primary key.
+"""
+
+import hashlib
+import logging
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from invoiceflow.redis_client import get_redis
+
+from .models import BlacklistResyncDay
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'auth:blacklist'
+SYNC_BATCH_SIZE = 10000
+
+
+def _bloom_key(day):
+    return f'{KEY_PREFIX}:bloom:{day:%Y%m%d}'
+
+
+def _jti_key(jti):
+    return f'{KEY_PREFIX}:jti:{jti}'
+
+
+def _sentinel_bit():
+    # One bit past the filter marks a day whose filter is complete
+    return settings.TOKEN_BLACKLIST_BLOOM_BITS
+
+
+def _bits(jti):
+    """Bloom filter bit offsets of a jti, by double hashing"""
+    digest = hashlib.sha256(jti.encode()).digest()
+    first = int.from_bytes(digest[:8], 'big')
+    second = int.from_bytes(digest[8:16], 'big') | 1
+    size = settings.TOKEN_BLACKLIST_BLOOM_BITS
+    return [(first + i * second) % size for i in range(settings.TOKEN_BLACKLIST_BLOOM_HASHES)]
+
+
+def _expiry_day(expires_at):
+    return expires_at.astimezone(dt_timezone.utc).date()
+
+
+def _day_end(day):
+    """When a day's filter can be dropped: a day after its last token expired"""
+    return datetime.combine(day + timedelta(days=2), time.min, tzinfo=dt_timezone.utc)
+
+
+def _add(pipe, jti, expires_at):
+    day = _expiry_day(expires_at)
+    ttl = int((expires_at - datetime.now(dt_timezone.utc)).total_seconds())
+    if ttl <= 0:
+        return
+    key = _bloom_key(day)
+    for bit in _bits(jti):
+        pipe.setbit(key, bit, 1)
+    pipe.expireat(key, _day_end(day))
+    pipe.set(_jti_key(jti), 1, ex=ttl)
+
+
+def _mark_for_resync(day):
+    # An upsert rather than ignore_conflicts: a resync that read marked_at
+    # before this token was blacklisted must not clear the marker
+    BlacklistResyncDay.objects.bulk_create(
+        [BlacklistResyncDay(day=day)],
+        update_conflicts=True,
+        unique_fields=['day'],
+        update_fields=['marked_at'],
+    )
+
+
+def add(jti, expires_at):
+    """
+    Mirror a blacklisted token to Redis, or mark its day for a resync.
+
+    Database errors propagate so that the blacklisting fails with them.
+    """
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        _add(pipe, jti, expires_at)
+        pipe.execute()
+    except Exception:
+        # The day's filter no longer matches the database: stop trusting it
+        # until it is reloaded, even if Redis has recovered by the next lookup
+        logger.exception('Could not mirror blacklisted token %s to Redis', jti)
+        _mark_for_resync(_expiry_day(expires_at))
+
+
+def lookup(jti, exp):
+    """
+    Blacklist membership from Redis: True or False, or None when only the
+    database can tell.
+    """
+    day = _expiry_day(datetime_from_epoch(exp))
+    key = _bloom_key(day)
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.getbit(key, _sentinel_bit())
+        for bit in _bits(jti):
+            pipe.getbit(key, bit)
+        pipe.exists(_jti_key(jti))
+        synced, *bits, exact = pipe.execute()
+    except Exception:
+        logger.warning('Token blacklist unavailable in Redis, checking the database', exc_info=True)
+        return None
+
+    if not synced:
+        return None
+    if exact:
+        return True
+    if all(bits):
+        # A Bloom false positive, or an exact key lost to eviction
+        return None
+    if BlacklistResyncDay.objects.filter(day=day).exists():
+        # The filter may be missing a token blacklisted while Redis was down
+        return None
+    return False
+
+
+def is_synced(day):
+    """Whether the filter for tokens expiring on `day` is complete"""
+    return bool(get_redis().getbit(_bloom_key(day), _sentinel_bit()))
+
+
+def sync_day(day):
+    """Load the tokens blacklisted until `day` into its filter and mark it complete"""
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    tokens = BlacklistedToken.objects.filter(
+        token__expires_at__gte=start, token__expires_at__lt=start + timedelta(days=1)
+    ).values_list('token__jti', 'token__expires_at').order_by()
+
+    redis_client = get_redis()
+    count = 0
+    pipe = redis_client.pipeline(transaction=False)
+    for jti, expires_at in tokens.iterator(chunk_size=SYNC_BATCH_SIZE):
+        _add(pipe, jti, expires_at)
+        count += 1
+        if count % SYNC_BATCH_SIZE == 0:
+            pipe.execute()
+    key = _bloom_key(day)
+    pipe.setbit(key, _sentinel_bit(), 1)
+    pipe.expireat(key, _day_end(day))
+    pipe.execute()
+    return count
+
+
+def resync_day(marker):
+    """
+    Reload the filter of a day marked for a resync, then clear the marker
+    unless a token was marked again while the filter was reloading
+    """
+    get_redis().delete(_bloom_key(marker.day))
+    count = sync_day(marker.day)
+    BlacklistResyncDay.objects.filter(day=marker.day, marked_at__lte=marker.marked_at).delete()
+    return count
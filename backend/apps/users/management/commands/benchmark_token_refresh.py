@@ -0,0 +1,126 @@
+"""
+Management command to benchmark token refresh against a large token blacklist
+"""
+
+import random
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer as DatabaseTokenRefreshSerializer
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from apps.users.models import User
+from apps.users.serializers import TokenRefreshSerializer
+from apps.users.tasks import sync_token_blacklist
+from apps.users.tokens import RefreshToken
+
+BATCH_SIZE = 10000
+
+
+class Rollback(Exception):
+    """Raised to discard the benchmark data"""
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks refresh token rotation latency with many historical tokens'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tokens', type=int, default=10000000, help='Historical outstanding tokens')
+        parser.add_argument('--blacklisted', type=float, default=0.9, help='Share of historical tokens blacklisted')
+        parser.add_argument('--history-days', type=int, default=90, help='Days of expired tokens to generate')
+        parser.add_argument('--runs', type=int, default=200, help='Timed refreshes per serializer')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the generated data')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        user = User.objects.create_user(
+            email=f'benchmark-{uuid.uuid4().hex[:12]}@invoiceflow.local',
+            first_name='Benchmark',
+            last_name='User',
+        )
+
+        self.stdout.write(f"Generating {options['tokens']} tokens...")
+        started = time.perf_counter()
+        self.generate(user, rng, options['tokens'], options['blacklisted'], options['history_days'])
+        self.stdout.write(self.style.SUCCESS(f' Generated tokens in {time.perf_counter() - started:.1f}s'))
+
+        started = time.perf_counter()
+        sync_token_blacklist()
+        self.stdout.write(f' Synced the Redis blacklist in {time.perf_counter() - started:.1f}s')
+
+        for label, serializer_class in [
+            ('database', DatabaseTokenRefreshSerializer),
+            ('redis', TokenRefreshSerializer),
+        ]:
+            self.measure(label, serializer_class, user, options['runs'])
+
+        # A rotated token must still be refused
+        token = str(RefreshToken.for_user(user))
+        TokenRefreshSerializer(data={'refresh': token}).is_valid(raise_exception=True)
+        try:
+            TokenRefreshSerializer(data={'refresh': token}).is_valid(raise_exception=True)
+        except TokenError:
+            self.stdout.write(self.style.SUCCESS('Rotated refresh token is rejected'))
+        else:
+            raise CommandError('Rotated refresh token was accepted twice')
+
+    def measure(self, label, serializer_class, user, runs):
+        # Tokens are issued up front so only the refresh itself is timed
+        tokens = [str(RefreshToken.for_user(user)) for _ in range(runs + 1)]
+        serializer_class(data={'refresh': tokens.pop()}).is_valid(raise_exception=True)
+
+        timings = []
+        query_counts = []
+        for token in tokens:
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                serializer_class(data={'refresh': token}).is_valid(raise_exception=True)
+                timings.append((time.perf_counter() - started) * 1000)
+            query_counts.append(len(queries))
+
+        percentiles = statistics.quantiles(timings, n=100)
+        self.stdout.write(
+            f'{label:<9} runs={runs}  p50={percentiles[49]:.2f}ms  p95={percentiles[94]:.2f}ms  '
+            f'p99={percentiles[98]:.2f}ms  queries={statistics.mean(query_counts):.1f}  db={connection.vendor}'
+        )
+
+    def generate(self, user, rng, count, blacklisted_share, history_days):
+        """Bulk insert outstanding tokens expiring over the history and the refresh lifetime"""
+        now = timezone.now()
+        lifetime_seconds = int(settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME'].total_seconds())
+        history_seconds = history_days * 86400
+
+        for offset in range(0, count, BATCH_SIZE):
+            size = min(BATCH_SIZE, count - offset)
+            outstanding = OutstandingToken.objects.bulk_create([
+                OutstandingToken(
+                    user=user,
+                    jti=uuid.UUID(int=rng.getrandbits(128)).hex,
+                    token='',
+                    expires_at=now + timedelta(seconds=rng.randint(-history_seconds, lifetime_seconds)),
+                )
+                for _ in range(size)
+            ])
+            BlacklistedToken.objects.bulk_create([
+                BlacklistedToken(token=token)
+                for token in outstanding
+                if rng.random() < blacklisted_share
+            ])
+            if (offset // BATCH_SIZE) % 50 == 49:
+                self.stdout.write(f' {offset + size} tokens')
@@ -0,0 +1,434 @@
+"""
+Management command to generate a large synthetic dataset for benchmarking
+"""
+
+import csv
+import io
+import multiprocessing
+import random
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from apps.clients.models import Client
+from apps.expenses.models import Expense
+from apps.invoices.models import Invoice, InvoiceItem
+from apps.payments.models import Payment
+from apps.reports.client_metrics import rebuild_client_metrics
+from apps.reports.models import (
+    ClientMetricsDirty,
+    ClientPaymentMetrics,
+    DailyExpenseCategoryRollup,
+    DailyRollup,
+    RollupDirtyDay,
+)
+from apps.reports.rollups import rebuild_rollups
+from apps.users.models import User
+
+EMAIL_DOMAIN = 'dataset.invoiceflow.local'
+
+# Rows per user at --scale 1
+CLIENTS_PER_SCALE = 25
+INVOICES_PER_SCALE = 500
+EXPENSES_PER_SCALE = 250
+
+HISTORY_DAYS = 730
+COPY_NULL = '\\N'
+
+FIRST_NAMES = ['Ada', 'Ben', 'Chloe', 'Dev', 'Elena', 'Farid', 'Grace', 'Hugo', 'Ines', 'Jonas', 'Kira', 'Liam']
+LAST_NAMES = ['Adams', 'Brown', 'Chen', 'Dubois', 'Evans', 'Fischer', 'Garcia', 'Hansen', 'Ito', 'Jones', 'Khan']
+COMPANY_WORDS = ['Acme', 'Blue', 'Cedar', 'Delta', 'Ember', 'Falcon', 'Granite', 'Harbor', 'Iris', 'Juniper', 'Kite']
+COMPANY_SUFFIXES = ['Ltd', 'Inc', 'GmbH', 'Labs', 'Studio', 'Partners', 'Group']
+SERVICES = ['Consulting', 'Design', 'Development', 'Hosting', 'Support', 'Training', 'Audit', 'Copywriting']
+TERMS_DAYS = [14, 30, 30, 30, 45, 60]
+TAX_RATES = [Decimal('0.00'), Decimal('5.00'), Decimal('10.00'), Decimal('20.00')]
+PAYMENT_METHODS = ['BANK_TRANSFER', 'BANK_TRANSFER', 'CREDIT_CARD', 'PAYPAL', 'CHECK']
+EXPENSE_VENDORS = {
+    'SOFTWARE': ['GitHub', 'Figma', 'Notion', 'Adobe'],
+    'TRAVEL': ['Delta Air Lines', 'Uber', 'Marriott'],
+    'MEALS': ['Starbucks', 'Chipotle', 'Local Bistro'],
+    'OFFICE_SUPPLIES': ['Staples', 'Amazon'],
+    'EQUIPMENT': ['Apple', 'Dell'],
+    'MARKETING': ['Google Ads', 'LinkedIn'],
+    'UTILITIES': ['Comcast', 'PG&E'],
+    'PROFESSIONAL_SERVICES': ['LegalZoom', 'Bench Accounting'],
+}
+
+
+def _rng(seed, *key):
+    """Independent, reproducible random stream for one part of the dataset"""
+    return random.Random(':'.join(str(part) for part in (seed, *key)))
+
+
+def _uuid(rng):
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def _money(rng, low, high):
+    return Decimal(rng.randint(low, high)) / 100
+
+
+def _at(day, rng):
+    return datetime.combine(day, datetime.min.time(), tzinfo=dt_timezone.utc) + timedelta(
+        seconds=rng.randint(8 * 3600, 18 * 3600)
+    )
+
+
+def _user(seed, user_index, password):
+    rng = _rng(seed, 'user', user_index)
+    return User(
+        id=_uuid(rng),
+        email=f'gen-{user_index:05d}@{EMAIL_DOMAIN}',
+        password=password,
+        first_name=rng.choice(FIRST_NAMES),
+        last_name=rng.choice(LAST_NAMES),
+        business_name=f'{rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_SUFFIXES)}',
+        tax_rate=rng.choice(TAX_RATES),
+    )
+
+
+def _clients(seed, user_index, user_id, count):
+    """
+    A user's clients, with each client's share of invoices and mean payment
+    delay. Every task rebuilds the same list, so ids never need a query.
+    """
+    rng = _rng(seed, 'clients', user_index)
+    clients, weights, delays = [], [], []
+    for index in range(count):
+        company = f'{rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_SUFFIXES)}'
+        clients.append(Client(
+            id=_uuid(rng),
+            user_id=user_id,
+            name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            email=f'billing{index}@client{index}.example.com',
+            company_name=company,
+            address=f'{rng.randint(1, 999)} Market Street',
+            phone=f'+1-555-{rng.randint(0, 9999):04d}',
+        ))
+        # A few large clients account for most invoices
+        weights.append(1 / (index + 1))
+        # Most clients pay around the due date, some are chronically late
+        delays.append(rng.choice([-5, 0, 0, 3, 10, 25]))
+    return clients, weights, delays
+
+
+def _invoices(seed, user_index, user, start, count, clients_per_user, end_date):
+    """Invoices `start`..`start + count` of a user, with their items and payments"""
+    clients, weights, delays = _clients(seed, user_index, user.pk, clients_per_user)
+    client_indexes = range(len(clients))
+    cum_weights = [sum(weights[:index + 1]) for index in client_indexes]
+    one_cent = Decimal('0.01')
+
+    invoices, items, payments = [], [], []
+    for number in range(start, start + count):
+        # Seeded per invoice, so batch size and worker count do not change the data
+        rng = _rng(seed, 'invoice', user_index, number)
+        client_index = rng.choices(client_indexes, cum_weights=cum_weights)[0]
+        issue_date = end_date - timedelta(days=rng.randint(0, HISTORY_DAYS))
+        terms = rng.choice(TERMS_DAYS)
+        due_date = issue_date + timedelta(days=terms)
+
+        invoice = Invoice(
+            id=_uuid(rng),
+            user_id=user.pk,
+            client_id=clients[client_index].pk,
+            invoice_number=f'GEN-{user_index:05d}-{number:07d}',
+            issue_date=issue_date,
+            due_date=due_date,
+            terms=f'Net {terms}',
+        )
+
+        subtotal = Decimal('0.00')
+        for order in range(rng.randint(1, 5)):
+            quantity = Decimal(rng.choice([1, 1, 1, 2, 5, 10, 20]))
+            unit_price = _money(rng, 2000, 250000)
+            amount = quantity * unit_price
+            subtotal += amount
+            items.append(InvoiceItem(
+                id=_uuid(rng), invoice_id=invoice.pk, description=rng.choice(SERVICES),
+                quantity=quantity, unit_price=unit_price, amount=amount, order=order,
+            ))
+        invoice.subtotal = subtotal
+        invoice.tax_amount = (subtotal * user.tax_rate / 100).quantize(one_cent)
+        invoice.total_amount = invoice.subtotal + invoice.tax_amount
+
+        if rng.random() < 0.03:
+            invoice.status = 'CANCELLED'
+        elif issue_date > end_date - timedelta(days=7) and rng.random() < 0.5:
+            invoice.status = 'DRAFT'
+        else:
+            invoice.sent_at = _at(issue_date, rng)
+            settle_days = max(0, round(rng.gauss(terms + delays[client_index], 7)))
+            paid_on = issue_date + timedelta(days=settle_days)
+            if paid_on <= end_date:
+                invoice.status = 'PAID'
+                invoice.paid_at = _at(paid_on, rng)
+                instalments = [invoice.total_amount]
+                if rng.random() < 0.2:
+                    first = (invoice.total_amount * Decimal(rng.uniform(0.2, 0.6))).quantize(one_cent)
+                    instalments = [first, invoice.total_amount - first]
+                for index, amount in enumerate(instalments):
+                    payment_date = paid_on - timedelta(days=7 * (len(instalments) - 1 - index))
+                    payments.append(Payment(
+                        id=_uuid(rng), invoice_id=invoice.pk, amount=amount,
+                        payment_date=max(payment_date, issue_date), payment_method=rng.choice(PAYMENT_METHODS),
+                        transaction_id=f'TX-{invoice.invoice_number}-{index}',
+                    ))
+            else:
+                invoice.status = 'OVERDUE' if due_date < end_date else 'SENT'
+                if rng.random() < 0.25:
+                    payments.append(Payment(
+                        id=_uuid(rng), invoice_id=invoice.pk,
+                        amount=(invoice.total_amount * Decimal('0.3')).quantize(one_cent),
+                        payment_date=issue_date + timedelta(days=rng.randint(0, (end_date - issue_date).days)),
+                        payment_method=rng.choice(PAYMENT_METHODS),
+                        transaction_id=f'TX-{invoice.invoice_number}-P',
+                    ))
+        invoices.append(invoice)
+    return invoices, items, payments
+
+
+def _expenses(seed, user_index, user_id, start, count, end_date):
+    categories = list(EXPENSE_VENDORS)
+    expenses = []
+    for number in range(start, start + count):
+        rng = _rng(seed, 'expense', user_index, number)
+        category = rng.choice(categories)
+        expenses.append(Expense(
+            id=_uuid(rng),
+            user_id=user_id,
+            description=f'{category.replace("_", " ").title()} expense',
+            amount=Decimal(round(rng.lognormvariate(4, 1.1), 2)).quantize(Decimal('0.01')) + Decimal('1.00'),
+            category=category,
+            expense_date=end_date - timedelta(days=rng.randint(0, HISTORY_DAYS)),
+            vendor=rng.choice(EXPENSE_VENDORS[category]),
+            tax_deductible=rng.random() < 0.85,
+        ))
+    return expenses
+
+
+def _copy(model, objects):
+    """Write unsaved instances with PostgreSQL COPY, filling auto_now fields as save() would"""
+    fields = model._meta.concrete_fields
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for obj in objects:
+        row = []
+        for field in fields:
+            value = field.get_db_prep_save(field.pre_save(obj, True), connection)
+            row.append(COPY_NULL if value is None else value)
+        writer.writerow(row)
+    buffer.seek(0)
+
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.cursor.copy_expert(
+            f"COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) "
+            f"FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+            buffer
+        )
+
+
+def _write(method, model, objects):
+    if not objects:
+        return
+    if method == 'copy':
+        _copy(model, objects)
+    else:
+        model.objects.bulk_create(objects, batch_size=2000)
+
+
+def run_task(task):
+    """Generate and write one unit of work; runs in a worker process"""
+    kind, options, user_index, *args = task
+    seed, method, end_date = options['seed'], options['method'], options['end_date']
+    user = _user(seed, user_index, '')
+    clients_per_user = CLIENTS_PER_SCALE * options['scale']
+
+    if kind == 'derived':
+        # Derived tables that signals would have kept up to date
+        rebuild_rollups(user.pk)
+        rebuild_client_metrics(user.pk)
+        return {}
+
+    with transaction.atomic():
+        if kind == 'clients':
+            clients, _, _ = _clients(seed, user_index, user.pk, clients_per_user)
+            _write(method, Client, clients)
+            return {'clients': len(clients)}
+
+        if kind == 'invoices':
+            start, count = args
+            invoices, items, payments = _invoices(seed, user_index, user, start, count, clients_per_user, end_date)
+            _write(method, Invoice, invoices)
+            _write(method, InvoiceItem, items)
+            _write(method, Payment, payments)
+            return {'invoices': len(invoices), 'invoice items': len(items), 'payments': len(payments)}
+
+        if kind == 'expenses':
+            start, count = args
+            expenses = _expenses(seed, user_index, user.pk, start, count, end_date)
+            _write(method, Expense, expenses)
+            return {'expenses': len(expenses)}
+
+    raise ValueError(f'Unknown task {kind}')
+
+
+def _chunks(total, size):
+    for start in range(0, total, size):
+        yield start, min(size, total - start)
+
+
+def _clear(users):
+    """
+    Delete `users` and everything generated for them.
+
+    Rows are deleted with one DELETE statement per table, in dependency
+    order, without loading them or sending delete signals: the rollups and
+    metrics those signals would mark dirty are deleted here as well. Only
+    the users themselves go through the ORM's cascade, which by then finds
+    nothing left to load.
+    """
+    querysets = [
+        Payment.objects.filter(invoice__user__in=users),
+        InvoiceItem.objects.filter(invoice__user__in=users),
+        ClientMetricsDirty.objects.filter(client__user__in=users),
+        ClientPaymentMetrics.objects.filter(user__in=users),
+        Invoice.objects.filter(user__in=users),
+        Client.objects.filter(user__in=users),
+        Expense.objects.filter(user__in=users),
+        RollupDirtyDay.objects.filter(user__in=users),
+        DailyExpenseCategoryRollup.objects.filter(user__in=users),
+        DailyRollup.objects.filter(user__in=users),
+    ]
+    with transaction.atomic():
+        for queryset in querysets:
+            queryset._raw_delete(queryset.db)
+        users.delete()
+
+
+class Command(BaseCommand):
+    help = 'Generates a large, reproducible synthetic dataset of users and their invoicing history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Users to generate')
+        parser.add_argument(
+            '--scale', type=int, default=1,
+            help=f'Per-user volume: {CLIENTS_PER_SCALE} clients, {INVOICES_PER_SCALE} invoices '
+                 f'and {EXPENSES_PER_SCALE} expenses per unit'
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Random seed; the same seed generates the same rows')
+        parser.add_argument('--end-date', type=datetime.fromisoformat,
+                            help='Last day of generated history (default: today)')
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                            help='Worker processes (SQLite always uses one)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Invoices or expenses per unit of work')
+        parser.add_argument('--method', choices=['auto', 'copy', 'bulk'], default='auto',
+                            help='COPY on PostgreSQL, bulk_create elsewhere')
+        parser.add_argument('--password', default='dataset-password', help='Password of every generated user')
+        parser.add_argument('--clear', action='store_true', help='Delete previously generated users first')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['scale'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--users, --scale and --batch-size must be positive')
+
+        method = options['method']
+        if method == 'auto':
+            method = 'copy' if connection.vendor == 'postgresql' else 'bulk'
+        elif method == 'copy' and connection.vendor != 'postgresql':
+            raise CommandError('--method copy requires PostgreSQL')
+
+        workers = max(1, options['workers'])
+        if connection.vendor == 'sqlite' and workers > 1:
+            self.stdout.write('SQLite allows a single writer, using one worker')
+            workers = 1
+        if workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            self.stdout.write('Worker processes need fork(), using one worker')
+            workers = 1
+
+        generated = User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}')
+        if options['clear']:
+            self.stdout.write('Deleting previously generated users...')
+            _clear(generated)
+        elif generated.exists():
+            raise CommandError('Generated users already exist, rerun with --clear to replace them')
+
+        task_options = {
+            'seed': options['seed'],
+            'scale': options['scale'],
+            'method': method,
+            'end_date': options['end_date'].date() if options['end_date'] else timezone.localdate(),
+        }
+        self.stdout.write(
+            f"Generating {options['users']} users at scale {options['scale']} "
+            f"(seed={options['seed']}, method={method}, workers={workers}, db={connection.vendor})"
+        )
+
+        started = time.perf_counter()
+        password = make_password(options['password'])
+        User.objects.bulk_create([_user(options['seed'], index, password) for index in range(options['users'])])
+
+        users = range(options['users'])
+        invoices = INVOICES_PER_SCALE * options['scale']
+        expenses = EXPENSES_PER_SCALE * options['scale']
+        phases = [
+            ('clients', [('clients', task_options, index) for index in users]),
+            ('invoices and expenses', [
+                ('invoices', task_options, index, *chunk)
+                for index in users
+                for chunk in _chunks(invoices, options['batch_size'])
+            ] + [
+                ('expenses', task_options, index, *chunk)
+                for index in users
+                for chunk in _chunks(expenses, options['batch_size'])
+            ]),
+            ('rollups and client metrics', [('derived', task_options, index) for index in users]),
+        ]
+
+        totals = Counter({'users': options['users']})
+        for label, tasks in phases:
+            self.stdout.write(f'Writing {label} ({len(tasks)} tasks)...')
+            totals += self.run_phase(tasks, workers, totals, started)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Generated {sum(totals.values()):,} rows in {elapsed:.1f}s'))
+        for name, count in totals.items():
+            self.stdout.write(f'  {name:<14} {count:>12,}  {count / elapsed:>10,.0f} rows/s')
+
+    def run_phase(self, tasks, workers, totals, started):
+        """Run tasks in worker processes and report progress and throughput"""
+        counts = Counter()
+        last_report = 0
+
+        if workers == 1:
+            results = map(run_task, tasks)
+            pool = None
+        else:
+            # Forked workers must open their own connections
+            connections.close_all()
+            pool = multiprocessing.get_context('fork').Pool(workers)
+            results = pool.imap_unordered(run_task, tasks)
+
+        try:
+            for done, result in enumerate(results, start=1):
+                counts.update(result)
+                now = time.perf_counter()
+                if now - last_report >= 1 or done == len(tasks):
+                    last_report = now
+                    rows = sum((totals + counts).values())
+                    self.stdout.write(
+                        f'  {done}/{len(tasks)} tasks  {rows:,} rows  '
+                        f'{rows / (now - started):,.0f} rows/s  {now - started:.1f}s'
+                    )
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return counts
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.6 on 2026-10-19 09:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlacklistResyncDay',
+            fields=[
+                ('day', models.DateField(primary_key=True, serialize=False)),
+                ('marked_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Blacklist Resync Day',
+                'verbose_name_plural': 'Blacklist Resync Days',
+                'ordering': ['marked_at'],
+            },
+        ),
+    ]
@@ -91,6 +91,22 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        """Override save to drop the cached copy used for authentication"""
+        from .authentication import invalidate_cached_user
+
+        super().save(*args, **kwargs)
+        invalidate_cached_user(self.pk)
+
+    def delete(self, *args, **kwargs):
+        """Override delete to drop the cached copy used for authentication"""
+        from .authentication import invalidate_cached_user
+
+        user_id = self.pk
+        result = super().delete(*args, **kwargs)
+        invalidate_cached_user(user_id)
+        return result
+
     def get_full_name(self):
         """Return the user's full name"""
         return f"{self.first_name} {self.last_name}".strip()
@@ -104,3 +120,18 @@ class User(AbstractBaseUser, PermissionsMixin):
         self.email_verified = True
         self.email_verified_at = timezone.now()
         self.save(update_fields=['email_verified', 'email_verified_at'])
+
+
+class BlacklistResyncDay(models.Model):
+    """A day whose Redis blacklist filter missed a token and must be reloaded"""
+
+    day = models.DateField(primary_key=True)
+    marked_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Blacklist Resync Day'
+        verbose_name_plural = 'Blacklist Resync Days'
+        ordering = ['marked_at']
+
+    def __str__(self):
+        return str(self.day)
@@ -3,8 +3,10 @@ Serializers for User authentication and profile
 """
 
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer as BaseTokenRefreshSerializer
 from django.contrib.auth.password_validation import validate_password
 from .models import User
+from .tokens import RefreshToken
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -100,3 +102,9 @@ class ChangePasswordSerializer(serializers.Serializer):
         user.set_password(self.validated_data['new_password'])
         user.save()
         return user
+
+
+class TokenRefreshSerializer(BaseTokenRefreshSerializer):
+    """Refresh serializer checking the blacklist through Redis"""
+
+    token_class = RefreshToken
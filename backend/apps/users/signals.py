@@ -0,0 +1,17 @@
+"""
+Signal handlers for user authentication
+"""
+
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from . import blacklist
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def mirror_blacklisted_token(sender, instance, created, raw=False, **kwargs):
+    # Mirrored right away rather than on commit, so a replayed token is
+    # refused even before the rotation commits
+    if created and not raw:
+        blacklist.add(instance.token.jti, instance.token.expires_at)
@@ -0,0 +1,62 @@
+"""
+Celery tasks for users
+"""
+
+import logging
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+from . import blacklist
+from .models import BlacklistResyncDay
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def sync_token_blacklist():
+    """
+    Reload the Redis blacklist filters marked for a resync, then load the
+    filter of every day a live refresh token can expire on
+    """
+    today = timezone.now().date()
+    # Past days' tokens have expired, so their filters are no longer read
+    BlacklistResyncDay.objects.filter(day__lt=today).delete()
+    for marker in BlacklistResyncDay.objects.all():
+        try:
+            count = blacklist.resync_day(marker)
+            logger.info('Resynced %d blacklisted tokens expiring on %s', count, marker.day)
+        except Exception:
+            logger.exception('Could not resync the token blacklist for %s', marker.day)
+
+    lifetime = settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME']
+    for offset in range(lifetime.days + 2):
+        day = today + timedelta(days=offset)
+        try:
+            if not blacklist.is_synced(day):
+                count = blacklist.sync_day(day)
+                logger.info('Synced %d blacklisted tokens expiring on %s', count, day)
+        except Exception:
+            logger.exception('Could not sync the token blacklist for %s', day)
+
+
+@shared_task(ignore_result=True)
+def prune_expired_tokens():
+    """Delete expired outstanding and blacklisted tokens, a chunk per statement"""
+    now = timezone.now()
+    chunk = settings.TOKEN_BLACKLIST_PRUNE_CHUNK
+    pruned = 0
+    while True:
+        ids = list(
+            OutstandingToken.objects.filter(expires_at__lte=now).order_by('id').values_list('id', flat=True)[:chunk]
+        )
+        if not ids:
+            break
+        # Blacklist rows cascade in a single DELETE since no delete signals are connected
+        OutstandingToken.objects.filter(id__in=ids).delete()
+        pruned += len(ids)
+    logger.info('Pruned %d expired tokens', pruned)
+    return pruned
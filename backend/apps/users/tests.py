@@ -1,3 +1,303 @@
-from django.test import TestCase
+"""
+Tests for the Redis token blacklist mirror, the cached authentication user
+and query budget tests for the authentication API
+"""
 
-# Create your tests here.
+import logging
+from io import StringIO
+from unittest import mock
+
+import fakeredis
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.exceptions import TokenError
+
+from apps.clients.models import Client
+from apps.expenses.models import Expense
+from apps.invoices.models import Invoice
+from apps.monitoring.testing import PASSWORD, TEST_CACHES, QueryBudgetTestCase
+from apps.payments.models import Payment
+from apps.reports.models import ClientPaymentMetrics, DailyRollup
+from apps.users import blacklist
+from apps.users.models import BlacklistResyncDay, User
+from apps.users.tasks import sync_token_blacklist
+from apps.users.tokens import RefreshToken
+from invoiceflow import throttling
+
+
+class BrokenRedis:
+    """Redis client whose every command fails, as when Redis is unreachable"""
+
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError('redis unavailable')
+        return fail
+
+
+class TokenBlacklistMirrorTests(TestCase):
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch.object(blacklist, 'get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(
+            email='blacklist@example.com', password=PASSWORD, first_name='Black', last_name='List'
+        )
+        self.token = RefreshToken.for_user(self.user)
+        self.day = blacklist._expiry_day(self.token.current_time + self.token.lifetime)
+        blacklist.sync_day(self.day)
+
+    def lookup(self, token=None):
+        token = token or self.token
+        return blacklist.lookup(token['jti'], token['exp'])
+
+    def assertRefused(self, token=None):
+        with self.assertRaises(TokenError):
+            RefreshToken(str(token or self.token))
+
+    def test_token_never_blacklisted_is_ruled_out(self):
+        self.assertIs(self.lookup(), False)
+        RefreshToken(str(self.token))
+
+    def test_blacklisted_token_is_found(self):
+        self.token.blacklist()
+        self.assertIs(self.lookup(), True)
+        self.assertRefused()
+
+    def test_unsynced_day_falls_back_to_the_database(self):
+        self.redis.flushall()
+        self.assertIsNone(self.lookup())
+
+    def test_evicted_filter_falls_back_to_the_database(self):
+        self.token.blacklist()
+        self.redis.delete(blacklist._bloom_key(self.day))
+        self.assertIsNone(self.lookup())
+        self.assertRefused()
+        sync_token_blacklist()
+        self.assertIs(self.lookup(), True)
+
+    def test_bloom_positive_without_exact_key_falls_back_to_the_database(self):
+        self.token.blacklist()
+        self.redis.delete(blacklist._jti_key(self.token['jti']))
+        self.assertIsNone(self.lookup())
+        self.assertRefused()
+
+    def test_lookup_falls_back_to_the_database_while_redis_is_down(self):
+        self.token.blacklist()
+        with mock.patch.object(blacklist, 'get_redis', return_value=BrokenRedis()):
+            self.assertIsNone(self.lookup())
+            self.assertRefused()
+
+    def test_token_blacklisted_while_redis_is_down_is_refused_after_recovery(self):
+        with mock.patch.object(blacklist, 'get_redis', return_value=BrokenRedis()):
+            self.token.blacklist()
+        self.assertTrue(BlacklistResyncDay.objects.filter(day=self.day).exists())
+
+        # Redis is back with the day's filter still marked complete
+        self.assertTrue(blacklist.is_synced(self.day))
+        self.assertIsNone(self.lookup())
+        self.assertRefused()
+
+        # Other tokens of that day also fall back until the filter is reloaded
+        other = RefreshToken.for_user(self.user)
+        self.assertIsNone(self.lookup(other))
+
+        sync_token_blacklist()
+        self.assertFalse(BlacklistResyncDay.objects.exists())
+        self.assertIs(self.lookup(), True)
+        self.assertIs(self.lookup(other), False)
+
+    def test_resync_keeps_a_day_marked_again_meanwhile(self):
+        with mock.patch.object(blacklist, 'get_redis', return_value=BrokenRedis()):
+            self.token.blacklist()
+        marker = BlacklistResyncDay.objects.get(day=self.day)
+
+        other = RefreshToken.for_user(self.user)
+        with mock.patch.object(blacklist, 'get_redis', return_value=BrokenRedis()):
+            other.blacklist()
+        self.assertGreater(BlacklistResyncDay.objects.get(day=self.day).marked_at, marker.marked_at)
+
+        blacklist.resync_day(marker)
+        self.assertTrue(BlacklistResyncDay.objects.filter(day=self.day).exists())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CachedUserAuthenticationTests(TestCase):
+    """Authenticated requests read the user from the cache until it is saved or deleted"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Throttles log every failed Redis call
+        logging.disable(logging.ERROR)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@example.com', password='x', first_name='Plain', last_name='User')
+        self.token = RefreshToken.for_user(self.user).access_token
+
+    def get_profile(self):
+        return self.client.get('/api/auth/user/', HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_second_request_reads_the_user_from_the_cache(self):
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.get_profile().status_code, 200)
+        self.assertTrue(any('"users_user"' in query['sql'] for query in first.captured_queries))
+
+        with self.assertNumQueries(0):
+            response = self.get_profile()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['email'], self.user.email)
+
+    def test_deactivated_user_is_refused_on_the_next_request(self):
+        self.assertEqual(self.get_profile().status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.get_profile().status_code, 401)
+
+    def test_deleted_user_is_evicted(self):
+        self.assertEqual(self.get_profile().status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertEqual(self.get_profile().status_code, 401)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LoginThrottleTests(TestCase):
+    """The login throttle's token bucket, keyed by client address"""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        for patcher in (mock.patch.object(throttling, 'get_redis', return_value=self.redis),
+                        mock.patch.dict(throttling._scripts, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def login(self, **extra):
+        return self.client.post('/api/auth/login/', {'email': 'nobody@example.com', 'password': 'wrong'},
+                                content_type='application/json', **extra)
+
+    def spend_budget(self, **extra):
+        for _ in range(10):
+            self.assertEqual(self.login(**extra).status_code, 401)
+
+    def test_burst_is_limited(self):
+        self.spend_budget()
+        response = self.login()
+        self.assertEqual(response.status_code, 429)
+        # A token refills every six seconds
+        self.assertIn(int(response['Retry-After']), range(1, 7))
+
+    def test_forwarded_for_from_the_client_is_ignored(self):
+        self.spend_budget(HTTP_X_FORWARDED_FOR='198.51.100.1')
+        self.assertEqual(self.login(HTTP_X_FORWARDED_FOR='203.0.113.7').status_code, 429)
+        self.assertEqual(self.login().status_code, 429)
+
+    def test_clients_have_separate_buckets(self):
+        self.spend_budget()
+        self.assertEqual(self.login(REMOTE_ADDR='198.51.100.2').status_code, 401)
+
+    def test_forwarded_for_from_a_trusted_proxy(self):
+        rest_framework = {**throttling.settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            self.spend_budget(HTTP_X_FORWARDED_FOR='203.0.113.7, 198.51.100.1')
+            # Entries before the proxy's own are the client's to choose
+            self.assertEqual(self.login(HTTP_X_FORWARDED_FOR='192.0.2.9, 198.51.100.1').status_code, 429)
+            self.assertEqual(self.login(HTTP_X_FORWARDED_FOR='198.51.100.2').status_code, 401)
+
+    def test_fails_open_when_redis_is_down(self):
+        with mock.patch.object(throttling, 'get_redis', return_value=BrokenRedis()), \
+                self.assertLogs('invoiceflow.throttling', 'WARNING'):
+            for _ in range(11):
+                self.assertEqual(self.login().status_code, 401)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class GenerateDatasetTests(TestCase):
+    """Generated datasets are replaced without loading their rows"""
+
+    def generate(self, *args):
+        call_command('generate_dataset', '--users', '2', '--scale', '1', '--batch-size', '200',
+                     '--workers', '1', *args, stdout=StringIO())
+
+    def test_clear_deletes_generated_rows_without_signals(self):
+        self.generate()
+        kept = User.objects.create_user(email='kept@example.com', password=PASSWORD, first_name='Kept', last_name='User')
+        self.assertTrue(Payment.objects.exists())
+        self.assertTrue(DailyRollup.objects.exists())
+
+        with mock.patch('apps.reports.signals.mark_dirty') as mark_dirty, \
+                mock.patch('apps.reports.signals.mark_client_dirty') as mark_client_dirty, \
+                mock.patch('apps.users.management.commands.generate_dataset.rebuild_rollups'), \
+                mock.patch('apps.users.management.commands.generate_dataset.rebuild_client_metrics'):
+            self.generate('--clear')
+        mark_dirty.assert_not_called()
+        mark_client_dirty.assert_not_called()
+
+        self.assertEqual(User.objects.count(), 3)
+        self.assertTrue(User.objects.filter(pk=kept.pk).exists())
+        self.assertEqual(Client.objects.count(), 50)
+        self.assertEqual(Invoice.objects.count(), 1000)
+        self.assertEqual(Expense.objects.count(), 500)
+        # Derived rows of the deleted users went with them
+        self.assertFalse(DailyRollup.objects.exclude(user__in=User.objects.all()).exists())
+        self.assertFalse(ClientPaymentMetrics.objects.exists())
+
+
+class AuthQueryBudgetTests(QueryBudgetTestCase):
+    """Authentication does not depend on how much data an account holds"""
+
+    def setUp(self):
+        super().setUp()
+        # With Redis reachable, as blacklisting marks days for a resync otherwise
+        patcher = mock.patch.object(blacklist, 'get_redis', return_value=fakeredis.FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_register(self):
+        self.assertBudget('post', '/api/auth/register/', queries=3, size=2 * 1024, status=201, authenticate=False,
+                          data=lambda account: {
+                              'email': f'new-{account.user.pk}@example.com',
+                              'password': PASSWORD,
+                              'password_confirm': PASSWORD,
+                              'first_name': 'New',
+                              'last_name': 'User',
+                          })
+
+    def test_login(self):
+        self.assertBudget('post', '/api/auth/login/', queries=3, size=1024, authenticate=False,
+                          data=lambda account: {'email': account.user.email, 'password': PASSWORD})
+
+    def test_refresh(self):
+        self.assertBudget('post', '/api/auth/refresh/', queries=6, size=1024, authenticate=False,
+                          data=lambda account: {'refresh': str(RefreshToken.for_user(account.user))})
+
+    def test_logout(self):
+        self.assertBudget('post', '/api/auth/logout/', queries=6, size=1024,
+                          data=lambda account: {'refresh_token': str(RefreshToken.for_user(account.user))})
+
+    def test_profile(self):
+        self.assertBudget('get', '/api/auth/user/', queries=0, size=1024)
+
+    def test_update_profile(self):
+        self.assertBudget('patch', '/api/auth/user/', queries=1, size=1024, data={'company_name': 'Renamed'})
+
+    def test_change_password(self):
+        self.assertBudget('post', '/api/auth/change-password/', queries=1, size=1024, data={
+            'old_password': PASSWORD,
+            'new_password': 'changed-Passw0rd!',
+            'new_password_confirm': 'changed-Passw0rd!',
+        })
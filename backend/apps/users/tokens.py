@@ -0,0 +1,21 @@
+"""
+JWT token classes for InvoiceFlow
+"""
+
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken as BaseRefreshToken
+
+from . import blacklist
+
+
+class RefreshToken(BaseRefreshToken):
+    """Refresh token whose blacklist check is answered from Redis when possible"""
+
+    def check_blacklist(self):
+        found = blacklist.lookup(self.payload[api_settings.JTI_CLAIM], self.payload['exp'])
+        if found is None:
+            super().check_blacklist()
+        elif found:
+            raise TokenError(_("Token is blacklisted"))
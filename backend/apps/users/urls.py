@@ -3,9 +3,10 @@ URL configuration for user authentication
 """
 
 from django.urls import path
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
 from .views import (
     UserRegistrationView,
+    LoginView,
     UserProfileView,
     ChangePasswordView,
     LogoutView
@@ -14,7 +15,7 @@ from .views import (
 urlpatterns = [
     # Authentication endpoints
     path('register/', UserRegistrationView.as_view(), name='register'),
-    path('login/', TokenObtainPairView.as_view(), name='login'),
+    path('login/', LoginView.as_view(), name='login'),
     path('refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('logout/', LogoutView.as_view(), name='logout'),
 
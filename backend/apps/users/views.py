@@ -6,8 +6,8 @@ from rest_framework import generics, status, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.tokens import RefreshToken
 from .models import User
+from .tokens import RefreshToken
 from .serializers import (
     UserSerializer,
     UserRegistrationSerializer,
@@ -24,6 +24,7 @@ class UserRegistrationView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserRegistrationSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_scope = 'register'
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -43,6 +44,14 @@ class UserRegistrationView(generics.CreateAPIView):
         }, status=status.HTTP_201_CREATED)
 
 
+class LoginView(TokenObtainPairView):
+    """
+    API endpoint for obtaining a token pair, throttled per client IP
+    POST /api/auth/login/
+    """
+    throttle_scope = 'login'
+
+
 class UserProfileView(generics.RetrieveUpdateAPIView):
     """
     API endpoint to retrieve and update user profile
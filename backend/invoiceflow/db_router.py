@@ -0,0 +1,151 @@
+"""
+Read-replica routing for InvoiceFlow
+
+Each URL in DATABASE_REPLICA_URLS adds a read replica of the `default`
+database. ReplicaRoutingMiddleware marks the requests whose reads may be
+served by a replica:
+
+- GET, HEAD and OPTIONS requests to apps.reports views
+- GET, HEAD and OPTIONS requests to a viewset's list action
+
+Everything else, including Celery tasks and management commands, reads
+from the primary. An eligible request picks one replica at random and
+keeps it for all of its reads, so they see a single snapshot.
+
+Replicas lag behind the primary, so a user who has just written must not
+read from one. A request that writes, whatever its method, reads from the
+primary from then on and pins its user to the primary for
+DATABASE_REPLICA_PIN_SECONDS. Pins are kept in the cache; if it is
+unavailable, requests read from the primary.
+"""
+
+import contextvars
+import logging
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.functional import SimpleLazyObject
+from rest_framework.permissions import SAFE_METHODS
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'db:pinned'
+
+_state = contextvars.ContextVar('db_routing', default=None)
+
+
+def _pin_key(user_id):
+    return f'{KEY_PREFIX}:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Send the user's reads to the primary for DATABASE_REPLICA_PIN_SECONDS"""
+    try:
+        cache.set(_pin_key(user_id), 1, timeout=settings.DATABASE_REPLICA_PIN_SECONDS)
+    except Exception:
+        logger.warning('Could not pin user %s to the primary database', user_id, exc_info=True)
+
+
+def is_pinned(user_id):
+    try:
+        return cache.get(_pin_key(user_id)) is not None
+    except Exception:
+        logger.warning('Replica pins unavailable, reading from the primary database', exc_info=True)
+        return True
+
+
+def _authenticated_user(request):
+    """
+    The user set by DRF authentication, else None. AuthenticationMiddleware's
+    lazy user is not evaluated: loading it would itself be a routed query.
+    """
+    user = request.__dict__.get('user')
+    if user is None or isinstance(user, SimpleLazyObject):
+        return None
+    return user if user.is_authenticated else None
+
+
+def replica_eligible(request, view_func):
+    """Whether the view handling `request` may read from a replica"""
+    if request.method not in SAFE_METHODS:
+        return False
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if view_class is not None and view_class.__module__.startswith('apps.reports.'):
+        return True
+    actions = getattr(view_func, 'actions', None) or {}
+    return actions.get(request.method.lower()) == 'list'
+
+
+class RoutingState:
+    """Routing decisions for one request"""
+
+    def __init__(self, request):
+        self.request = request
+        self.eligible = False
+        self.wrote = False
+        self._replica = None
+        self._decided = False
+
+    def replica(self):
+        """Replica alias for this request's reads, or None for the primary"""
+        if not self.eligible or self.wrote or not settings.DATABASE_REPLICAS:
+            return None
+        if not self._decided:
+            user = _authenticated_user(self.request)
+            if user is None:
+                # Not authenticated yet; the user's own row is read from the primary
+                return None
+            if not is_pinned(user.pk):
+                self._replica = random.choice(settings.DATABASE_REPLICAS)
+            self._decided = True
+        return self._replica
+
+
+class PrimaryReplicaRouter:
+    """Send eligible requests' reads to a replica and all writes to the primary"""
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        return state.replica() if state is not None else None
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the primary's schema through replication
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaRoutingMiddleware:
+    """Route eligible requests' reads to a replica and pin users who write"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = RoutingState(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+
+        if state.wrote and settings.DATABASE_REPLICAS:
+            user = _authenticated_user(request) or getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                pin_to_primary(user.pk)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _state.get().eligible = replica_eligible(request, view_func)
@@ -0,0 +1,23 @@
+"""
+Shared Redis connection for InvoiceFlow
+
+For features that need Redis data structures the Django cache API does not
+expose (bitmaps, sorted sets, scripts). Timeouts are short because every
+caller treats Redis as an accelerator and falls back when it is slow or down.
+"""
+
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+
+
+@lru_cache(maxsize=None)
+def get_redis():
+    """Return a client for REDIS_URL, shared by the whole process"""
+    return redis.Redis.from_url(
+        settings.REDIS_URL,
+        socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        health_check_interval=30,
+    )
@@ -6,6 +6,7 @@ import os
 from pathlib import Path
 from datetime import timedelta
 import dj_database_url
+from celery.schedules import crontab
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,9 +43,12 @@ INSTALLED_APPS = [
     'apps.payments',
     'apps.expenses',
     'apps.reports',
+    'apps.monitoring',
 ]
 
 MIDDLEWARE = [
+    'apps.monitoring.middleware.QueryInstrumentationMiddleware',
+    'invoiceflow.db_router.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -53,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'apps.monitoring.profiling.RequestProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'invoiceflow.urls'
@@ -93,6 +98,18 @@ else:
         }
     }
 
+# Read replicas (invoiceflow.db_router): comma-separated URLs, added as replica1, replica2, ...
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+DATABASE_REPLICAS = [f'replica{number}' for number in range(1, len(DATABASE_REPLICA_URLS) + 1)]
+for alias, url in zip(DATABASE_REPLICAS, DATABASE_REPLICA_URLS):
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600)
+    # Tests read replica queries from the test database
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['invoiceflow.db_router.PrimaryReplicaRouter']
+# Seconds a user who wrote reads from the primary, covering replication lag
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get('DATABASE_REPLICA_PIN_SECONDS', '10'))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -134,6 +151,20 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Chunked receipt uploads
+
+RECEIPT_UPLOAD_TEMP_DIR = os.environ.get('RECEIPT_UPLOAD_TEMP_DIR', str(BASE_DIR / 'uploads'))
+RECEIPT_MAX_UPLOAD_SIZE = int(os.environ.get('RECEIPT_MAX_UPLOAD_SIZE', str(100 * 1024 * 1024)))
+RECEIPT_MAX_CHUNK_SIZE = int(os.environ.get('RECEIPT_MAX_CHUNK_SIZE', str(8 * 1024 * 1024)))
+RECEIPT_UPLOAD_EXPIRY = timedelta(hours=24)
+
+# Background report jobs
+
+# Public base URL of the API, for links in report job emails
+SITE_URL = os.environ.get('SITE_URL', 'http://localhost:8000')
+REPORT_JOB_RESULT_TTL = timedelta(hours=int(os.environ.get('REPORT_JOB_RESULT_TTL_HOURS', '24')))
+REPORT_JOB_TIMEOUT = timedelta(hours=1)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -143,11 +174,27 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'apps.users.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'invoiceflow.throttling.ScopedTokenBucketThrottle',
+    ),
+    # Token bucket budgets per throttle_scope: the whole budget may be spent
+    # in a burst, then it refills evenly over the period
+    'DEFAULT_THROTTLE_RATES': {
+        'login': os.environ.get('THROTTLE_RATE_LOGIN', '10/min'),
+        'register': os.environ.get('THROTTLE_RATE_REGISTER', '5/hour'),
+        'reports': os.environ.get('THROTTLE_RATE_REPORTS', '120/min'),
+        'report_jobs': os.environ.get('THROTTLE_RATE_REPORT_JOBS', '30/hour'),
+        'imports': os.environ.get('THROTTLE_RATE_IMPORTS', '30/hour'),
+    },
+    # Reverse proxies in front of the app: anonymous clients are throttled by
+    # the address the nearest proxy saw, so X-Forwarded-For entries a client
+    # adds itself are ignored. With 0, REMOTE_ADDR is used.
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', '0')),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_FILTER_BACKENDS': (
@@ -176,8 +223,16 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
+    'TOKEN_REFRESH_SERIALIZER': 'apps.users.serializers.TokenRefreshSerializer',
 }
 
+# Blacklisted refresh tokens are mirrored to Redis (apps.users.blacklist):
+# bits per daily Bloom filter and hash functions per token
+TOKEN_BLACKLIST_BLOOM_BITS = 2 ** 23
+TOKEN_BLACKLIST_BLOOM_HASHES = 7
+# Expired tokens deleted per statement by the pruning task
+TOKEN_BLACKLIST_PRUNE_CHUNK = 5000
+
 # CORS Configuration
 
 CORS_ALLOWED_ORIGINS = os.environ.get(
@@ -196,15 +251,164 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+CELERY_BEAT_SCHEDULE = {
+    'purge-stale-receipt-uploads': {
+        'task': 'apps.expenses.tasks.purge_stale_receipt_uploads',
+        'schedule': timedelta(hours=1),
+    },
+    'refresh-report-rollups': {
+        'task': 'apps.reports.tasks.refresh_dirty_rollups',
+        'schedule': timedelta(minutes=1),
+    },
+    'purge-report-jobs': {
+        'task': 'apps.reports.tasks.purge_report_jobs',
+        'schedule': timedelta(hours=1),
+    },
+    'refresh-client-payment-metrics': {
+        'task': 'apps.reports.tasks.update_client_payment_metrics',
+        'schedule': timedelta(minutes=15),
+    },
+    'sync-token-blacklist': {
+        'task': 'apps.users.tasks.sync_token_blacklist',
+        'schedule': timedelta(minutes=10),
+    },
+    'prune-expired-tokens': {
+        'task': 'apps.users.tasks.prune_expired_tokens',
+        'schedule': crontab(hour=3, minute=15),
+    },
+    'rebuild-client-payment-metrics': {
+        'task': 'apps.reports.tasks.update_client_payment_metrics',
+        'schedule': crontab(hour=2, minute=30),
+        'kwargs': {'full': True},
+    },
+}
+
+# Long-running reports get their own workers so they cannot starve other tasks
+CELERY_TASK_ROUTES = {
+    'apps.reports.tasks.run_report_job': {'queue': 'reports'},
+}
+
 # Cache Configuration
 
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/1')
+# Seconds before a direct Redis call (invoiceflow.redis_client) gives up
+REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', '0.25'))
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
-        'LOCATION': os.environ.get('REDIS_URL', 'redis://localhost:6379/1'),
+        'LOCATION': REDIS_URL,
     }
 }
 
+# Requests one user may have in flight per concurrency_scope (invoiceflow.throttling)
+THROTTLE_CONCURRENCY_LIMITS = {
+    'reports': int(os.environ.get('THROTTLE_CONCURRENCY_REPORTS', '2')),
+    'imports': 1,
+}
+# Seconds after which a slot held by a request that never finished is freed
+THROTTLE_CONCURRENCY_LEASE = 120
+
+# Seconds an authenticated user is served from the cache; saves invalidate it sooner
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get('AUTH_USER_CACHE_TIMEOUT', '60'))
+
+# Seconds a cached report response is fresh; writes invalidate it sooner
+REPORT_CACHE_TIMEOUT = int(os.environ.get('REPORT_CACHE_TIMEOUT', '300'))
+# Seconds a response may then be served stale while one request refreshes it
+REPORT_CACHE_STALE_TIMEOUT = int(os.environ.get('REPORT_CACHE_STALE_TIMEOUT', '60'))
+# Maximum seconds a report computation holds the fill lock
+REPORT_CACHE_LOCK_TIMEOUT = 30
+# Seconds a request waits for another request's computation before computing itself
+REPORT_CACHE_LOCK_WAIT = 5.0
+
+# Query Instrumentation (apps.monitoring)
+
+# Identical query shapes per request that are reported as a possible N+1
+QUERY_N_PLUS_ONE_THRESHOLD = int(os.environ.get('QUERY_N_PLUS_ONE_THRESHOLD', '5'))
+# Maximum queries per request, by URL name; views may also set `query_budget`.
+# Budgets are opt-in: views without one, and without QUERY_BUDGET_DEFAULT,
+# are not checked. These leave one query over the budget tests for
+# authenticating the user on a cache miss.
+QUERY_BUDGETS = {
+    'dashboard': 6,
+    'invoice-list': 5,
+}
+QUERY_BUDGET_DEFAULT = None
+# Under DEBUG, fail requests that exceed their budget instead of logging
+QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', '1') == '1'
+
+# On-demand request profiling for staff users (apps.monitoring.profiling)
+
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '1') == '1'
+# Seconds between call stack samples
+PROFILER_SAMPLE_INTERVAL = float(os.environ.get('PROFILER_SAMPLE_INTERVAL', '0.001'))
+# Frames tracemalloc keeps per allocation; allocation sites are grouped by the innermost
+PROFILER_TRACEMALLOC_FRAMES = 1
+# Allocation sites stored per profile
+PROFILER_ALLOCATION_LIMIT = 30
+
+# Prometheus metrics (apps.monitoring.metrics), served at /metrics
+
+# Bearer token scrapers must send; when empty the endpoint is open only with DEBUG
+METRICS_AUTH_TOKEN = os.environ.get('METRICS_AUTH_TOKEN', '')
+# Celery queues whose length is reported; 'celery' is the default queue
+CELERY_METRICS_QUEUES = ['celery'] + sorted({route['queue'] for route in CELERY_TASK_ROUTES.values()})
+# Port on which each Celery worker serves its task metrics, 0 to disable
+CELERY_METRICS_PORT = int(os.environ.get('CELERY_METRICS_PORT', '0'))
+
+# OpenTelemetry tracing (apps.monitoring.tracing)
+
+# 'otlp' to send spans to OTEL_EXPORTER_OTLP_ENDPOINT, 'file' to append
+# them to TRACING_FILE; empty disables tracing
+TRACING_EXPORTER = os.environ.get('TRACING_EXPORTER', '')
+TRACING_FILE = os.environ.get('TRACING_FILE', str(BASE_DIR / 'traces.jsonl'))
+# Fraction of new traces recorded; spans in Celery tasks follow the request's decision
+TRACING_SAMPLE_RATIO = float(os.environ.get('TRACING_SAMPLE_RATIO', '0.05'))
+TRACING_SERVICE_NAME = os.environ.get('TRACING_SERVICE_NAME', 'invoiceflow')
+
+# Slow-query log (apps.monitoring.slow_queries)
+
+# Milliseconds over which a query is logged, aggregated and explained
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', '250'))
+# Minimum time between two plans captured for the same slow query
+SLOW_QUERY_EXPLAIN_INTERVAL = timedelta(hours=1)
+# Seconds EXPLAIN ANALYZE may run before PostgreSQL cancels it
+SLOW_QUERY_EXPLAIN_TIMEOUT = 30
+# Send slow queries' bound parameters through the broker so parameterized
+# statements can be explained too. They may hold personal data and secrets,
+# so leave this off unless the broker is trusted with them.
+SLOW_QUERY_EXPLAIN_PARAMS = os.environ.get('SLOW_QUERY_EXPLAIN_PARAMS', '0') == '1'
+# Captures a process holds while waiting for the broker; more are dropped
+SLOW_QUERY_QUEUE_SIZE = 1000
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'apps.monitoring.logging.JSONFormatter',
+        },
+    },
+    'handlers': {
+        'requests': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'apps.monitoring.requests': {
+            'handlers': ['requests'],
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+        'apps.monitoring.slow_queries': {
+            'handlers': ['requests'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 # Email Configuration
 
 EMAIL_BACKEND = os.environ.get(
@@ -222,6 +426,8 @@ DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'noreply@invoiceflow.c
 
 if not DEBUG:
     SECURE_SSL_REDIRECT = True
+    # Prometheus scrapes over the internal network
+    SECURE_REDIRECT_EXEMPT = [r'^metrics$']
     SESSION_COOKIE_SECURE = True
     CSRF_COOKIE_SECURE = True
     SECURE_BROWSER_XSS_FILTER = True
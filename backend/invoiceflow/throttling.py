@@ -0,0 +1,206 @@
+"""
+Redis-backed request throttling for InvoiceFlow
+
+Views opt in by naming a `throttle_scope`; its budget is the scope's entry
+in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], e.g. '10/min'. Budgets are
+token buckets: a client may burst up to the full budget, after which
+tokens refill evenly over the period. Each check is a single Lua script,
+so concurrent requests across workers cannot overspend a bucket.
+
+Heavy views additionally cap how many requests one user may have in
+flight at once with ConcurrencyLimitMixin, so a single tenant cannot hold
+every worker.
+
+Throttling fails open: if Redis is unavailable, requests are allowed.
+"""
+
+import logging
+import math
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.throttling import BaseThrottle
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'throttle'
+
+# Returns {allowed, milliseconds until enough tokens}
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_per_ms = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * refill_per_ms)
+
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    wait = math.ceil((cost - tokens) / refill_per_ms)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / refill_per_ms))
+return {allowed, wait}
+"""
+
+# Returns 1 if a slot was taken; expired leases are dropped first
+CONCURRENCY_ACQUIRE_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local lease_ms = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + lease_ms, ARGV[3])
+redis.call('PEXPIRE', KEYS[1], lease_ms)
+return 1
+"""
+
+_scripts = {}
+
+
+def _script(source):
+    """Register a Lua script once per process; redis-py falls back to EVAL as needed"""
+    if source not in _scripts:
+        _scripts[source] = get_redis().register_script(source)
+    return _scripts[source]
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """Parse a DRF rate such as '10/min' into (requests, seconds)"""
+    requests, period = rate.split('/')
+    return int(requests), PERIODS[period[0]]
+
+
+def _client_ident(throttle, request):
+    if request.user and request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f'ip:{throttle.get_ident(request)}'
+
+
+class ScopedTokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket per client and `throttle_scope` of the view
+
+    Authenticated clients are identified by user, anonymous ones by IP: the
+    peer address, or with REST_FRAMEWORK['NUM_PROXIES'] set, the address
+    the nearest trusted proxy recorded in X-Forwarded-For. Views without a
+    `throttle_scope` are not throttled.
+    """
+
+    def __init__(self):
+        self.retry_after = None
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if not scope:
+            return True
+
+        rates = settings.REST_FRAMEWORK.get('DEFAULT_THROTTLE_RATES', {})
+        if scope not in rates:
+            raise ImproperlyConfigured(f"No throttle rate set for scope '{scope}'")
+        capacity, period = parse_rate(rates[scope])
+
+        key = f'{KEY_PREFIX}:bucket:{scope}:{_client_ident(self, request)}'
+        try:
+            allowed, wait_ms = _script(TOKEN_BUCKET_SCRIPT)(
+                keys=[key], args=[capacity, capacity / (period * 1000), 1]
+            )
+        except Exception:
+            logger.warning('Throttling unavailable, allowing %s request', scope, exc_info=True)
+            return True
+
+        if allowed:
+            return True
+        self.retry_after = math.ceil(int(wait_ms) / 1000)
+        return False
+
+    def wait(self):
+        return self.retry_after
+
+
+class ConcurrencyThrottle(BaseThrottle):
+    """
+    Cap on a user's requests in flight for the view's `concurrency_scope`
+
+    Slots are leases in a sorted set that expire after
+    THROTTLE_CONCURRENCY_LEASE seconds, so a worker that dies mid-request
+    cannot hold one forever. ConcurrencyLimitMixin releases them.
+    """
+
+    def __init__(self):
+        self.key = None
+        self.token = None
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'concurrency_scope', None)
+        if not scope:
+            return True
+
+        limits = settings.THROTTLE_CONCURRENCY_LIMITS
+        if scope not in limits:
+            raise ImproperlyConfigured(f"No concurrency limit set for scope '{scope}'")
+
+        key = f'{KEY_PREFIX}:concurrency:{scope}:{_client_ident(self, request)}'
+        token = uuid.uuid4().hex
+        try:
+            acquired = _script(CONCURRENCY_ACQUIRE_SCRIPT)(
+                keys=[key], args=[limits[scope], settings.THROTTLE_CONCURRENCY_LEASE * 1000, token]
+            )
+        except Exception:
+            logger.warning('Concurrency limit unavailable, allowing %s request', scope, exc_info=True)
+            return True
+
+        if acquired:
+            self.key, self.token = key, token
+        return bool(acquired)
+
+    def release(self):
+        if self.token is None:
+            return
+        try:
+            get_redis().zrem(self.key, self.token)
+        except Exception:
+            logger.warning('Could not release concurrency slot %s', self.key, exc_info=True)
+        self.key = self.token = None
+
+    def wait(self):
+        # Slots are freed as soon as a request finishes
+        return 1
+
+
+class ConcurrencyLimitMixin:
+    """
+    View mixin that caps each user's concurrent requests
+
+    Set `concurrency_scope` to a key of THROTTLE_CONCURRENCY_LIMITS.
+    """
+    concurrency_scope = None
+
+    def get_throttles(self):
+        self.concurrency_throttle = ConcurrencyThrottle()
+        return super().get_throttles() + [self.concurrency_throttle]
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        throttle = getattr(self, 'concurrency_throttle', None)
+        if throttle is not None:
+            throttle.release()
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -12,13 +12,18 @@ from rest_framework.routers import DefaultRouter
 from apps.clients.views import ClientViewSet
 from apps.invoices.views import InvoiceViewSet
 from apps.payments.views import PaymentViewSet
-from apps.expenses.views import ExpenseViewSet
+from apps.expenses.views import ExpenseViewSet, ExpenseCategoryRuleViewSet, ReceiptUploadViewSet
 from apps.reports.views import (
     DashboardView,
     IncomeReportView,
     ExpenseReportView,
-    ClientReportView
+    ClientReportView,
+    TimeSeriesReportView,
+    CashflowForecastView,
+    ReportCacheStatsView,
+    ReportJobViewSet
 )
+from apps.monitoring.views import metrics_view
 
 # Create router and register viewsets
 router = DefaultRouter()
@@ -26,6 +31,9 @@ router.register(r'clients', ClientViewSet, basename='client')
 router.register(r'invoices', InvoiceViewSet, basename='invoice')
 router.register(r'payments', PaymentViewSet, basename='payment')
 router.register(r'expenses', ExpenseViewSet, basename='expense')
+router.register(r'expense-rules', ExpenseCategoryRuleViewSet, basename='expense-rule')
+router.register(r'receipt-uploads', ReceiptUploadViewSet, basename='receipt-upload')
+router.register(r'reports/jobs', ReportJobViewSet, basename='report-job')
 
 urlpatterns = [
     # Admin
@@ -40,6 +48,12 @@ urlpatterns = [
     path('api/reports/income/', IncomeReportView.as_view(), name='income-report'),
     path('api/reports/expenses/', ExpenseReportView.as_view(), name='expense-report'),
     path('api/reports/clients/', ClientReportView.as_view(), name='client-report'),
+    path('api/reports/timeseries/', TimeSeriesReportView.as_view(), name='timeseries-report'),
+    path('api/reports/cashflow-forecast/', CashflowForecastView.as_view(), name='cashflow-forecast'),
+    path('api/reports/cache-stats/', ReportCacheStatsView.as_view(), name='report-cache-stats'),
+
+    # Prometheus
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 # Serve media files in development